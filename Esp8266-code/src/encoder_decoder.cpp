@@ -20,4 +20,24 @@ float decodeTemp(uint16_t encoded) {
 
 int decodeSensorId(uint16_t encoded) {
 	return encoded >> 13;
+}
+
+// Binary /temp page header: 'T', format version, record count and remaining records, little-endian
+void writeBinaryHeader(uint8_t *out, uint16_t count, uint32_t remain) {
+	out[0] = 'T';
+	out[1] = 1;
+	out[2] = count & 0xFF;
+	out[3] = count >> 8;
+	for (int i = 0; i < 4; i++) {
+		out[4 + i] = (remain >> (8 * i)) & 0xFF;
+	}
+}
+
+// Binary /temp page record: the encoded temperature and sensor id and the age in milliseconds, little-endian
+void writeBinaryRecord(uint8_t *out, uint16_t encoded, uint32_t age) {
+	out[0] = encoded & 0xFF;
+	out[1] = encoded >> 8;
+	for (int i = 0; i < 4; i++) {
+		out[2 + i] = (age >> (8 * i)) & 0xFF;
+	}
 }
\ No newline at end of file
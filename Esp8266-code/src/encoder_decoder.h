@@ -3,10 +3,17 @@
 
 #include <stdint.h>
 
+#define PAGE_HEADER_SIZE 8
+#define PAGE_RECORD_SIZE 6
+
 uint16_t encode(float temp, int sensor_id);
 
 float decodeTemp(uint16_t encoded);
 
 int decodeSensorId(uint16_t encoded);
 
+void writeBinaryHeader(uint8_t *out, uint16_t count, uint32_t remain);
+
+void writeBinaryRecord(uint8_t *out, uint16_t encoded, uint32_t age);
+
 #endif
\ No newline at end of file
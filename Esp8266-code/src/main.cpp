@@ -117,6 +117,7 @@ void handleWebServer() {
   server.on("/temp", []() {
     String sensor_id = server.arg("sensor_id");
     int limit = server.arg("limit").toInt();
+    int skip = server.arg("skip").toInt();
     unsigned long currentMillis = millis();
     unsigned long time_frame = 0;
     bool filterByTime = server.hasArg("time");
@@ -136,8 +137,18 @@ void handleWebServer() {
       limit = 100;
     }
 
+    if (server.arg("format") == "bin") {
+      static uint8_t page[PAGE_HEADER_SIZE + 100 * PAGE_RECORD_SIZE];
+      size_t size = writeBinaryPage(page, limit, skip, currentMillis, filterByTime, time_frame, sensor_id.isEmpty() ? -1 : sensor_id.toInt());
+      server.setContentLength(size);
+      server.send(200, "application/octet-stream", "");
+      server.sendContent((const char*)page, size);
+      return;
+    }
+
     String response = "{\"temperature_data\":[";
     int count = 0;
+    int skipped = 0;
     int totalMatched = 0;
 
     for (int i = 1; i < maxRecords; i++) {
@@ -149,7 +160,10 @@ void handleWebServer() {
 
       if (temperatureData.sensor_id != 0 && isWithinTimeFrame && matchesSensorId && i != 0) {
         totalMatched++;
-        if (count < limit) {
+        // Records of the pages already read, counted by buffer position from the newest
+        if (skipped < skip) {
+          skipped++;
+        } else if (count < limit) {
           if (count > 0) {
             response += ",";
           }
@@ -159,8 +173,8 @@ void handleWebServer() {
       }
     }
 
-    int remainCount = totalMatched - count;
-    response += "],\"remain\":" + String(remainCount) + "}";
+    int remainCount = totalMatched - skipped - count;
+    response += "],\"remain\":" + String(remainCount) + ",\"skip\":" + String(skipped) + "}";
     server.send(200, "application/json", response);
   });
 
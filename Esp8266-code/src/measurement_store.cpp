@@ -88,3 +88,35 @@ SensTempTime getTemp(int index) {
 
     return result;
 }
+
+// Writes the newest matching records after the first skip ones as a binary /temp page into out, which must hold
+// PAGE_HEADER_SIZE + limit * PAGE_RECORD_SIZE bytes. Matches the same records as the JSON page. Returns the page size
+// in bytes.
+size_t writeBinaryPage(uint8_t *out, int limit, int skip, unsigned long currentMillis, bool filterByTime, unsigned long timeFrame, int sensorId) {
+    int count = 0;
+    int skipped = 0;
+    uint32_t totalMatched = 0;
+
+    for (int i = 1; i < buffSize; i++) {
+        int actualIndex = (currentIndex - i + buffSize) % buffSize;
+        uint16_t encoded = buffTempsAndSensors[actualIndex];
+        unsigned long time = buffTimes[actualIndex];
+        int recordSensorId = decodeSensorId(encoded);
+
+        bool isWithinTimeFrame = !filterByTime || time <= timeFrame;
+        bool matchesSensorId = sensorId < 0 || recordSensorId == sensorId;
+
+        if (recordSensorId != 0 && isWithinTimeFrame && matchesSensorId) {
+            totalMatched++;
+            if (skipped < skip) {
+                skipped++;
+            } else if (count < limit) {
+                writeBinaryRecord(out + PAGE_HEADER_SIZE + count * PAGE_RECORD_SIZE, encoded, time != 0 ? currentMillis - time : 0);
+                count++;
+            }
+        }
+    }
+
+    writeBinaryHeader(out, count, totalMatched - skipped - count);
+    return PAGE_HEADER_SIZE + count * PAGE_RECORD_SIZE;
+}
@@ -18,5 +18,6 @@ void setBuff(int16_t *buffTempsAndSensors2, unsigned long *buffTimes2, int buffs
 void initBuff(unsigned int buffsize2);
 void saveTemperature(float temp, unsigned long time, unsigned int sensorId, float maxTempDiff);
 struct SensTempTime getTemp(int index);
+size_t writeBinaryPage(uint8_t *out, int limit, int skip, unsigned long currentMillis, bool filterByTime, unsigned long timeFrame, int sensorId);
 
 #endif
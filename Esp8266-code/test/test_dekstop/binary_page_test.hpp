@@ -0,0 +1,68 @@
+#include <unity.h>
+#include <measurement_store.h>
+#include <stdio.h>
+
+void test_binaryRecord(void) {
+    uint8_t out[PAGE_RECORD_SIZE];
+
+    writeBinaryRecord(out, (uint16_t)0b0011000010101111, 305419896);
+    uint8_t expected[PAGE_RECORD_SIZE] = {0b10101111, 0b00110000, 0x78, 0x56, 0x34, 0x12};
+    TEST_ASSERT_EQUAL_UINT8_ARRAY(expected, out, PAGE_RECORD_SIZE);
+
+    uint8_t header[PAGE_HEADER_SIZE];
+    writeBinaryHeader(header, 100, 6900);
+    uint8_t expectedHeader[PAGE_HEADER_SIZE] = {'T', 1, 100, 0, 0xF4, 0x1A, 0, 0};
+    TEST_ASSERT_EQUAL_UINT8_ARRAY(expectedHeader, header, PAGE_HEADER_SIZE);
+}
+
+uint16_t pageWord(uint8_t *page, int record) {
+    uint8_t *out = page + PAGE_HEADER_SIZE + record * PAGE_RECORD_SIZE;
+    return out[0] | (out[1] << 8);
+}
+
+uint32_t pageAge(uint8_t *page, int record) {
+    uint8_t *out = page + PAGE_HEADER_SIZE + record * PAGE_RECORD_SIZE;
+    return out[2] | (out[3] << 8) | (out[4] << 16) | ((uint32_t)out[5] << 24);
+}
+
+void test_binaryPage(void) {
+    const int records = 6;
+    int16_t buff[records];
+    unsigned long timestamps[records] = {10, 10, 20, 20, 30, 0};
+    float temps[records] = {17.5, -4.2, 18.1, 24.5, 18.3, 0};
+    int sensorIds[records] = {1, 2, 1, 2, 1, 0};
+
+    for (int i = 0; i < records; i++) {
+        buff[i] = encode(temps[i], sensorIds[i]);
+    }
+    setBuff(buff, timestamps, records, 5);
+
+    uint8_t page[PAGE_HEADER_SIZE + 100 * PAGE_RECORD_SIZE];
+
+    // Newest first, limited, the rest counted as remaining
+    size_t size = writeBinaryPage(page, 3, 0, 100, false, 0, -1);
+    TEST_ASSERT_EQUAL(PAGE_HEADER_SIZE + 3 * PAGE_RECORD_SIZE, size);
+    TEST_ASSERT_EQUAL('T', page[0]);
+    TEST_ASSERT_EQUAL(3, page[2] | (page[3] << 8));
+    TEST_ASSERT_EQUAL(2, page[4]);
+    TEST_ASSERT_EQUAL(encode(18.3, 1), pageWord(page, 0));
+    TEST_ASSERT_EQUAL(70, pageAge(page, 0));
+    TEST_ASSERT_EQUAL(encode(24.5, 2), pageWord(page, 1));
+    TEST_ASSERT_EQUAL(80, pageAge(page, 1));
+
+    // Sensor and age filters
+    size = writeBinaryPage(page, 100, 0, 100, true, 80, 2);
+    TEST_ASSERT_EQUAL(PAGE_HEADER_SIZE + 2 * PAGE_RECORD_SIZE, size);
+    TEST_ASSERT_EQUAL(encode(24.5, 2), pageWord(page, 0));
+    TEST_ASSERT_EQUAL(encode(-4.2, 2), pageWord(page, 1));
+    TEST_ASSERT_EQUAL(90, pageAge(page, 1));
+    TEST_ASSERT_EQUAL(0, page[4]);
+
+    // The next page starts after the records already sent
+    size = writeBinaryPage(page, 3, 2, 100, false, 0, -1);
+    TEST_ASSERT_EQUAL(PAGE_HEADER_SIZE + 3 * PAGE_RECORD_SIZE, size);
+    TEST_ASSERT_EQUAL(encode(18.1, 1), pageWord(page, 0));
+    TEST_ASSERT_EQUAL(80, pageAge(page, 0));
+    TEST_ASSERT_EQUAL(encode(17.5, 1), pageWord(page, 2));
+    TEST_ASSERT_EQUAL(0, page[4]);
+}
@@ -1,5 +1,6 @@
 #include <measurement_store_test.hpp>
 #include <encoding_decoding_test.hpp>
+#include <binary_page_test.hpp>
 #include <unity.h>
 #include <stdio.h>
 
@@ -19,6 +20,8 @@ int main(int argc, char **argv) {
   RUN_TEST(test_saveTemperature);
   RUN_TEST(test_initFunct);
   RUN_TEST(test_readTemperature);
+  RUN_TEST(test_binaryRecord);
+  RUN_TEST(test_binaryPage);
   UNITY_END();
 
 }
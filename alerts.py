@@ -0,0 +1,532 @@
+######################################################################
+#                                                                    #
+#                 Alert engine                                       #
+#                                                                    #
+#   Evaluates the 'alert-rules' of config.json on every reading as   #
+#   the collector ingests it, instead of scanning temp_data later:   #
+#   - threshold     value (or its EMA) above or below a limit        #
+#   - rate          change within a window, from rolling min/max     #
+#   - flat-line     no change over a whole window (stuck sensor)     #
+#   - no-data       no reading for 'timeout' seconds                 #
+#   - disconnected  consecutive disconnected-sensor readings         #
+#                                                                    #
+#   The state of a rule per sensor is updated in O(1) per reading.   #
+#   Firing and resolved events go to the 'alert-sinks' (file,        #
+#   webhook, ...), each drained by its own thread from a bounded     #
+#   queue, so a slow sink never holds up ingestion.                  #
+#                                                                    #
+######################################################################
+
+from collections import defaultdict, deque
+from hot_tier import DISCONNECTED_TEMP, is_connected
+from datetime import datetime
+import numpy as np
+import threading
+import math
+import json
+import time
+import sys
+import os
+
+BATCH_SIZE = 100
+SEND_ATTEMPTS = 3
+
+
+class RollingExtremes:
+    """
+    Min and max of the samples of the last `window` seconds. Both are kept in monotonic deques, so every sample is
+    appended and removed once: O(1) amortized per sample, whatever the length of the window.
+    """
+    __slots__ = ('window', 'low', 'high', 'since', 'last')
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.low = deque()
+        self.high = deque()
+        # Start of the current run of samples without a gap longer than the window
+        self.since = 0.0
+        self.last = None
+
+    def add(self, moment: float, value: float) -> None:
+        if self.last is None or moment - self.last > self.window:
+            self.since = moment
+        self.last = moment
+
+        low, high = self.low, self.high
+        while low and low[-1][1] >= value:
+            low.pop()
+        low.append((moment, value))
+        while high and high[-1][1] <= value:
+            high.pop()
+        high.append((moment, value))
+
+        cutoff = moment - self.window
+        while low[0][0] < cutoff:
+            low.popleft()
+        while high[0][0] < cutoff:
+            high.popleft()
+
+    def min(self) -> float:
+        return self.low[0][1]
+
+    def max(self) -> float:
+        return self.high[0][1]
+
+    def covered(self) -> float:
+        return self.last - self.since
+
+
+class Ema:
+    """
+    Exponential moving average with a time constant in seconds, weighted by the time between readings, so irregular
+    readings (the boards only send changes) are averaged correctly.
+    """
+    __slots__ = ('seconds', 'value', 'last')
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.value = None
+        self.last = 0.0
+
+    def add(self, moment: float, value: float) -> float:
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += (1 - math.exp(-(moment - self.last) / self.seconds)) * (value - self.value)
+        self.last = moment
+        return self.value
+
+
+class Rule:
+    """
+    Base of the rule types. update() gets the rule's state for one sensor, a reading and whether the alert is active,
+    and returns whether it is active afterwards and the value that was decided on. An active alert only resolves
+    once the value is back by more than 'hysteresis', so a value close to the limit does not flap.
+    """
+    kind = ''
+    # Whether update() sees the readings of a disconnected sensor, the other rules skip them
+    disconnected = False
+    # Rules evaluated on every reading; the others are checked periodically by check_silence()
+    per_reading = True
+
+    def __init__(self, spec: dict) -> None:
+        self.name = spec.get('name', self.kind)
+        sensors = spec.get('sensors')
+        self.sensors = None if sensors is None else {int(sensor_id) for sensor_id in sensors}
+        self.hysteresis = max(0.0, float(spec.get('hysteresis', 0)))
+
+    def applies(self, sensor_id) -> bool:
+        return self.sensors is None or sensor_id in self.sensors
+
+    def state(self):
+        return None
+
+    def update(self, state, moment: float, temp: float, active: bool) -> tuple:
+        raise NotImplementedError
+
+    def detail(self, value: float, active: bool) -> str:
+        return f"{value:.2f}"
+
+
+class ThresholdRule(Rule):
+    """
+    Fires while the temperature, or its EMA over 'smoothing' seconds, is above 'above' or below 'below'.
+    """
+    kind = 'threshold'
+
+    def __init__(self, spec: dict) -> None:
+        super().__init__(spec)
+        self.above = None if spec.get('above') is None else float(spec['above'])
+        self.below = None if spec.get('below') is None else float(spec['below'])
+        if self.above is None and self.below is None:
+            raise ValueError(f"Alert rule {self.name} needs 'above' or 'below'")
+        self.smoothing = max(0.0, float(spec.get('smoothing', 0)))
+
+    def state(self):
+        return Ema(self.smoothing) if self.smoothing else None
+
+    def update(self, state, moment: float, temp: float, active: bool) -> tuple:
+        value = state.add(moment, temp) if state is not None else temp
+        margin = self.hysteresis if active else 0.0
+        high = self.above is not None and value > self.above - margin
+        low = self.below is not None and value < self.below + margin
+        return high or low, value
+
+    def detail(self, value: float, active: bool) -> str:
+        limits = [f"above {self.above:g}" if self.above is not None else '',
+                  f"below {self.below:g}" if self.below is not None else '']
+        return f"{value:.2f} C (limit {' / '.join(limit for limit in limits if limit)})"
+
+
+class RateRule(Rule):
+    """
+    Fires when the temperature rose or fell by more than 'change' degrees within 'window' seconds.
+    """
+    kind = 'rate'
+
+    def __init__(self, spec: dict) -> None:
+        super().__init__(spec)
+        self.change = float(spec['change'])
+        self.window = float(spec.get('window', 600))
+
+    def state(self):
+        return RollingExtremes(self.window)
+
+    def update(self, state, moment: float, temp: float, active: bool) -> tuple:
+        state.add(moment, temp)
+        value = max(temp - state.min(), state.max() - temp)
+        return value > self.change - (self.hysteresis if active else 0.0), value
+
+    def detail(self, value: float, active: bool) -> str:
+        return f"changed {value:.2f} C within {self.window:g} s"
+
+
+class FlatLineRule(Rule):
+    """
+    Fires when the temperature changed by less than 'min-change' degrees over a whole 'window' of seconds, the
+    typical failure of a sensor that keeps reporting its last value.
+    """
+    kind = 'flat-line'
+
+    def __init__(self, spec: dict) -> None:
+        super().__init__(spec)
+        self.window = float(spec.get('window', 21600))
+        self.min_change = float(spec.get('min-change', 0.05))
+
+    def state(self):
+        return RollingExtremes(self.window)
+
+    def update(self, state, moment: float, temp: float, active: bool) -> tuple:
+        state.add(moment, temp)
+        value = state.max() - state.min()
+        if active:
+            return value < self.min_change + self.hysteresis, value
+        return state.covered() >= self.window and value < self.min_change, value
+
+    def detail(self, value: float, active: bool) -> str:
+        return f"changed {value:.2f} C in {self.window:g} s"
+
+
+class NoDataRule(Rule):
+    """
+    Fires when a sensor sent no reading for 'timeout' seconds.
+    """
+    kind = 'no-data'
+    per_reading = False
+
+    def __init__(self, spec: dict) -> None:
+        super().__init__(spec)
+        self.timeout = float(spec.get('timeout', 900))
+
+    def detail(self, value: float, active: bool) -> str:
+        return f"no reading for {value:.0f} s"
+
+
+class DisconnectedRule(Rule):
+    """
+    Fires after 'count' readings in a row are the disconnected-sensor value (-127 on the board, -120 after encode())
+    and resolves after 'count' valid readings in a row.
+    """
+    kind = 'disconnected'
+    disconnected = True
+
+    def __init__(self, spec: dict) -> None:
+        super().__init__(spec)
+        self.count = max(1, int(spec.get('count', 3)))
+
+    def state(self):
+        # Readings in a row that disagree with the current state
+        return [0]
+
+    def update(self, state, moment: float, temp: float, active: bool) -> tuple:
+        disconnected = not is_connected(temp)
+        if disconnected == active:
+            state[0] = 0
+            return active, temp
+        state[0] += 1
+        if state[0] < self.count:
+            return active, temp
+        state[0] = 0
+        return disconnected, temp
+
+    def detail(self, value: float, active: bool) -> str:
+        return f"reports {DISCONNECTED_TEMP:g} (disconnected)" if active else f"reports {value:.2f} C again"
+
+
+RULE_TYPES = {rule.kind: rule for rule in (ThresholdRule, RateRule, FlatLineRule, NoDataRule, DisconnectedRule)}
+
+
+def create_rule(spec: dict) -> Rule:
+    kind = spec.get('type')
+    if kind not in RULE_TYPES:
+        raise ValueError(f"Unknown alert rule type {kind!r}, use one of {', '.join(RULE_TYPES)}")
+    return RULE_TYPES[kind](spec)
+
+
+class FileSink:
+    """
+    Appends every event as a JSON line to 'path'.
+    """
+
+    def __init__(self, spec: dict) -> None:
+        self.path = spec.get('path', os.path.join('data', 'alerts.log'))
+
+    def send(self, events: list) -> None:
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(event) + '\n' for event in events))
+
+
+class WebhookSink:
+    """
+    POSTs every batch of events as a JSON array to 'url'. Any HTTP service answering 2xx can take them, a chat
+    integration or a small local receiver.
+    """
+
+    def __init__(self, spec: dict) -> None:
+        self.url = spec['url']
+        self.timeout = float(spec.get('timeout', 5))
+
+    def send(self, events: list) -> None:
+        # requests errors are OSErrors, like the ones of the file sink
+        import requests
+
+        response = requests.post(self.url, json=events, timeout=self.timeout)
+        response.raise_for_status()
+
+
+SINKS = {
+    'file': FileSink,
+    'webhook': WebhookSink,
+}
+
+
+def register_sink(kind: str, sink_class) -> None:
+    """
+    Makes a sink type available to 'alert-sinks'. The class is created with the sink's config entry and needs a
+    send(events) method raising OSError when the events could not be delivered.
+    """
+    SINKS[kind] = sink_class
+
+
+class SinkWorker(threading.Thread):
+    """
+    Delivers the events queued for one sink in batches. The queue is bounded: when the sink falls behind, the oldest
+    events are dropped and counted. A batch the sink cant take is retried a few times with a growing pause.
+    """
+
+    def __init__(self, kind: str, sink, queue_size: int, on_error) -> None:
+        super().__init__(name=f"alert-{kind}", daemon=True)
+        self.kind = kind
+        self.sink = sink
+        self.on_error = on_error
+        self.queue = deque(maxlen=queue_size)
+        self.wake = threading.Event()
+        self.running = True
+        self.delivered = 0
+        self.dropped = 0
+
+    def put(self, events: list) -> None:
+        for event in events:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(event)
+        self.wake.set()
+
+    def deliver(self, batch: list) -> None:
+        for attempt in range(SEND_ATTEMPTS):
+            try:
+                self.sink.send(batch)
+                self.delivered += len(batch)
+                return
+            except OSError as e:
+                self.on_error(f"Alert sink {self.kind} failed: {e}")
+            if attempt + 1 < SEND_ATTEMPTS and self.running:
+                time.sleep(min(30, 2 ** attempt))
+        self.dropped += len(batch)
+
+    def run(self) -> None:
+        while self.running or self.queue:
+            self.wake.wait()
+            self.wake.clear()
+            while self.queue:
+                batch = []
+                while self.queue and len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.popleft())
+                self.deliver(batch)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Delivers what is still queued, waiting at most `timeout` seconds.
+        """
+        self.running = False
+        self.wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class SensorAlerts:
+    """
+    Alert state of one sensor: the time of its newest evaluated reading and, per rule, the rule's state and whether
+    its alert is active.
+    """
+    __slots__ = ('last_time', 'rules', 'states', 'active', 'silence_rules', 'silent')
+
+    def __init__(self, sensor_id, rules: list, silence_rules: list, last_time: float = 0.0) -> None:
+        self.last_time = last_time
+        self.rules = [rule for rule in rules if rule.applies(sensor_id)]
+        self.states = [rule.state() for rule in self.rules]
+        self.active = [False] * len(self.rules)
+        self.silence_rules = [rule for rule in silence_rules if rule.applies(sensor_id)]
+        self.silent = [False] * len(self.silence_rules)
+
+
+def report_error(message: str) -> None:
+    print(message, file=sys.stderr)
+
+
+class AlertEngine:
+    """
+    Evaluates the alert rules on the readings of every page and hands the resulting events to the sinks. Readings are
+    evaluated per sensor in time order; readings older than the newest one already evaluated (a backlog fetched after
+    a restart) are history and skipped. The readings of a sensor come from one poller at a time, so the per-sensor
+    state needs no lock.
+    """
+
+    def __init__(self, on_error=report_error) -> None:
+        self.on_error = on_error
+        self.rule_specs = []
+        self.rules = []
+        self.silence_rules = []
+        self.sensors = {}
+        self.sink_specs = None
+        self.sinks = []
+        self.events = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def configure(self, rule_specs: list, sink_specs: list, queue_size: int = 10000) -> None:
+        """
+        Applies 'alert-rules' and 'alert-sinks'. Changed rules start over with empty windows and no active alerts;
+        changed sinks replace the old ones after those delivered their queue.
+        """
+        if rule_specs != self.rule_specs:
+            rules = [create_rule(spec) for spec in rule_specs]
+            self.rule_specs = rule_specs
+            self.rules = [rule for rule in rules if rule.per_reading]
+            self.silence_rules = [rule for rule in rules if not rule.per_reading]
+            # The time of the last reading carries over, so no-data alerts keep counting
+            self.sensors = {
+                sensor_id: SensorAlerts(sensor_id, self.rules, self.silence_rules, alerts.last_time)
+                for sensor_id, alerts in self.sensors.items()
+            }
+
+        if (sink_specs, queue_size) != self.sink_specs:
+            for spec in sink_specs:
+                if spec.get('type') not in SINKS:
+                    raise ValueError(f"Unknown alert sink type {spec.get('type')!r}, use one of {', '.join(SINKS)}")
+            workers = [SinkWorker(spec['type'], SINKS[spec['type']](spec), queue_size, self.on_error)
+                       for spec in sink_specs]
+            old, self.sinks = self.sinks, workers
+            self.sink_specs = (sink_specs, queue_size)
+            for worker in workers:
+                worker.start()
+            for worker in old:
+                worker.stop()
+
+    def watch(self, last_times: dict) -> None:
+        """
+        Starts the no-data timeout of sensors that did not report yet from the time of their last stored reading.
+        """
+        for sensor_id, last_time in last_times.items():
+            if sensor_id not in self.sensors:
+                self.sensors[sensor_id] = SensorAlerts(sensor_id, self.rules, self.silence_rules, last_time)
+
+    def _alerts(self, sensor_id) -> SensorAlerts:
+        alerts = self.sensors.get(sensor_id)
+        if alerts is None:
+            alerts = self.sensors.setdefault(sensor_id, SensorAlerts(sensor_id, self.rules, self.silence_rules))
+        return alerts
+
+    def add(self, temps: np.ndarray, timestamps: np.ndarray, sensor_ids: np.ndarray) -> None:
+        """
+        Evaluates the rules on the readings of a page.
+        """
+        if not len(temps) or not (self.rules or self.silence_rules):
+            return
+        order = np.lexsort((timestamps, sensor_ids))
+        events = []
+        alerts = None
+        current = None
+        for sensor_id, moment, temp in zip(sensor_ids[order].tolist(), timestamps[order].tolist(),
+                                           temps[order].tolist()):
+            if sensor_id != current:
+                current = sensor_id
+                alerts = self._alerts(sensor_id)
+            if moment <= alerts.last_time:
+                continue
+            alerts.last_time = moment
+
+            disconnected = not is_connected(temp)
+            for index, rule in enumerate(alerts.rules):
+                if disconnected and not rule.disconnected:
+                    continue
+                active = alerts.active[index]
+                firing, value = rule.update(alerts.states[index], moment, temp, active)
+                if firing != active:
+                    alerts.active[index] = firing
+                    events.append(self.event(rule, sensor_id, moment, value, firing))
+
+        if events:
+            self.emit(events)
+
+    def check_silence(self, now: float = None) -> None:
+        """
+        Evaluates the no-data rules, called every few seconds. A sensor that reports again resolves its alert on the
+        next check.
+        """
+        if not self.silence_rules:
+            return
+        now = time.time() if now is None else now
+        events = []
+        for sensor_id, alerts in list(self.sensors.items()):
+            silence = now - alerts.last_time
+            for index, rule in enumerate(alerts.silence_rules):
+                firing = silence > rule.timeout
+                if firing != alerts.silent[index]:
+                    alerts.silent[index] = firing
+                    events.append(self.event(rule, sensor_id, now, silence, firing))
+        if events:
+            self.emit(events)
+
+    @staticmethod
+    def event(rule: Rule, sensor_id, moment: float, value: float, firing: bool) -> dict:
+        state = 'firing' if firing else 'resolved'
+        return {
+            'time': datetime.fromtimestamp(moment).isoformat(timespec='seconds'),
+            'sensor_id': sensor_id,
+            'rule': rule.name,
+            'type': rule.kind,
+            'state': state,
+            'value': round(value, 2),
+            'message': f"{rule.name} {state} on sensor {sensor_id}: {rule.detail(value, firing)}",
+        }
+
+    def emit(self, events: list) -> None:
+        with self.lock:
+            for event in events:
+                self.events[(event['rule'], event['state'])] += 1
+        for sink in self.sinks:
+            sink.put(events)
+
+    def active(self) -> dict:
+        """
+        Number of active alerts per rule.
+        """
+        counts = defaultdict(int)
+        for alerts in list(self.sensors.values()):
+            for rule, firing in zip(alerts.rules + alerts.silence_rules, alerts.active + alerts.silent):
+                counts[rule.name] += firing
+        return dict(counts)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.stop()
@@ -0,0 +1,244 @@
+######################################################################
+#                                                                    #
+#                 Read API                                           #
+#                                                                    #
+#   Flask blueprint served by the collector next to /metrics:        #
+#   - /api/sensors                  sensor locations                 #
+#   - /api/latest                   latest reading per sensor        #
+#   - /api/sensors/<id>/series      readings in a time range, or     #
+#                                   minute/hour/day rollups          #
+#                                   (json, or streamed ndjson/csv)   #
+#   - /api/recent                   latest value and window stats    #
+#   - /api/sensors/<id>/recent      of every sensor, from memory,    #
+#                                   plus a downsampled series        #
+#                                                                    #
+#   JSON answers are kept in an LRU+TTL cache (api_cache.py) that    #
+#   the collector invalidates when it writes readings, and carry an  #
+#   ETag. Streams read on connections of their own, a few at most.   #
+#                                                                    #
+######################################################################
+
+from flask import Blueprint, Response, request, jsonify
+from api_cache import ResponseCache
+from storage import database_errors
+from contextlib import ExitStack
+from rollups import ROLLUP_TABLES
+from datetime import datetime
+import hashlib
+import json
+
+SERIES_LIMIT = 10000
+STREAM_CHUNK = 1000
+# Tag of the sensor locations: the collector never writes them, so they only expire
+LOCATIONS = 'locations'
+RECENT_POINTS = 1000
+
+
+def parse_time(value: str | None) -> datetime | None:
+    """
+    Accepts epoch seconds or an ISO 8601 date/time.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return float(value)
+
+
+def cached_json(cache: ResponseCache, sensor_id, build) -> Response:
+    """
+    Answers from the cache or builds, encodes and caches the payload. Conditional GETs with a matching ETag get 304.
+    """
+    key = request.full_path
+    cached = cache.get(key)
+    if cached is None:
+        generation = cache.generation(sensor_id)
+        body = json.dumps(build(), default=json_default, separators=(',', ':')).encode()
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        cache.put(key, body, etag, sensor_id, generation)
+    else:
+        body, etag = cached
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, content_type='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def epoch_time(value: float) -> str:
+    return datetime.fromtimestamp(value).isoformat(timespec='seconds')
+
+
+def recent_summary(hot_tier, sensor_id, window: float) -> dict:
+    latest = hot_tier.latest(sensor_id)
+    stats = hot_tier.stats(sensor_id, window)
+    if stats is not None:
+        stats['first'], stats['last'] = epoch_time(stats['first']), epoch_time(stats['last'])
+    return {
+        'sensor_id': sensor_id,
+        'time': epoch_time(latest[0]) if latest else None,
+        'temp': latest[1] if latest else None,
+        'window': stats,
+    }
+
+
+def error(message: str, status: int = 400) -> Response:
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def create_read_api(session, cache: ResponseCache, hot_tier, stream_session) -> Blueprint:
+    """
+    Builds the read API. `session` is the collector's db_session() context manager, yielding a storage session,
+    `stream_session` the same for the streamed series on a connection outside the pool, and `hot_tier` the in-memory
+    buffers of recent readings.
+    """
+    api = Blueprint('api', __name__, url_prefix='/api')
+
+    def query(sql: str, params: tuple = ()) -> list:
+        with session() as storage:
+            return storage.query(sql, params)
+
+    @api.route('/sensors')
+    def sensors() -> Response:
+        def build() -> list:
+            rows = query("SELECT id, location FROM sensorId_list ORDER BY id")
+            return [{'sensor_id': sensor_id, 'location': location} for sensor_id, location in rows]
+
+        return cached_json(cache, LOCATIONS, build)
+
+    @api.route('/latest')
+    def latest() -> Response:
+        def build() -> list:
+            rows = query(
+                """
+                SELECT t.sensor_id, t.temp, t.time, s.location
+                FROM temp_data t
+                JOIN (SELECT sensor_id, MAX(id) AS id FROM temp_data GROUP BY sensor_id) AS last ON last.id = t.id
+                LEFT JOIN sensorId_list s ON s.id = t.sensor_id
+                ORDER BY t.sensor_id
+                """
+            )
+            return [
+                {'sensor_id': sensor_id, 'temp': round(float(temp), 2), 'time': timestamp, 'location': location}
+                for sensor_id, temp, timestamp, location in rows
+            ]
+
+        return cached_json(cache, None, build)
+
+    @api.route('/sensors/<int:sensor_id>/series')
+    def series(sensor_id: int) -> Response:
+        try:
+            start = parse_time(request.args.get('from'))
+            end = parse_time(request.args.get('to'))
+            limit = int(request.args.get('limit', SERIES_LIMIT))
+        except ValueError as e:
+            return error(f"Invalid parameter: {e}")
+        output = request.args.get('format', 'json')
+        resolution = request.args.get('resolution', 'raw')
+
+        if resolution == 'raw':
+            fields = ('time', 'temp')
+            sql = "SELECT time, ROUND(temp, 2) FROM temp_data WHERE sensor_id = %s"
+            column = 'time'
+        elif resolution in ROLLUP_TABLES:
+            # Buckets only, the average is exact because sums and counts are stored
+            fields = ('time', 'min', 'max', 'avg', 'samples')
+            sql = (
+                "SELECT bucket, ROUND(temp_min, 2), ROUND(temp_max, 2), ROUND(temp_sum / samples, 2), samples "
+                f"FROM {ROLLUP_TABLES[resolution]} WHERE sensor_id = %s"
+            )
+            column = 'bucket'
+        else:
+            return error(f"resolution must be raw or one of {', '.join(ROLLUP_TABLES)}")
+
+        params = [sensor_id]
+        if start is not None:
+            sql += f" AND {column} >= %s"
+            params.append(start)
+        if end is not None:
+            sql += f" AND {column} <= %s"
+            params.append(end)
+        sql += f" ORDER BY {column}"
+
+        def record(row) -> dict:
+            return {field: value.isoformat() if isinstance(value, datetime) else value
+                    for field, value in zip(fields, row)}
+
+        if output == 'json':
+            if not 0 < limit <= SERIES_LIMIT:
+                return error(f"limit must be between 1 and {SERIES_LIMIT}, use format=ndjson or csv for more")
+
+            def build() -> dict:
+                rows = query(sql + " LIMIT %s", tuple(params) + (limit,))
+                return {'sensor_id': sensor_id, 'resolution': resolution, 'readings': [record(row) for row in rows]}
+
+            return cached_json(cache, sensor_id, build)
+
+        if output == 'ndjson':
+            content_type = 'application/x-ndjson'
+            header = ''
+
+            def line(row) -> str:
+                return json.dumps(record(row), default=json_default) + '\n'
+        elif output == 'csv':
+            content_type = 'text/csv'
+            header = ','.join(fields) + '\n'
+
+            def line(row) -> str:
+                return ','.join(str(value) for value in record(row).values()) + '\n'
+        else:
+            return error("format must be json, ndjson or csv")
+
+        streaming = ExitStack()
+        try:
+            storage = streaming.enter_context(stream_session())
+        except database_errors() as e:
+            return error(f"Cant stream now: {e}", 503)
+
+        def stream():
+            # Rows are read from the database chunk by chunk while the response is sent
+            if header:
+                yield header
+            for rows in storage.stream(sql, tuple(params), STREAM_CHUNK):
+                yield ''.join(line(row) for row in rows)
+
+        response = Response(stream(), content_type=content_type)
+        # Also closes the connection of a client that went away before the first chunk
+        response.call_on_close(streaming.close)
+        return response
+
+    @api.route('/recent')
+    def recent() -> Response:
+        try:
+            window = float(request.args.get('window', hot_tier.retention))
+        except ValueError as e:
+            return error(f"Invalid parameter: {e}")
+        return jsonify([recent_summary(hot_tier, sensor_id, window) for sensor_id in hot_tier.sensors()])
+
+    @api.route('/sensors/<int:sensor_id>/recent')
+    def sensor_recent(sensor_id: int) -> Response:
+        try:
+            window = float(request.args.get('window', hot_tier.retention))
+            points = min(RECENT_POINTS, int(request.args.get('points', 200)))
+        except ValueError as e:
+            return error(f"Invalid parameter: {e}")
+        summary = recent_summary(hot_tier, sensor_id, window)
+        summary['series'] = [
+            {'time': epoch_time(start), 'min': low, 'max': high, 'avg': mean}
+            for start, low, high, mean in hot_tier.series(sensor_id, window, points)
+        ]
+        return jsonify(summary)
+
+    return api
@@ -0,0 +1,84 @@
+######################################################################
+#                                                                    #
+#                 Read API response cache                            #
+#                                                                    #
+#   Encoded /api answers by request path, tagged with the sensors    #
+#   they depend on. Kept apart from the Flask blueprint so the       #
+#   collector can invalidate it without importing Flask.             #
+#                                                                    #
+######################################################################
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    LRU cache of encoded API responses with a time to live. Every entry is tagged with the sensors it depends on, or
+    with None if it depends on all of them, so writing readings of one sensor only drops the entries it affects.
+    An answer built while readings of its sensor were written may be stale, put() leaves it out: take generation()
+    before the query and pass it on.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.cleared = 0
+        self.changes = 0
+        self.sensor_changes = {}
+
+    def generation(self, sensor_id=None) -> tuple:
+        """
+        Changes whenever entries tagged with sensor_id are invalidated.
+        """
+        with self.lock:
+            return self._generation(sensor_id)
+
+    def _generation(self, sensor_id) -> tuple:
+        if sensor_id is None:
+            return self.cleared, self.changes
+        return self.cleared, self.sensor_changes.get(sensor_id, 0)
+
+    def get(self, key: str) -> tuple[bytes, str] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[3] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key: str, body: bytes, etag: str, sensor_id=None, generation: tuple | None = None) -> None:
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self._generation(sensor_id):
+                return
+            self.entries[key] = (body, etag, sensor_id, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, sensor_ids=None) -> None:
+        """
+        Drops the entries of the given sensors and the entries depending on all sensors, or everything without ids.
+        """
+        with self.lock:
+            if sensor_ids is None:
+                self.cleared += 1
+                self.entries.clear()
+                return
+            sensor_ids = set(sensor_ids)
+            self.changes += 1
+            for sensor_id in sensor_ids:
+                self.sensor_changes[sensor_id] = self.sensor_changes.get(sensor_id, 0) + 1
+            for key in [key for key, entry in self.entries.items() if entry[2] is None or entry[2] in sensor_ids]:
+                del self.entries[key]
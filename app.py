@@ -18,25 +18,44 @@
 #                                                                    #
 ######################################################################
 
-from mysql.connector.connection import MySQLConnection
-from mysql.connector.cursor import MySQLCursor
+from __future__ import annotations
+from storage import Storage, Session, database_errors
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Metrics, Counter, Gauge
+from api_cache import ResponseCache
+from logger import Logger
+from config_watch import ConfigWatcher
+from health import ConnectivityProbe
+from discovery import DiscoveryService
+from collections.abc import Iterator
+from contextlib import contextmanager
 from collections import defaultdict
-from mysql.connector import Error
 from dotenv import load_dotenv
 from datetime import datetime
-from icecream import ic
-import mysql.connector
+from typing import TYPE_CHECKING
 from os import getenv
+import subprocess
 import functools
 import threading
-import requests
-import socket
+import argparse
+import logging
+import random
+import atexit
+import signal
+import struct
 import time
 import json
 import sys
-import re
 import os
 
+# numpy, mysql.connector and the modules needing them are imported where they are used first, so importing app (the
+# benchmarks, tests, --help) stays fast and a SQLite collector never loads the MySQL driver
+if TYPE_CHECKING:
+    from shards import ShardCoordinator
+    from hot_tier import HotTier
+    from alerts import AlertEngine
+    import numpy as np
+
 
 interval: int = 0
 measurement_interval: int = 0
@@ -45,176 +64,419 @@ max_time_difference: float = 0.0
 max_temp_difference_esp: float = 0.0
 UDP_IP: str = "192.168.0.255"
 UDP_PORT: int = 4210
-lst_request_time: float = 0.0
 LAN_host: str = ""
 reset_board: bool = False
+poll_workers: int = 8
+db_flush_size: int = 500
+sensor_cache_resync: int = 3600
+db_pool_size: int = 10
+db_acquire_timeout: float = 30.0
+api_stream_connections: int = 2
+discovery_interval: float = 10.0
+discovery_wait: float = 2.0
+partition_months: int = 3
+partitions_checked: float = 0.0
+device_port: int = 80
+binary_transfer: bool = True
+rollups_enabled: bool = True
+spool_enabled: bool = True
+spool_dir: str = os.path.join('data', 'spool')
+spool_max_bytes: int = 256 << 20
+spool_segment_bytes: int = 4 << 20
+spool_fsync_interval: float = 0.005
+spool_drain_size: int = 5000
+hot_tier_samples: int = 17280
+hot_tier_hours: float = 24.0
+storage_backend: str = 'mysql'
+sqlite_path: str = os.path.join('data', 'esp_temp.db')
+http_host: str = "127.0.0.1"
+http_port: int = 8000
+probe_interval: float = 5.0
+breaker_failures: int = 2
+breaker_backoff: float = 10.0
+breaker_max_backoff: float = 600.0
+fast_start: bool = True
+shard_enabled: bool = False
+worker_id: str = ""
+worker_index: int | None = None
+shard_lease_seconds: float = 30.0
+shard_heartbeat: float = 5.0
+shard_replicas: int = 64
+alert_queue_size: int = 10000
+CONFIG_PATH: str = os.path.join('data', 'config.json')
+loaded_config: dict = {}
 load_dotenv()
 
 
-def load_config() -> None:
+def load_config() -> set:
     """
-    Load configuration settings from 'config.json'.
+    Load configuration settings from 'config.json'. Returns the keys of the 'config' section whose values changed
+    since the previous load.
     """
     global interval, measurement_interval, max_temp_difference, max_time_difference, max_temp_difference_esp, UDP_IP, UDP_PORT, LAN_host, reset_board
+    global poll_workers, db_flush_size, sensor_cache_resync, db_pool_size, partition_months, db_acquire_timeout
+    global api_stream_connections
+    global discovery_interval, discovery_wait, device_port, http_host, http_port, loaded_config
+    global spool_enabled, spool_dir, spool_max_bytes, spool_segment_bytes, spool_fsync_interval, spool_drain_size
+    global hot_tier_samples, hot_tier_hours, storage_backend, sqlite_path
+    global probe_interval, breaker_failures, breaker_backoff, breaker_max_backoff, binary_transfer, rollups_enabled
+    global shard_enabled, worker_id, shard_lease_seconds, shard_heartbeat, shard_replicas, fast_start
+    global alert_queue_size, hot_tier
+
+    with open(CONFIG_PATH) as f:
+        settings = json.load(f)
+
+    dev = settings["dev"]
+    reset_board = dev["RST_board_after_fail"]
+
+    config = settings['config']
+    interval = config['server-time-get']
+    measurement_interval = config['device-time-measurement']
+    max_temp_difference = config['max-difference']
+    max_time_difference = config['max-time-difference']
+    max_temp_difference_esp = config['max_temp_difference_esp']
+    UDP_IP = config['UDP_host']
+    UDP_PORT = config['UDP_port']
+    LAN_host = config['LAN_host']
+    poll_workers = max(1, int(config.get('poll-workers', 8)))
+    db_flush_size = max(1, int(config.get('db-flush-size', 500)))
+    sensor_cache_resync = int(config.get('sensor-cache-resync', 3600))
+    db_pool_size = min(32, max(1, int(config.get('db-pool-size', 10))))
+    db_acquire_timeout = max(1.0, float(config.get('db-acquire-timeout', 30)))
+    api_stream_connections = max(1, int(config.get('api-stream-connections', 2)))
+    partition_months = max(1, int(config.get('partition-months-ahead', 3)))
+    discovery_interval = float(config.get('discovery-interval', 10))
+    discovery.configure(UDP_IP, UDP_PORT, discovery_interval)
+    discovery_wait = float(config.get('discovery-wait', 2))
+    device_port = int(config.get('device-port', 80))
+    binary_transfer = bool(config.get('binary-transfer', True))
+    rollups_enabled = bool(config.get('rollups', True))
+    spool_enabled = bool(config.get('spool', True))
+    spool_dir = config.get('spool-dir', os.path.join('data', 'spool'))
+    spool_max_bytes = int(float(config.get('spool-max-mb', 256)) * (1 << 20))
+    spool_segment_bytes = min(spool_max_bytes, int(float(config.get('spool-segment-mb', 4)) * (1 << 20)))
+    spool_fsync_interval = max(0.0, float(config.get('spool-fsync-ms', 5)) / 1000)
+    spool_drain_size = max(1, int(config.get('spool-drain-size', 5000)))
+    storage_backend = config.get('storage', 'mysql')
+    sqlite_path = config.get('sqlite-path', os.path.join('data', 'esp_temp.db'))
+    hot_tier_samples = max(0, int(config.get('hot-tier-samples', 17280)))
+    hot_tier_hours = float(config.get('hot-tier-hours', 24))
+    if hot_tier is None:
+        from hot_tier import HotTier
+        hot_tier = HotTier()
+    hot_tier.configure(hot_tier_samples, hot_tier_hours * 3600)
+    http_host = config.get('http-host', "127.0.0.1")
+    http_port = int(config.get('http-port', 8000))
+    response_cache.max_entries = int(config.get('api-cache-size', 256))
+    response_cache.ttl = float(config.get('api-cache-ttl', 30))
+    probe_interval = max(1.0, float(config.get('probe-interval', 5)))
+    connectivity.configure(LAN_host, probe_interval)
+    breaker_failures = max(1, int(config.get('breaker-failures', 2)))
+    breaker_backoff = max(1.0, float(config.get('breaker-backoff', 10)))
+    breaker_max_backoff = max(breaker_backoff, float(config.get('breaker-max-backoff', 600)))
+    fast_start = bool(config.get('fast-start', True))
+    shard_enabled = bool(config.get('shard', False)) or worker_index is not None
+    # Without 'worker-id' the shard service names the worker when it starts
+    worker_id = config.get('worker-id', "")
+    shard_lease_seconds = max(3.0, float(config.get('shard-lease-seconds', 30)))
+    # Two renewals fit into the time a lease is used locally
+    shard_heartbeat = min(shard_lease_seconds / 3, max(0.5, float(config.get('shard-heartbeat-seconds', 5))))
+    shard_replicas = max(1, int(config.get('shard-replicas', 64)))
+    alert_queue_size = max(1, int(config.get('alert-queue-size', 10000)))
+    setup_alerts(config.get('alert-rules', []), config.get('alert-sinks', []))
+    if worker_index is not None:
+        # Processes started with --workers share config.json, each gets its own id, spool and port
+        if config.get('worker-id'):
+            worker_id = f"{config['worker-id']}-{worker_index}"[-64:]
+        spool_dir = os.path.join(spool_dir, f"worker-{worker_index}")
+        if http_port:
+            http_port += worker_index
+    logger.configure(
+        queued=bool(config.get('log-queued', True)),
+        max_bytes=int(config.get('log-max-bytes', 1048576)),
+        rotate_seconds=float(config.get('log-rotate-hours', 24)) * 3600,
+        backups=int(config.get('log-backups', 5)),
+        sample_rate=int(config.get('log-reading-rate', 20))
+    )
 
-    with open("data/config.json") as f:
-        config = json.load(f)["dev"]
-        if not config["DEBUG_mode"]:
-            ic.disable()
-        reset_board = config["RST_board_after_fail"]
-
-    with open('data/config.json') as f:
-        config = json.load(f)['config']
-        interval = config['server-time-get']
-        measurement_interval = config['device-time-measurement']
-        max_temp_difference = config['max-difference']
-        max_time_difference = config['max-time-difference']
-        max_temp_difference_esp = config['max_temp_difference_esp']
-        UDP_IP = config['UDP_host']
-        UDP_PORT = config['UDP_port']
-        LAN_host = config['LAN_host']
-
-    ic(UDP_IP, UDP_PORT, LAN_host, interval, measurement_interval, max_temp_difference, max_time_difference, max_temp_difference_esp)
-    ic("Develop variables", reset_board)
-
-
-def dot_or_dash(char: str) -> None:
-    print(char, end='', flush=True)
-
-
-class Logger:
-    """
-    Custom logger to log program info and exceptions
-    """
-    LOG_COLORS = {
-        'DEBUG': '\033[92m',
-        'INFO': '\033[94m',
-        'WARNING': '\033[93m',
-        'ERROR': '\033[91m',
-        'CRITICAL': '\033[41m'
-    }
-    RESET_COLOR = '\033[0m'
-
-    def __init__(self, log_file: str = 'data/app.log', log_level: str = 'INFO') -> None:
-        self.log_file = log_file
-        self.log_level = log_level
-        self.colored = sys.stdout.isatty() or 'PYCHARM_HOSTED' in os.environ
-        self.log_levels = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
-        self.console_log_levels = {'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'}
-        self.file_log_levels = {'WARNING', 'ERROR', 'CRITICAL'}
-        self.current_log_level = self.log_levels.get(log_level, 50)
-
-        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
-
-    def _log(self, level: str, message: str) -> None:
-        if level == 'IGNORE':
-            print(message)
-            return
+    if dev["DEBUG_mode"]:
+        # icecream is only imported when it prints something
+        from icecream import ic
+        ic(UDP_IP, UDP_PORT, LAN_host, interval, measurement_interval, max_temp_difference, max_time_difference, max_temp_difference_esp)
+        ic("Collector variables", poll_workers, db_flush_size, sensor_cache_resync, db_pool_size, partition_months,
+           discovery_interval, discovery_wait, device_port, binary_transfer, rollups_enabled, spool_enabled, spool_dir,
+           spool_max_bytes, hot_tier_samples, hot_tier_hours, storage_backend, sqlite_path, http_host, http_port,
+           probe_interval, breaker_failures, breaker_backoff, breaker_max_backoff, shard_enabled, worker_id,
+           shard_lease_seconds, shard_heartbeat, shard_replicas, fast_start, alert_queue_size, db_acquire_timeout,
+           api_stream_connections)
+        ic("Develop variables", reset_board)
 
-        if self.log_levels[level] >= self.current_log_level:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            color = self.LOG_COLORS.get(level, self.RESET_COLOR) if self.colored else ""
-            reset_color = self.RESET_COLOR if self.colored else ""
-            log_message = f"{timestamp} - {level} - {message}"
+    changed = {key for key in config.keys() | loaded_config.keys() if config.get(key) != loaded_config.get(key)}
+    loaded_config = config
+    return changed
 
-            if level in self.console_log_levels:
-                colorized_message = f"{timestamp} - {color}{level}{reset_color} - {message}"
-                print(colorized_message)
 
-            if level in self.file_log_levels:
-                with open(self.log_file, 'a') as f:
-                    f.write(log_message + '\n')
+def device_url(device_ip: str, path: str) -> str:
+    """
+    Builds the URL of a device endpoint. Boards listen on port 80, other ports are only used by the simulator.
+    """
+    if device_port == 80:
+        return f"http://{device_ip}{path}"
+    return f"http://{device_ip}:{device_port}{path}"
 
-    def name(self, message: str) -> None:
-        self._log('IGNORE', message)
 
-    def debug(self, message: str) -> None:
-        self._log('DEBUG', message)
+logger = Logger()
 
-    def info(self, message: str) -> None:
-        self._log('INFO', message)
+metrics = Metrics()
+stage_seconds = metrics.histogram(
+    'esp_stage_seconds', "Time spent in each collector stage: device fetch, JSON decode, alert rules, "
+                         "insert/move decision, spool append, insert, update, rollup refresh and commit", ('stage',)
+)
+cycle_seconds = metrics.histogram('esp_cycle_seconds', "Duration of a main loop cycle polling all devices")
+readings_total = metrics.counter('esp_readings_total', "Readings received from devices")
+rows_written_total = metrics.counter('esp_rows_written_total', "Rows written to temp_data", ('operation',))
+batch_failures_total = metrics.counter('esp_batch_failures_total', "Write batches that were rolled back")
+response_cache = ResponseCache()
+hot_tier: HotTier | None = None
+alert_engine: AlertEngine | None = None
+
+
+class LogSink:
+    """
+    Alert sink writing the events to the collector log, firing alerts as warnings.
+    """
 
-    def warning(self, message: str) -> None:
-        self._log('WARNING', message)
+    def __init__(self, spec: dict) -> None:
+        pass
 
-    def error(self, message: str) -> None:
-        self._log('ERROR', message)
+    def send(self, events: list) -> None:
+        for event in events:
+            if event['state'] == 'firing':
+                logger.warning(f"Alert {event['message']}")
+            else:
+                logger.info(f"Alert {event['message']}")
 
-    def critical(self, message: str) -> None:
-        self._log('CRITICAL', message)
 
+def setup_alerts(rules: list, sinks: list) -> None:
+    """
+    Applies 'alert-rules' and 'alert-sinks'. The alert engine is only loaded once there are rules, it then watches the
+    sensors of the last run like at a start.
+    """
+    global alert_engine
+    if alert_engine is None:
+        if not rules:
+            return
+        from alerts import AlertEngine, register_sink
+
+        register_sink('log', LogSink)
+        alert_engine = AlertEngine(on_error=logger.error)
+        atexit.register(alert_engine.close)
+        for cursors in registry.restored.values():
+            alert_engine.watch(cursors)
+    alert_engine.configure(rules, sinks, alert_queue_size)
 
-logger = Logger()
 
 # Additional global variables
 interval_between_json_load: int = 5000
-lst_measure: float = time.time()
-esp_devices: list = []
 lst_check: float = 0.0
-entry_time: float = 0.0
-lst_device_upload: float = time.time()
-lst_request_times: dict = {}
 DATABASE_HOST: str = getenv('DATABASE_HOST')
-DATABASE_PORT: int = int(getenv('DATABASE_PORT'))
+DATABASE_PORT: int = int(getenv('DATABASE_PORT', 3306))
 DATABASE_USER: str = getenv('DATABASE_USER')
 DATABASE_PASSWORD: str = getenv('DATABASE_PASSWORD')
 DATABASE: str = getenv('DATABASE')
-exc: list = []
-disconnect: bool = False
-esp_db: MySQLConnection
-esp_cursor: MySQLCursor
-sock: socket
-last_mtime = 0
+storage: Storage | None = None
+poll_executor: ThreadPoolExecutor | None = None
+poll_executor_size: int = 0
+prefetch_executor: ThreadPoolExecutor | None = None
+prefetch_executor_size: int = 0
+started_at: float = 0.0
+first_readings = threading.Event()
+
+
+class SensorStateCache:
+    """
+    In-memory copy of the last two stored records of every sensor, newest first. The collector keeps it in step with
+    its own writes, so deciding between a new row and a moved timestamp needs no database read.
+    """
+
+    def __init__(self) -> None:
+        self.records = {}
+        self.lock = threading.RLock()
+        self.synced_at = 0.0
+
+    def warm(self) -> None:
+        """
+        Loads the last two records of all sensors with a single query.
+        """
+        with db_session() as session:
+            rows = session.last_records_all()
+
+        records = defaultdict(list)
+        for sensor_id, temp, timestamp in rows:
+            records[sensor_id].append((temp, timestamp))
+
+        with self.lock:
+            self.records = dict(records)
+            self.synced_at = time.time()
+        logger.info(f"Sensor cache loaded for {len(records)} sensors")
+
+    def get(self, sensor_id) -> list:
+        """
+        Returns a copy of the cached records of a sensor, loading them from the database on a miss.
+        """
+        with self.lock:
+            if sensor_id in self.records:
+                return list(self.records[sensor_id])
+
+        with db_session() as session:
+            records = list(session.last_records(sensor_id))
+        with self.lock:
+            self.records.setdefault(sensor_id, records)
+            return list(self.records[sensor_id])
+
+    def record_insert(self, sensor_id, temp, timestamp) -> None:
+        with self.lock:
+            if sensor_id in self.records:
+                self.records[sensor_id] = [(temp, timestamp)] + self.records[sensor_id][:1]
+
+    def record_update(self, sensor_id, new_time) -> None:
+        with self.lock:
+            records = self.records.get(sensor_id)
+            if records:
+                records[0] = (records[0][0], new_time)
+
+    def invalidate(self, sensor_id=None) -> None:
+        """
+        Drops cached records of one sensor, or of all sensors, so they are read again from the database. Use it
+        whenever something other than this collector changes temp_data.
+        """
+        with self.lock:
+            if sensor_id is None:
+                self.records.clear()
+            else:
+                self.records.pop(sensor_id, None)
+
+    def resync(self) -> None:
+        """
+        Replaces the whole cache with the current database state.
+        """
+        try:
+            self.warm()
+        except database_errors() as e:
+            logger.error(f"Error reloading sensor cache: {e}")
+            self.invalidate()
+
+
+sensor_cache = SensorStateCache()
 
 
 def get_database() -> None:
     """
-    Connect or reconnect to the MySQL database.
+    Opens the configured storage ('storage': "mysql" or "sqlite") shared by all collector threads and creates the
+    rollup tables if they are missing. Does nothing if it is open already. Raises one of database_errors() if the
+    database is not reachable, the next database access tries again.
     """
-    global esp_db, esp_cursor
+    global storage
+    if storage is None:
+        from storage import MySQLStorage, SQLiteStorage
+
+        if storage_backend == 'sqlite':
+            storage = SQLiteStorage(sqlite_path, db_pool_size, rollups_enabled, api_stream_connections,
+                                    db_acquire_timeout)
+        else:
+            storage = MySQLStorage(
+                db_pool_size,
+                rollups_enabled,
+                stream_size=api_stream_connections,
+                acquire_timeout=db_acquire_timeout,
+                host=DATABASE_HOST,
+                port=DATABASE_PORT,
+                user=DATABASE_USER,
+                password=DATABASE_PASSWORD,
+                database=DATABASE,
+                connection_timeout=60
+            )
     try:
-        esp_db = mysql.connector.connect(
-            host=DATABASE_HOST,
-            port=DATABASE_PORT,
-            user=DATABASE_USER,
-            password=DATABASE_PASSWORD,
-            database=DATABASE,
-            connection_timeout=60
-        )
-        esp_cursor = esp_db.cursor(buffered=True)
-    except Error as e:
-        logger.error(f"Error connecting to MySQL database: {e}")
-        exit()
+        storage.open()
+    except database_errors() as e:
+        logger.error(f"Error connecting to {storage_backend} database: {e}")
+        raise
 
 
-def insert_data(temp, timestamp, sensor_id) -> bool:
+@contextmanager
+def db_session() -> Iterator[Session]:
     """
-    Inserts temperature data into a database if no duplicate entry exists for the same sensor and timestamp.
+    Borrows a database session for the current thread. Nested calls in the same thread reuse the borrowed session,
+    which goes back to the storage when the outermost block exits.
     """
+    get_database()
+    with storage.session() as session:
+        yield session
+
+
+@contextmanager
+def db_stream_session() -> Iterator[Session]:
+    """
+    Opens a database session on a connection of its own for a read streamed to an API client, at most
+    'api-stream-connections' at once.
+    """
+    get_database()
+    with storage.stream_session() as session:
+        yield session
+
+
+def maintain_partitions() -> None:
+    """
+    Adds the partitions of the next 'partition-months-ahead' months if temp_data is partitioned by month (setup.py),
+    so readings never go to the catch-all partition. Only MySQL tables are partitioned.
+    """
+    global partitions_checked
+    partitions_checked = time.time()
+    if storage_backend != 'mysql':
+        return
+    import partitions
+
     try:
-        global esp_db, esp_cursor
+        with db_session() as session:
+            added = partitions.extend(session.cursor, partition_months)
+    except database_errors() as e:
+        logger.error(f"Error adding partitions of temp_data: {e}")
+        return
+    if added:
+        logger.info(f"Added partitions {', '.join(added)} to temp_data")
 
-        query_check = """
-        SELECT id 
-        FROM temp_data 
-        WHERE sensor_id = %s 
-        AND temp = %s 
-        AND (time = %s OR time BETWEEN DATE_SUB(%s, INTERVAL 5 SECOND) AND %s)
-        """
-        esp_cursor.execute(query_check, (sensor_id, temp, timestamp, timestamp, timestamp))
-        duplicate = esp_cursor.fetchone()
 
-        if duplicate:
-            return False
+def refresh_rollups(session: Session, touched: dict) -> None:
+    """
+    Rebuilds the rollup buckets of the written timestamps before the caller commits, unless 'rollups' is off.
+    """
+    if rollups_enabled and touched:
+        with stage_seconds.time('rollup'):
+            session.refresh_rollups(touched)
 
-        query_insert = f"INSERT INTO temp_data (temp, time, sensor_id) VALUES ({temp}, '{timestamp}', {sensor_id})"
-        esp_cursor.execute(query_insert)
-        esp_db.commit()
 
-        logger.info(f"Data inserted: sensor {sensor_id}, temp {temp}, timestamp {timestamp}")
+def insert_data(temp, timestamp, sensor_id) -> bool:
+    """
+    Inserts temperature data into a database if no duplicate entry exists for the same sensor and timestamp.
+    """
+    try:
+        with db_session() as session:
+            if session.is_duplicate(sensor_id, temp, timestamp):
+                return False
+
+            with stage_seconds.time('insert'):
+                session.insert(temp, timestamp, sensor_id)
+            refresh_rollups(session, {sensor_id: [timestamp]})
+            with stage_seconds.time('commit'):
+                session.commit()
+        sensor_cache.record_insert(sensor_id, temp, timestamp)
+        response_cache.invalidate((sensor_id,))
+        rows_written_total.inc('insert')
+
+        logger.sampled('insert', f"Data inserted: sensor {sensor_id}, temp {temp}, timestamp {timestamp}")
         return True
 
-    except Error as e:
+    except database_errors() as e:
         logger.error(f"Error inserting data: {e}")
         return False
 
@@ -223,30 +485,192 @@ def update_timestamp(sensor_id, new_time) -> None:
     """
     Updates the timestamp for the most recent entry of a given sensor in the database.
     """
-    logger.info(f"Sensor_id : {sensor_id} new time: {new_time}")
+    logger.sampled('move', f"Sensor_id : {sensor_id} new time: {new_time}")
     try:
-        global esp_db, esp_cursor
-        esp_cursor.execute(
-            f"UPDATE temp_data SET time = '{new_time}' WHERE sensor_id = {sensor_id} ORDER BY id DESC LIMIT 1"
-        )
-        esp_db.commit()
-    except Error as e:
+        moved = [record[1] for record in sensor_cache.get(sensor_id)[:1]] + [new_time]
+        with db_session() as session:
+            with stage_seconds.time('update'):
+                session.move(sensor_id, new_time)
+            refresh_rollups(session, {sensor_id: moved})
+            with stage_seconds.time('commit'):
+                session.commit()
+        sensor_cache.record_update(sensor_id, new_time)
+        response_cache.invalidate((sensor_id,))
+        rows_written_total.inc('update')
+    except database_errors() as e:
         logger.error(f"Error updating timestamp: {e}")
+        sensor_cache.invalidate(sensor_id)
+
+
+class WriteBatch:
+    """
+    Collects the insert and timestamp-move decisions for a page of readings and writes them in one transaction.
+    Rows are committed together on flush() or as soon as 'db-flush-size' writes are pending. A `fence`, if set, is
+    called with the session right before every commit and raises LeaseLost to roll the batch back; `before_commit`
+    is called the same way to write more rows in the same transaction.
+    """
+
+    def __init__(self, page_start: float = None, page_end: float = None, flush_size: int = None) -> None:
+        self.flush_size = flush_size or db_flush_size
+        self.page_start = datetime.fromtimestamp(page_start - 5) if page_start is not None else None
+        self.page_end = datetime.fromtimestamp(page_end) if page_end is not None else None
+        self.inserts = []
+        self.updates = {}
+        self.moved_from = {}
+        self.last_records = {}
+        self.pending_last = {}
+        self.stored = {}
+        self.failed = False
+        self.fence = None
+        self.before_commit = None
+
+    def errors(self) -> tuple:
+        """
+        Exceptions that roll the batch back: failed database calls and LeaseLost of the fence.
+        """
+        if self.fence is None:
+            return database_errors()
+        from shards import LeaseLost
+        return *database_errors(), LeaseLost
+
+    def get_last_records(self, sensor_id) -> list:
+        """
+        Returns the last two records of a sensor as stored after all decisions made so far, newest first.
+        """
+        if sensor_id not in self.last_records:
+            self.last_records[sensor_id] = sensor_cache.get(sensor_id)
+        return self.last_records[sensor_id]
+
+    def _stored_rows(self, sensor_id) -> list:
+        if sensor_id not in self.stored:
+            if self.page_start is None:
+                self.stored[sensor_id] = []
+            else:
+                with db_session() as session:
+                    self.stored[sensor_id] = list(session.stored_rows(sensor_id, self.page_start, self.page_end))
+        return self.stored[sensor_id]
+
+    def _is_duplicate(self, temp, timestamp, sensor_id) -> bool:
+        if self.page_start is None or not self.page_start <= timestamp <= self.page_end:
+            with db_session() as session:
+                if session.is_duplicate(sensor_id, temp, timestamp):
+                    return True
+            rows = []
+        else:
+            rows = self._stored_rows(sensor_id)
+
+        rows = rows + [(row[0], row[1]) for row in self.inserts if row[2] == sensor_id]
+        window = timestamp.timestamp() - 5
+        return any(
+            round(float(row_temp), 2) == round(float(temp), 2) and window <= row_time.timestamp() <= timestamp.timestamp()
+            for row_temp, row_time in rows
+        )
+
+    def insert(self, temp, timestamp, sensor_id) -> bool:
+        """
+        Queues a new row unless an equal reading of the sensor is already stored or queued within 5 seconds.
+        """
+        if self._is_duplicate(temp, timestamp, sensor_id):
+            return False
+
+        self.inserts.append([temp, timestamp, sensor_id])
+        self.pending_last[sensor_id] = len(self.inserts) - 1
+        self.last_records[sensor_id] = [(temp, timestamp)] + self.get_last_records(sensor_id)[:1]
+        self._flush_if_full()
+        return True
+
+    def update_timestamp(self, sensor_id, new_time) -> None:
+        """
+        Moves the timestamp of the newest row of a sensor, rewriting a queued row instead of issuing an UPDATE.
+        """
+        last_records = self.get_last_records(sensor_id)
+        if sensor_id in self.pending_last:
+            self.inserts[self.pending_last[sensor_id]][1] = new_time
+        else:
+            if sensor_id not in self.updates and last_records:
+                self.moved_from[sensor_id] = last_records[0][1]
+            self.updates[sensor_id] = new_time
+
+        if last_records:
+            last_records[0] = (last_records[0][0], new_time)
+        self._flush_if_full()
 
+    def _flush_if_full(self) -> None:
+        if len(self.inserts) + len(self.updates) >= self.flush_size:
+            self.flush()
 
-def check_and_insert_data(temp, timestamp, sensor_id) -> None:
+    def flush(self) -> int:
+        """
+        Writes all queued moves and inserts and commits them once. Returns the number of written rows.
+        """
+        if not self.inserts and not self.updates:
+            return 0
+
+        inserts, updates, moved_from = self.inserts, self.updates, self.moved_from
+        self.inserts, self.updates, self.moved_from, self.pending_last = [], {}, {}, {}
+
+        touched = defaultdict(list)
+        for sensor_id, old_time in moved_from.items():
+            touched[sensor_id].append(old_time)
+        for sensor_id, new_time in updates.items():
+            touched[sensor_id].append(new_time)
+        for temp, timestamp, sensor_id in inserts:
+            touched[sensor_id].append(timestamp)
+        try:
+            with db_session() as session:
+                try:
+                    if updates:
+                        with stage_seconds.time('update'):
+                            session.move_many(updates)
+                    if inserts:
+                        with stage_seconds.time('insert'):
+                            session.insert_many([tuple(row) for row in inserts])
+                    refresh_rollups(session, touched)
+                    if self.fence is not None:
+                        self.fence(session)
+                    if self.before_commit is not None:
+                        self.before_commit(session)
+                    with stage_seconds.time('commit'):
+                        session.commit()
+                except self.errors():
+                    session.rollback()
+                    raise
+        except self.errors() as e:
+            logger.error(f"Error writing batch of {len(inserts) + len(updates)} rows: {e}")
+            batch_failures_total.inc()
+            self.failed = True
+            for sensor_id in set(updates) | {row[2] for row in inserts}:
+                sensor_cache.invalidate(sensor_id)
+            self.last_records.clear()
+            self.stored.clear()
+            return 0
+
+        rows_written_total.inc('update', amount=len(updates))
+        rows_written_total.inc('insert', amount=len(inserts))
+        response_cache.invalidate(set(updates) | {row[2] for row in inserts})
+        for sensor_id, new_time in updates.items():
+            sensor_cache.record_update(sensor_id, new_time)
+            logger.sampled('move', f"Sensor_id : {sensor_id} new time: {new_time}")
+        for temp, timestamp, sensor_id in inserts:
+            sensor_cache.record_insert(sensor_id, temp, timestamp)
+            logger.sampled('insert', f"Data inserted: sensor {sensor_id}, temp {temp}, timestamp {timestamp}")
+            if sensor_id in self.stored:
+                self.stored[sensor_id].append((temp, timestamp))
+        return len(inserts) + len(updates)
+
+
+def check_and_insert_data(temp, timestamp, sensor_id, batch: WriteBatch = None) -> None:
     """
     Checks the last two temperature records for a given sensor and decides whether to insert a new record or update
     the timestamp based on temperature and time differences. If conditions are met, it either inserts a new record or
-    updates the timestamp accordingly.
+    updates the timestamp accordingly. With a batch the decisions are queued on it instead of written one by one.
     """
-    global esp_db, esp_cursor
-
-    esp_cursor.execute(
-        "SELECT temp, time FROM temp_data WHERE sensor_id = %s ORDER BY id DESC LIMIT 2",
-        (sensor_id,)
-    )
-    last_records = esp_cursor.fetchall()
+    if batch is not None:
+        last_records = list(batch.get_last_records(sensor_id))
+        insert, move = batch.insert, batch.update_timestamp
+    else:
+        last_records = sensor_cache.get(sensor_id)
+        insert, move = insert_data, update_timestamp
 
     timestamp = datetime.fromtimestamp(timestamp)
 
@@ -259,379 +683,1297 @@ def check_and_insert_data(temp, timestamp, sensor_id) -> None:
 
         if last_temp_diff <= max_temp_difference and abs(float(last_last_temp) - float(temp)) <= max_temp_difference:
             if time_diff > max_time_difference:
-                logger.info(
+                logger.sampled(
+                    'decision',
                     f"Inserting new record for sensor {sensor_id} due to time difference > {max_time_difference} seconds.")
-                insert_data(temp, timestamp, sensor_id)
+                insert(temp, timestamp, sensor_id)
             else:
-                logger.info(f"Moving timestamp due to no temperature change.")
-                update_timestamp(sensor_id, timestamp)
+                logger.sampled('decision', f"Moving timestamp due to no temperature change.")
+                move(sensor_id, timestamp)
         else:
-            logger.info(f"Inserting new record for sensor {sensor_id} due to larger temperature change.")
-            insert_data(temp, timestamp, sensor_id)
+            logger.sampled('decision', f"Inserting new record for sensor {sensor_id} due to larger temperature change.")
+            insert(temp, timestamp, sensor_id)
     else:
-        logger.info(f"Inserting first record for sensor {sensor_id}")
-        insert_data(temp, timestamp, sensor_id)
+        logger.sampled('decision', f"Inserting first record for sensor {sensor_id}")
+        insert(temp, timestamp, sensor_id)
 
     if len(last_records) == 1:
         last_temp, last_time = last_records[0]
         if abs(datetime.timestamp(timestamp) - datetime.timestamp(last_time)) > max_time_difference:
-            logger.info(f"Inserting new record for sensor {sensor_id} due to timestamp change.")
-            insert_data(temp, timestamp, sensor_id)
+            logger.sampled('decision', f"Inserting new record for sensor {sensor_id} due to timestamp change.")
+            insert(temp, timestamp, sensor_id)
 
     if len(last_records) == 0:
-        logger.info(f"Inserting new record for sensor {sensor_id} due to no last temperatures.")
-        insert_data(temp, timestamp, sensor_id)
+        logger.sampled('decision', f"Inserting new record for sensor {sensor_id} due to no last temperatures.")
+        insert(temp, timestamp, sensor_id)
 
 
-def get_esp8266_data(device_ip: str, start_time: dict, max_retries=3, is_first_request=False, entry_time_ms=None, remain=0) -> bool:
+def check_and_insert_page(temps: np.ndarray, timestamps: np.ndarray, sensor_id, batch: WriteBatch) -> None:
     """
-    Fetches temperature data from an ESP8266 device, processes it, and inserts valid records into the database. It
-    retries up to a specified number of times if the request fails, and handles remaining data by recursively calling
-    the function.
+    Applies the rules of check_and_insert_data() to all readings of one sensor from a page, ordered by time, and
+    queues the result on the batch. While the last two records stay the same, a reading can only insert a row or move
+    the newest timestamp, so the run of readings that only move it is found with one vectorized comparison and
+    becomes a single move to the last time of the run. Each insert changes the last two records and starts the next
+    run. The stored rows are the same as with one check_and_insert_data() call per reading.
+    """
+    import numpy as np
+
+    count = len(temps)
+    index = 0
+    while index < count:
+        last_records = batch.get_last_records(sensor_id)
+        if len(last_records) >= 2:
+            last_temp, last_time = last_records[0]
+            last_last_temp, last_last_time = last_records[1]
+            if abs(float(last_temp) - float(last_last_temp)) <= max_temp_difference:
+                moves = (np.abs(float(last_last_temp) - temps[index:]) <= max_temp_difference) & \
+                        (np.abs(timestamps[index:] - last_last_time.timestamp()) <= max_time_difference)
+                run = count - index if moves.all() else int(moves.argmin())
+                if run:
+                    index += run
+                    batch.update_timestamp(sensor_id, datetime.fromtimestamp(timestamps[index - 1]))
+                    continue
+
+        batch.insert(float(temps[index]), datetime.fromtimestamp(timestamps[index]), sensor_id)
+        index += 1
+
+
+def page_batch(timestamps: np.ndarray, flush_size: int = None) -> WriteBatch:
     """
-    global esp_devices, exc, lst_request_times
+    Creates a write batch covering the time range of the readings of a /temp page.
+    """
+    if not len(timestamps):
+        return WriteBatch(flush_size=flush_size)
+    return WriteBatch(page_start=float(timestamps.min()), page_end=float(timestamps.max()), flush_size=flush_size)
 
-    retry_count = 0
-    response_data = None
 
-    if is_first_request:
-        get_database()
+class SensorState:
+    """
+    A sensor of a device with its sync cursor and counters.
+    """
+    __slots__ = ('sensor_id', 'device', 'cursor', 'last_reading_time', 'readings')
+
+    def __init__(self, sensor_id: int, device: 'DeviceState', cursor: float = 0.0) -> None:
+        self.sensor_id = sensor_id
+        self.device = device
+        self.cursor = cursor
+        self.last_reading_time = 0.0
+        self.readings = 0
+
+
+class DeviceState:
+    """
+    A discovered board with its sensors, health and request counters. Every device has a circuit breaker: after
+    'breaker-failures' failed fetches in a row it opens and the device is skipped until `open_until`, with a backoff
+    doubling from 'breaker-backoff' up to 'breaker-max-backoff' seconds. After the backoff one fetch is tried again
+    (half-open), and the first success closes the breaker.
+    """
+    __slots__ = ('ip', 'sensors', 'needs_first_fetch', 'successes', 'failures', 'retries', 'last_success', 'remain',
+                 'consecutive_failures', 'open_until', 'polling')
+
+    def __init__(self, ip: str) -> None:
+        self.ip = ip
+        self.sensors = {}
+        self.needs_first_fetch = True
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.last_success = 0.0
+        self.remain = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.polling = False
+
+    def record_success(self) -> None:
+        self.successes += 1
+        self.last_success = time.time()
+        if self.consecutive_failures >= breaker_failures:
+            logger.info(f"Device {self.ip} is responding again")
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self) -> float:
+        """
+        Counts a failed fetch and opens the breaker once there were enough of them in a row. Returns the backoff in
+        seconds, or 0 while the breaker stays closed.
+        """
+        self.failures += 1
+        self.consecutive_failures += 1
+        trips = self.consecutive_failures - breaker_failures
+        if trips < 0:
+            return 0.0
+        backoff = min(breaker_max_backoff, breaker_backoff * 2 ** min(trips, 30))
+        # Jitter spreads the retries of boards that failed together, e.g. after a switch restart
+        backoff *= random.uniform(0.5, 1.0)
+        self.open_until = time.time() + backoff
+        return backoff
+
+    def is_open(self) -> bool:
+        return time.time() < self.open_until
+
+
+class DeviceRegistry:
+    """
+    All known devices and sensors, indexed by IP and by sensor id. The sync cursors of the sensors (time of the newest
+    stored reading) are persisted in a small state file, so a restart costs one page per device instead of a full
+    resync. Cursors of devices that were not discovered again yet are kept until they come back. The file also keeps
+    the sensor ids of every device, so a restart can poll the known devices before discovery found them again.
+    """
+
+    def __init__(self, path: str = 'data/sync_state.json') -> None:
+        self.path = path
+        self.devices = {}
+        self.sensors = {}
+        self.restored = {}
+        self.snapshot = {}
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.added = threading.Event()
+
+    def add(self, device_ip: str, sensor_ids: list) -> list:
+        """
+        Registers the sensors of a device that are not known yet. Returns the ids of the added sensors.
+        """
+        added = []
+        with self.lock:
+            device = self.devices.get(device_ip)
+            for sensor_id in sensor_ids:
+                cursor = self.restored.get(device_ip, {}).pop(sensor_id, 0.0)
+                known = self.sensors.get(sensor_id)
+                if known is not None:
+                    if known.device.ip == device_ip:
+                        continue
+                    # The board answered from a new address, e.g. after a DHCP lease change
+                    self._move_sensor(known)
+                    cursor = max(cursor, known.cursor)
+                if device is None:
+                    device = self.devices[device_ip] = DeviceState(device_ip)
+                device.sensors[sensor_id] = self.sensors[sensor_id] = SensorState(sensor_id, device, cursor)
+                device.needs_first_fetch = True
+                added.append(sensor_id)
+            if added:
+                self.dirty = True
+                self.added.set()
+        return added
+
+    def restore_devices(self) -> int:
+        """
+        Registers the devices of the last run from the state file. Discovery confirms them later, or moves their sensors
+        if a board answers from a new address. Returns the number of restored devices.
+        """
+        with self.lock:
+            snapshot, self.snapshot = self.snapshot, {}
+            for device_ip, sensor_ids in snapshot.items():
+                self.add(device_ip, sensor_ids)
+            return len(snapshot)
+
+    def _move_sensor(self, sensor: SensorState) -> None:
+        old_device = sensor.device
+        old_device.sensors.pop(sensor.sensor_id, None)
+        self.sensors.pop(sensor.sensor_id, None)
+        if not old_device.sensors:
+            self.devices.pop(old_device.ip, None)
+            logger.warning(f"Device {old_device.ip} moved to a new address")
+        self.dirty = True
+
+    def get(self, device_ip: str) -> DeviceState | None:
+        return self.devices.get(device_ip)
+
+    def claim(self, device_ips: list) -> list:
+        """
+        Returns the given devices whose circuit breaker is not open and that are not being polled already, and marks
+        them as being polled until done() is called.
+        """
+        with self.lock:
+            claimed = [
+                device_ip for device_ip in device_ips
+                if device_ip in self.devices and not self.devices[device_ip].is_open()
+                and not self.devices[device_ip].polling
+            ]
+            for device_ip in claimed:
+                self.devices[device_ip].polling = True
+            return claimed
+
+    def done(self, device_ip: str) -> None:
+        with self.lock:
+            device = self.devices.get(device_ip)
+            if device is not None:
+                device.polling = False
+
+    def ips(self) -> list:
+        with self.lock:
+            return list(self.devices)
+
+    def take_new(self) -> list:
+        """
+        Returns the devices waiting for their first fetch and clears their flag.
+        """
+        with self.lock:
+            new_devices = [device.ip for device in self.devices.values() if device.needs_first_fetch]
+            for device_ip in new_devices:
+                self.devices[device_ip].needs_first_fetch = False
+        return new_devices
+
+    def cursors(self, device_ip: str) -> dict:
+        with self.lock:
+            device = self.devices.get(device_ip)
+            if device is None:
+                return dict(self.restored.get(device_ip, {}))
+            return {sensor_id: sensor.cursor for sensor_id, sensor in device.sensors.items() if sensor.cursor}
+
+    def device_sensors(self) -> dict:
+        with self.lock:
+            return {device_ip: list(device.sensors) for device_ip, device in self.devices.items()}
+
+    def all_cursors(self) -> dict:
+        with self.lock:
+            return {
+                device_ip: {sensor_id: sensor.cursor for sensor_id, sensor in device.sensors.items() if sensor.cursor}
+                for device_ip, device in self.devices.items()
+            }
+
+    def adopt(self, device_ip: str, sensor_ids: list, cursors: dict) -> None:
+        """
+        Takes a device over from another worker: registers its sensors, moves their cursors forward to the ones the
+        previous holder saved and queues the device for its first fetch.
+        """
+        with self.lock:
+            self.add(device_ip, sensor_ids)
+            self.advance(device_ip, cursors)
+            device = self.devices.get(device_ip)
+            if device is not None:
+                device.needs_first_fetch = True
+
+    def note_readings(self, newest: dict, counts: dict) -> None:
+        """
+        Records the newest reading time and the number of stored readings of every sensor in a page.
+        """
+        with self.lock:
+            for sensor_id, reading_time in newest.items():
+                sensor = self.sensors.get(sensor_id)
+                if sensor is not None:
+                    sensor.last_reading_time = max(sensor.last_reading_time, reading_time)
+                    sensor.readings += counts.get(sensor_id, 0)
+
+    def advance(self, device_ip: str, newest: dict) -> None:
+        """
+        Moves the cursors of a device forward to the newest stored reading time of each given sensor.
+        """
+        with self.lock:
+            device = self.devices.get(device_ip)
+            for sensor_id, reading_time in newest.items():
+                sensor = self.sensors.get(sensor_id)
+                if sensor is None:
+                    if device is None:
+                        continue
+                    sensor = device.sensors[sensor_id] = self.sensors[sensor_id] = SensorState(sensor_id, device)
+                if reading_time > sensor.cursor:
+                    sensor.cursor = reading_time
+                    self.dirty = True
+
+    def load(self) -> None:
         try:
-            while retry_count < max_retries:
-                url = f"http://{device_ip}/temp?limit=100"
-                response = requests.get(url, timeout=5)
-                response.raise_for_status()
-                if response.status_code != 204:
-                    response_data = response.json()
-                    break
-        except:
-            retry_count += 1
-            if retry_count == max_retries:
-                logger.error(f"Max retries reached for {device_ip}. Disconnecting device")
-                _disconnect_device(device_ip)
-                return False
+            with open(self.path) as f:
+                state = json.load(f)
+            restored = {
+                device_ip: {int(sensor_id): float(reading_time) for sensor_id, reading_time in sensors.items()}
+                for device_ip, sensors in state.get('devices', {}).items()
+            }
+            snapshot = {
+                device_ip: [int(sensor_id) for sensor_id in sensor_ids]
+                for device_ip, sensor_ids in state.get('sensors', {}).items()
+            }
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Cant read sync state {self.path}, devices will be fully resynced: {e}")
+            return
+
+        with self.lock:
+            self.restored = restored
+            self.snapshot = snapshot
+        logger.info(f"Loaded sync cursors for {len(self.restored)} devices")
+
+    def save(self) -> None:
+        """
+        Writes the cursors and the device map if they changed. The file is replaced atomically, so a crash never
+        leaves it half written.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            devices = {device_ip: dict(sensors) for device_ip, sensors in self.restored.items() if sensors}
+            for device_ip, device in self.devices.items():
+                devices.setdefault(device_ip, {}).update(
+                    {sensor_id: sensor.cursor for sensor_id, sensor in device.sensors.items() if sensor.cursor}
+                )
+            sensors = {device_ip: list(sensor_ids) for device_ip, sensor_ids in self.snapshot.items()}
+            sensors.update({device_ip: list(device.sensors) for device_ip, device in self.devices.items()})
+            self.dirty = False
 
         try:
-            remain = response_data["remain"]
-            temperatures = response_data["temperature_data"]
-        except:
-            logger.warning("Response data was empty")
-            return False
-        curr_time = time.time()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'devices': devices, 'sensors': sensors}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Cant save sync state {self.path}: {e}")
+            with self.lock:
+                self.dirty = True
 
-        rec = []
-        for record in temperatures:
-            sensor = record['id']
-            temperature = record['t']
-            entry_time_ms = record['ti']
 
-            if sensor not in lst_request_times:
-                lst_request_times[sensor] = 0
+registry = DeviceRegistry()
 
-            if entry_time_ms > lst_request_times[sensor]:
-                lst_request_times[sensor] = curr_time - entry_time_ms / 1000
 
-            if int(temperature) != -127:
-                check_and_insert_data(temperature, curr_time - entry_time_ms / 1000, sensor)
-                if not any(sensor_id[0] == sensor for sensor_id in rec):
-                    rec.append((sensor, 1))
-                else:
-                    for i in range(len(rec)):
-                        if rec[i][0] == sensor:
-                            rec[i] = (sensor, rec[i][1] + 1)
+class TempPage:
+    """
+    One /temp page as arrays, newest reading first: temperatures, ages in milliseconds and sensor ids, plus the number
+    of matching records the device did not send and whether the device pages by buffer position ("skip").
+    """
+    __slots__ = ('temps', 'ages', 'sensor_ids', 'remain', 'skips')
 
-        rec = sorted(rec, key=lambda x: x[0])
-        message = ', '.join(f'sensor {sensor_id}: {count} rec' for sensor_id, count in rec)
-        if message != '':
-            logger.info(f"Read {message}, remaining {remain} records from sensors")
+    def __init__(self, temps: np.ndarray, ages: np.ndarray, sensor_ids: np.ndarray, remain: int,
+                 skips: bool = False) -> None:
+        self.temps = temps
+        self.ages = ages
+        self.sensor_ids = sensor_ids
+        self.remain = remain
+        self.skips = skips
+
+    def __len__(self) -> int:
+        return len(self.temps)
+
+    @classmethod
+    def empty(cls) -> 'TempPage':
+        import numpy as np
+
+        return cls(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64), 0)
+
+
+# Binary /temp page (format=bin): 'T', format version, record count (uint16) and remain (uint32), followed by one
+# record per reading: the 16 bit word from encode() and the age in milliseconds (uint32), all little-endian
+PAGE_HEADER = struct.Struct('<cBHI')
+PAGE_RECORD = [('word', '<u2'), ('age', '<u4')]
+
+
+def decode_binary_page(content: bytes) -> TempPage:
+    """
+    Decodes a binary /temp page into arrays without creating an object per reading.
+    """
+    import numpy as np
+
+    magic, version, count, remain = PAGE_HEADER.unpack_from(content)
+    if magic != b'T' or version != 1:
+        raise ValueError(f"Unknown /temp page format {magic!r} {version}")
+
+    records = np.frombuffer(content, dtype=PAGE_RECORD, count=count, offset=PAGE_HEADER.size)
+    words = records['word'].astype(np.int64)
+    # Same as decodeTemp(): tenths of a degree in the low 11 bits and the sign in bit 12
+    temps = (words & 0x7FF) / 10.0
+    temps[(words >> 12) & 1 == 1] *= -1
+    # Every firmware with the binary format knows "skip"
+    return TempPage(temps, records['age'].astype(np.float64), words >> 13, remain, skips=True)
 
-        if remain > 0:
-            get_esp8266_data(device_ip, start_time, is_first_request=False, entry_time_ms=entry_time_ms, remain=remain)
-        return True
+
+def decode_json_page(data: dict) -> TempPage:
+    """
+    Converts a JSON /temp page of boards without the binary format into arrays.
+    """
+    import numpy as np
+
+    records = data["temperature_data"]
+    count = len(records)
+    return TempPage(
+        np.fromiter((record['t'] for record in records), dtype=np.float64, count=count),
+        np.fromiter((record['ti'] for record in records), dtype=np.float64, count=count),
+        np.fromiter((record['id'] for record in records), dtype=np.int64, count=count),
+        int(data["remain"]),
+        skips="skip" in data
+    )
+
+
+def fetch_temp_page(device_ip: str, query, max_retries: int = 3) -> tuple[TempPage, float] | None:
+    """
+    Requests one /temp page from a device and retries failed requests. The query string is built by calling `query`
+    right before every attempt, so time offsets stay accurate. The binary format is requested when
+    'binary-transfer' is on; boards that dont know it answer with JSON, which is decoded into the same arrays.
+    Returns the decoded page with the time it was received, or None if all attempts failed; the failure is counted by
+    the device's circuit breaker.
+    """
+    import requests
 
     retry_count = 0
+    device = registry.get(device_ip)
+    page_format = "&format=bin" if binary_transfer else ""
 
     while retry_count < max_retries:
         try:
-            if remain > 0:
-                url = f"http://{device_ip}/temp?time={entry_time_ms}&limit={100}"
-            else:
-                url = f"http://{device_ip}/temp?time={int(round(time.time() - min(start_time.values()))) + 10}&limit=100"
+            with stage_seconds.time('fetch'):
+                response = requests.get(device_url(device_ip, f"/temp?{query()}{page_format}"), timeout=5)
+                response.raise_for_status()
+            with stage_seconds.time('decode'):
+                if response.status_code == 204:
+                    page = TempPage.empty()
+                elif response.headers.get('Content-Type', '').startswith('application/octet-stream'):
+                    page = decode_binary_page(response.content)
+                else:
+                    page = decode_json_page(response.json())
+            if device is not None:
+                device.record_success()
+            return page, time.time()
+        except Exception:
+            retry_count += 1
+            if device is not None:
+                device.retries += 1
 
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            if response.status_code != 204:
-                response_data = response.json()
-                break
+    if device is None:
+        logger.error(f"Max retries reached for {device_ip}")
+        return None
 
-        except:
-            retry_count += 1
-            if retry_count == max_retries:
-                logger.error(f"Max retries reached for {device_ip}. Disconnecting device")
-                _disconnect_device(device_ip)
-                return False
+    backoff = device.record_failure()
+    if not backoff:
+        logger.warning(f"Max retries reached for {device_ip}, trying again in the next cycle")
+        return None
+
+    logger.error(f"Device {device_ip} failed {device.consecutive_failures} times in a row, pausing it for {backoff:.0f} s")
+    if reset_board and device.consecutive_failures == breaker_failures:
+        reset_device(device_ip)
+    return None
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """
+    Returns the pool that requests the next backlog page while the current one is written. It is kept apart from the
+    polling pool, so pollers waiting for their prefetched pages can never starve it.
+    """
+    global prefetch_executor, prefetch_executor_size
+
+    if prefetch_executor is None or prefetch_executor_size != poll_workers:
+        if prefetch_executor is not None:
+            prefetch_executor.shutdown(wait=False)
+        prefetch_executor = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix="prefetch")
+        prefetch_executor_size = poll_workers
+    return prefetch_executor
 
+
+def sensor_values(sensor_ids: np.ndarray, values: dict, default: float) -> np.ndarray:
+    """
+    Maps per-sensor values (marks, cursors) onto the readings of a page.
+    """
+    import numpy as np
+
+    result = np.full(len(sensor_ids), default, dtype=np.float64)
+    for sensor_id, value in values.items():
+        result[sensor_ids == sensor_id] = value
+    return result
+
+
+def not_fetched(fetched: dict, timestamps: np.ndarray, sensor_ids: np.ndarray) -> np.ndarray:
+    """
+    Marks the readings of a page that were not fetched before and adds them to `fetched`, the sorted reading times
+    per sensor. A sensor measures at most once per second, so a reading within 0.5 s of a fetched one of the same
+    sensor is that reading sent again.
+    """
+    import numpy as np
+
+    fresh = np.ones(len(timestamps), dtype=bool)
+    for sensor_id in np.unique(sensor_ids).tolist():
+        selected = np.flatnonzero(sensor_ids == sensor_id)
+        times = fetched.get(sensor_id, np.empty(0))
+        if len(times):
+            index = np.searchsorted(times, timestamps[selected] - 0.5)
+            nearest = times[np.minimum(index, len(times) - 1)]
+            fresh[selected] = (index == len(times)) | (nearest >= timestamps[selected] + 0.5)
+        fetched[sensor_id] = np.sort(np.concatenate((times, timestamps[selected[fresh[selected]]])))
+    return fresh
+
+
+def store_readings(temps: np.ndarray, timestamps: np.ndarray, sensor_ids: np.ndarray, fence=None,
+                   before_commit=None) -> dict | None:
+    """
+    Runs the insert/move decisions for the readings of one page in a single write batch, sensor by sensor in time
+    order. Returns the number of stored readings per sensor, or None if the batch could not be written. `fence` is
+    the lease check of the device in sharded mode. With `before_commit` all readings are written in one transaction
+    and it is called in there right before the commit.
+    """
+    import numpy as np
+    from hot_tier import is_connected
+
+    counts = {}
+    newest = {}
+    valid = is_connected(temps)
     try:
-        remain = response_data["remain"]
-        temperatures = response_data["temperature_data"]
-    except:
-        logger.warning("Response data was empty")
-        return False
-    curr_time = time.time()
+        with db_session():
+            # Every reading is at most one write
+            batch = page_batch(timestamps, len(temps) + 1 if before_commit is not None else None)
+            batch.fence = fence
+            batch.before_commit = before_commit
+            for sensor_id in np.unique(sensor_ids).tolist():
+                of_sensor = sensor_ids == sensor_id
+                newest[sensor_id] = float(timestamps[of_sensor].max())
+                of_sensor &= valid
+                if not of_sensor.any():
+                    continue
+
+                sensor_temps, sensor_times = temps[of_sensor], timestamps[of_sensor]
+                order = np.lexsort((sensor_temps, sensor_times))
+                with stage_seconds.time('decision'):
+                    check_and_insert_page(sensor_temps[order], sensor_times[order], sensor_id, batch)
+                counts[sensor_id] = len(order)
+            batch.flush()
+    except database_errors() as e:
+        logger.error(f"Error storing readings: {e}")
+        return None
+
+    if batch.failed:
+        return None
+    registry.note_readings(newest, counts)
+    return counts
+
+
+def spool_readings(temps: np.ndarray, timestamps: np.ndarray, sensor_ids: np.ndarray) -> dict | None:
+    """
+    Appends the readings of one page to the local spool, for the spool writer to store. Returns once they are on disk
+    with the number of valid readings per sensor, or None if the spool could not be written.
+    """
+    import numpy as np
+    from hot_tier import is_connected
 
-    rec = []
-    get_database()
-    for record in temperatures:
-        temperature = record['t']
-        entry_time_ms = record['ti']
-        sensor_id = record['id']
+    if not len(temps):
+        return {}
+    try:
+        with stage_seconds.time('spool'):
+            reading_spool.append(temps, timestamps, sensor_ids)
+    except OSError as e:
+        logger.error(f"Error writing readings to the spool: {e}")
+        return None
+    spool_writer.wake.set()
 
-        if curr_time - entry_time_ms / 1000 > start_time.get(sensor_id, 0):
-            lst_request_times[sensor_id] = curr_time - entry_time_ms / 1000
+    valid = is_connected(temps)
+    ids, counts = np.unique(sensor_ids[valid], return_counts=True)
+    return dict(zip(ids.tolist(), counts.tolist()))
 
-        check_and_insert_data(temperature, curr_time - entry_time_ms / 1000, sensor_id)
 
-        if not any(sensor[0] == sensor_id for sensor in rec):
-            rec.append((sensor_id, 1))
-        else:
-            for i in range(len(rec)):
-                if rec[i][0] == sensor_id:
-                    rec[i] = (sensor_id, rec[i][1] + 1)
+class SpoolWriter(threading.Thread):
+    """
+    Drains the spool into MySQL, up to 'spool-drain-size' readings per transaction. The spool position after the
+    readings is stored in the same transaction, so readings stored just before a crash are skipped after the restart
+    instead of being decided again. While the database is not reachable or a batch fails, the readings stay in the
+    spool and the writer retries with a growing pause.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="spool-writer", daemon=True)
+        self.wake = threading.Event()
+        self.failures = 0
+        self.synced = False
+
+    def sync(self) -> None:
+        """
+        Moves the spool past the readings the database already has.
+        """
+        from spool import create_progress_table, stored_position
 
-    rec = sorted(rec, key=lambda x: x[0])
+        with db_session() as session:
+            create_progress_table(session.cursor, session.dialect)
+            position = stored_position(session.cursor, reading_spool.spool_id)
+            session.commit()
+        if position is not None:
+            reading_spool.commit(position)
+        self.synced = True
 
-    message = ', '.join(f'sensor {sensor_id}: {count} rec' for sensor_id, count in rec)
-    if message != '':
-        logger.info(f"Read {message}, remaining {remain} records from sensors")
+    def drain(self) -> int | None:
+        """
+        Stores the next chunk of spooled readings. Returns their number, or None if they could not be stored.
+        """
+        from spool import store_position
+
+        if not self.synced:
+            self.sync()
+        chunk = reading_spool.read(spool_drain_size)
+        if chunk is None:
+            return 0
+        records, position = chunk
+
+        def save_position(session: Session) -> None:
+            store_position(session.cursor, session.dialect, reading_spool.spool_id, position)
+
+        if len(records) and store_readings(
+            records['temp'], records['time'], records['sensor_id'], before_commit=save_position
+        ) is None:
+            return None
+        reading_spool.commit(position)
+        return len(records)
+
+    def run(self) -> None:
+        while True:
+            try:
+                drained = self.drain()
+            except (*database_errors(), OSError) as e:
+                logger.error(f"Error draining the spool: {e}")
+                drained = None
+
+            if drained is None:
+                # The spool file may lag behind the database now
+                self.synced = False
+                self.failures += 1
+                pause = min(30, 2 ** self.failures)
+                logger.warning(f"Spooled readings are kept, storing them again in {pause} s")
+                time.sleep(pause)
+            elif drained == 0:
+                self.failures = 0
+                self.wake.wait(1)
+                self.wake.clear()
+            else:
+                self.failures = 0
 
-    if remain > 0:
-        get_esp8266_data(device_ip, start_time, is_first_request=False, entry_time_ms=entry_time_ms, remain=remain)
 
-    return True
+reading_spool = None
+spool_writer = SpoolWriter()
 
 
-def _disconnect_device(device_ip: str) -> bool or None:
-    global esp_devices, exc, disconnect
+def open_spool(start_writer: bool = True) -> None:
+    """
+    Opens the spool with the configured limits and starts the spool writer, which first stores what a previous run
+    left behind.
+    """
+    global reading_spool
+    from spool import Spool
 
-    if not reset_board:
-        logger.warning(f"Device {device_ip} was disconnected")
-        for i in range(0, len(esp_devices)):
-            if esp_devices[i][0] == device_ip:
-                del lst_request_times[esp_devices[i][1]]
-        esp_devices = [item for item in esp_devices if item[0] != device_ip]
-        disconnect = True
-        return False
-    else:
-        try:
-            response = requests.get(f"http://{device_ip}/exit", timeout=5)
-            if response.status_code == 200:
-                logger.info(f"Device {device_ip} was reset")
-                return True
+    reading_spool = Spool(spool_dir, spool_max_bytes, spool_segment_bytes, spool_fsync_interval)
+    reading_spool.open()
+    pending = reading_spool.pending_bytes()
+    if pending:
+        logger.info(f"Replaying {pending} bytes of spooled readings")
+    atexit.register(reading_spool.close)
+    if start_writer:
+        spool_writer.start()
+
+
+def get_esp8266_data(device_ip: str, max_retries=3) -> bool:
+    """
+    Fetches temperature data from an ESP8266 device, processes it, and inserts valid records into the database. It
+    retries up to a specified number of times if the request fails. Pages are read newest first and only readings
+    newer than the device's sync cursors are stored; older pages are drained only until the cursors are reached. A
+    backlog is drained in a loop: the next page is requested while the current one is written. Each page continues at
+    the buffer position where the previous one ended ("skip"), so readings whose timestamp the board moved in place are
+    not missed; boards with older firmware ignore "skip" and are paged on the age of the last record returned instead.
+    Readings fetched twice are dropped by sensor and time. The cursors move forward once the whole backlog was stored.
+    """
+    import numpy as np
+
+    cursors = registry.cursors(device_ip)
+    fetched = {}
+    marks = {}
+    newest = {}
+    position = 0
+    page = fetch_temp_page(device_ip, lambda: "limit=100", max_retries)
+
+    while True:
+        if page is None:
+            return False
+
+        temp_page, curr_time = page
+        remain = temp_page.remain
+        readings_total.inc(amount=len(temp_page))
+        device = registry.get(device_ip)
+        if device is not None:
+            device.remain = remain
+
+        timestamps = curr_time - temp_page.ages / 1000
+        sensor_ids = temp_page.sensor_ids
+        fresh = not_fetched(fetched, timestamps, sensor_ids)
+        position += len(temp_page)
+        for sensor_id in np.unique(sensor_ids[fresh]).tolist():
+            sensor_times = timestamps[fresh & (sensor_ids == sensor_id)]
+            marks[sensor_id] = min(marks.get(sensor_id, np.inf), float(sensor_times.min()))
+            newest[sensor_id] = max(newest.get(sensor_id, -np.inf), float(sensor_times.max()))
+
+        caught_up = bool(marks) and all(
+            sensor_id in cursors and mark <= cursors[sensor_id] for sensor_id, mark in marks.items()
+        )
+        new = fresh & (timestamps > sensor_values(sensor_ids, cursors, 0.0) + 0.5)
+
+        next_page = None
+        if remain > 0 and not caught_up and fresh.any():
+            if temp_page.skips:
+                def next_query(skip=position):
+                    return f"skip={skip}&limit=100"
             else:
-                logger.error("Device not responding. Try to restart device.")
-                logger.warning(f"Device {device_ip} was disconnected")
-                for i in range(0, len(esp_devices)):
-                    if esp_devices[i][0] == device_ip:
-                        del lst_request_times[esp_devices[i][1]]
-
-                esp_devices = [item for item in esp_devices if item[0] != device_ip]
-                disconnect = True
-                return False
+                def next_query(last_time=float(timestamps[-1])):
+                    return f"time={max(0, int((time.time() - last_time) * 1000))}&limit=100"
+            next_page = get_prefetch_executor().submit(fetch_temp_page, device_ip, next_query, max_retries)
+
+        if coordinator is not None and coordinator.holds(device_ip) is None:
+            logger.warning(f"Lease of device {device_ip} ran out, leaving its readings to the next holder")
+            if next_page is not None:
+                next_page.cancel()
+            return False
 
-        except Exception:
-            logger.error("Device not responding. Try to restart device.")
-            logger.warning(f"Device {device_ip} was disconnected")
-            for i in range(0, len(esp_devices)):
-                if esp_devices[i][0] == device_ip:
-                    del lst_request_times[esp_devices[i][1]]
-
-            esp_devices = [item for item in esp_devices if item[0] != device_ip]
-            disconnect = True
+        hot_tier.add(temp_page.temps[new], timestamps[new], sensor_ids[new])
+        if alert_engine is not None:
+            with stage_seconds.time('alerts'):
+                alert_engine.add(temp_page.temps[new], timestamps[new], sensor_ids[new])
+        if reading_spool is not None and coordinator is None:
+            counts = spool_readings(temp_page.temps[new], timestamps[new], sensor_ids[new])
+        else:
+            fence = coordinator.fence(device_ip) if coordinator is not None else None
+            counts = store_readings(temp_page.temps[new], timestamps[new], sensor_ids[new], fence)
+        if counts is None:
+            if next_page is not None:
+                next_page.cancel()
             return False
 
+        message = ', '.join(f'sensor {sensor_id}: {count} rec' for sensor_id, count in sorted(counts.items()))
+        if message != '':
+            logger.sampled('page', f"Read {message}, remaining {remain} records from sensors")
+        if counts and not first_readings.is_set():
+            first_readings.set()
+            logger.info(f"First readings stored {(time.perf_counter() - started_at) * 1000:.0f} ms after start")
+
+        if next_page is None:
+            if remain > 0 and not caught_up:
+                logger.warning(f"Device {device_ip} sent no new readings, stopping with {remain} remaining records")
+            registry.advance(device_ip, newest)
+            return True
+        page = next_page.result()
+
+
+def reset_device(device_ip: str) -> bool:
+    """
+    Asks a failing board to clear its memory and restart measuring ('RST_board_after_fail').
+    """
+    import requests
+
+    try:
+        response = requests.get(device_url(device_ip, "/exit"), timeout=5)
+        if response.status_code == 200:
+            logger.info(f"Device {device_ip} was reset")
+            return True
+    except requests.RequestException:
+        pass
+    logger.error("Device not responding. Try to restart device.")
+    return False
+
 
-def get_devices() -> None:
+def get_poll_executor() -> ThreadPoolExecutor:
     """
-    Disconnects a device by either resetting it via an HTTP request or simply removing it from the list of devices.
-    It logs the disconnection and removes associated data from esp_devices and lst_request_times.
+    Returns the shared device polling pool, recreating it when 'poll-workers' was changed in the config.
     """
+    global poll_executor, poll_executor_size
+
+    if poll_executor is None or poll_executor_size != poll_workers:
+        if poll_executor is not None:
+            poll_executor.shutdown(wait=False)
+        poll_executor = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix="poll")
+        poll_executor_size = poll_workers
+    return poll_executor
+
+
+def poll_device(device_ip: str) -> bool:
     try:
-        global sock, exc
-        message = f"DISCOVER"
+        return get_esp8266_data(device_ip=device_ip)
+    finally:
+        registry.done(device_ip)
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.bind(("0.0.0.0", UDP_PORT))
-        sock.sendto(message.encode(), (UDP_IP, UDP_PORT))
-        sock.settimeout(2)
 
-        sock.sendto(message.encode(), (UDP_IP, UDP_PORT))
+def poll_devices(device_ips: list) -> None:
+    """
+    Fetches data from every given device whose circuit breaker is not open. With more than one poll worker all devices
+    are fetched in parallel, so a slow or dead board only delays itself; each device keeps its own retries and breaker.
+    In sharded mode only the devices this worker holds the lease of are fetched.
+    """
+    device_ips = list(dict.fromkeys(device_ips))
+    if coordinator is not None:
+        device_ips = [device_ip for device_ip in device_ips if coordinator.holds(device_ip) is not None]
+    # A device still draining its backlog in the catch-up thread is skipped
+    device_ips = registry.claim(device_ips)
+
+    if poll_workers <= 1:
+        for ip in device_ips:
+            poll_device(ip)
+        registry.save()
+        return
+
+    executor = get_poll_executor()
+    futures = {executor.submit(poll_device, ip): ip for ip in device_ips}
+    for future, ip in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"Polling device {ip} failed: {e}")
+    registry.save()
 
+
+def register_device(device_ip: str, sensor_ids: list) -> None:
+    """
+    Adds the sensors of a discovered device that are not known yet and queues the device for its first fetch.
+    """
+    for sensor_id in registry.add(device_ip, sensor_ids):
+        logger.info(f"Added meter device {device_ip} with id: {sensor_id}")
+
+
+discovery = DiscoveryService(logger, register_device)
+coordinator: ShardCoordinator | None = None
+
+
+class ShardService(threading.Thread):
+    """
+    Heartbeat of a sharded worker ('shard' or --workers). Every 'shard-heartbeat-seconds' it publishes the discovered
+    devices, renews the leases of this worker and takes devices over or hands them back as workers join and leave.
+    While the database is not reachable the leases run out and the worker stops polling.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="shards", daemon=True)
+        self.failing = False
+
+    def beat(self) -> None:
+        with db_session() as session:
+            try:
+                acquired, released = coordinator.heartbeat(session, registry.device_sensors(), registry.all_cursors())
+            except database_errors():
+                session.rollback()
+                raise
+
+        for device_ip, (sensor_ids, cursors) in acquired.items():
+            registry.adopt(device_ip, sensor_ids, cursors)
+            # The previous holder wrote these sensors, so their cached last records are stale
+            for sensor_id in sensor_ids:
+                sensor_cache.invalidate(sensor_id)
+        if acquired:
+            logger.info(f"Took over {len(acquired)} devices: {', '.join(sorted(acquired))}")
+        if released:
+            logger.info(f"Handed {len(released)} devices over to other workers: {', '.join(sorted(released))}")
+
+    def run(self) -> None:
         while True:
             try:
-                data, addr = sock.recvfrom(1024)
-            except TimeoutError:
-                break
-
-            if data:
-                data = data.decode()
-                if "DEVICE" in data:
-                    match = re.search(r'\[([0-9, ]+)\]', data)
-                    list_string = match.group(0)
-                    device = eval(list_string)
-
-                    for i in range(0, len(device)):
-                        found = any(device[i] in sublist for sublist in esp_devices)
-                        if not found:
-                            esp_devices.append([addr[0], device[i]])
-                            logger.info(f"Added meter device {addr[0]} with id: {device[i]}")
-                            if device[i] not in lst_request_times:
-                                lst_request_times[device[i]] = 0
-                            exc.append([addr[0], device[i]])
-            else:
-                break
-    except OSError:
-        check_internet_connection()
+                self.beat()
+                if self.failing:
+                    logger.info("Shard heartbeat is working again")
+                    self.failing = False
+            except database_errors() as e:
+                if not self.failing:
+                    logger.error(f"Shard heartbeat failed, polling stops when the leases run out: {e}")
+                    self.failing = True
+            time.sleep(shard_heartbeat)
+
+    def stop(self) -> None:
+        """
+        Hands all leases back on exit, so the other workers take the devices over at their next heartbeat.
+        """
+        try:
+            with db_session() as session:
+                coordinator.release_all(session, registry.all_cursors())
+        except database_errors() as e:
+            logger.warning(f"Cant release the device leases, they are taken over when they run out: {e}")
+
+
+shard_service = ShardService()
+
+
+def start_shard_service() -> None:
+    global coordinator, worker_id
+    from shards import ShardCoordinator, default_worker_id
+
+    worker_id = worker_id or default_worker_id()
+    coordinator = ShardCoordinator(worker_id, shard_lease_seconds, shard_replicas)
+    logger.info(f"Running as sharded worker {worker_id}")
+    atexit.register(shard_service.stop)
+    shard_service.start()
 
 
-def set_params() -> None:
+def device_metrics() -> list:
     """
-    Discovers devices on the network by sending a broadcast message and listening for responses.
+    Per-device request counters and backlog, read from the registry on every scrape.
     """
-    for i in range(0, len(esp_devices)):
+    device_requests = Counter('esp_device_requests_total', "Device /temp requests by result", ('device', 'result'))
+    remain = Gauge('esp_device_remain_records', "Records left on the device after its last page", ('device',))
+    breaker_open = Gauge('esp_device_breaker_open', "1 while the device is paused by its circuit breaker", ('device',))
+    devices = Gauge('esp_devices', "Known devices")
+    online = Gauge('esp_lan_online', "1 if the last connectivity probe reached LAN_host")
+    with registry.lock:
+        for device in registry.devices.values():
+            device_requests.values[(device.ip, 'success')] = device.successes
+            device_requests.values[(device.ip, 'failure')] = device.failures
+            device_requests.values[(device.ip, 'retry')] = device.retries
+            remain.values[(device.ip,)] = device.remain
+            breaker_open.values[(device.ip,)] = int(device.is_open())
+        devices.values[()] = len(registry.devices)
+    online.values[()] = int(connectivity.online.is_set())
+    return [device_requests, remain, breaker_open, devices, online]
+
+
+metrics.add_collector(device_metrics)
+
+
+def spool_metrics() -> list:
+    """
+    Spool backlog and losses, read from the spool on every scrape.
+    """
+    if reading_spool is None:
+        return []
+    pending = Gauge('esp_spool_pending_bytes', "Spooled bytes of readings not stored in MySQL yet")
+    dropped = Counter('esp_spool_dropped_bytes_total', "Spooled bytes dropped by the 'spool-max-mb' cap")
+    pending.values[()] = reading_spool.pending_bytes()
+    dropped.values[()] = reading_spool.dropped_bytes
+    return [pending, dropped]
+
+
+metrics.add_collector(spool_metrics)
+
+
+def shard_metrics() -> list:
+    """
+    Leases of this worker and size of the ring, in sharded mode.
+    """
+    if coordinator is None:
+        return []
+    leases = Gauge('esp_shard_leases', "Device leases held by this worker")
+    workers = Gauge('esp_shard_workers', "Live collector workers in the hash ring")
+    leases.values[()] = len(coordinator.held)
+    workers.values[()] = len(coordinator.workers)
+    return [leases, workers]
+
+
+metrics.add_collector(shard_metrics)
+
+
+def alert_metrics() -> list:
+    """
+    Alert events per rule and state, active alerts and the events the sinks dropped.
+    """
+    events = Counter('esp_alert_events_total', "Alert events by rule and state (firing, resolved)", ('rule', 'state'))
+    active = Gauge('esp_alerts_active', "Active alerts by rule", ('rule',))
+    dropped = Counter('esp_alert_dropped_total', "Alert events a sink dropped or could not deliver", ('sink',))
+    if alert_engine is None:
+        return [events, active, dropped]
+    with alert_engine.lock:
+        events.values.update(alert_engine.events)
+    for rule, count in alert_engine.active().items():
+        active.values[(rule,)] = count
+    for sink in alert_engine.sinks:
+        dropped.values[(sink.kind,)] = dropped.values.get((sink.kind,), 0) + sink.dropped
+    return [events, active, dropped]
+
+
+metrics.add_collector(alert_metrics)
+
+
+def create_web_app():
+    """
+    Builds the Flask app of the HTTP endpoints. Flask is imported here, in the HTTP thread, so it does not delay the
+    start of polling.
+    """
+    from flask import Flask, Response
+    from api import create_read_api
+
+    web_app = Flask(__name__)
+    web_app.register_blueprint(create_read_api(db_session, response_cache, hot_tier, db_stream_session))
+
+    @web_app.route('/metrics')
+    def metrics_endpoint() -> Response:
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return web_app
+
+
+class HttpService(threading.Thread):
+    """
+    Serves the local HTTP endpoints (/metrics and the /api read API) on 'http-host':'http-port' in the background.
+    A port of 0 disables it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="http", daemon=True)
+        self.server = None
+
+    def run(self) -> None:
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
         try:
-            while True:
-                url = f"http://{esp_devices[i][0]}/setinterval?interval={measurement_interval}"
-                response = requests.get(url, timeout=5)
-                if response.status_code == 200:
-                    break
-            logger.info(
-                f"Time for measurement ({measurement_interval} milliseconds) was set for {esp_devices[i][0]}")
-        except Exception:
-            logger.error(f"Cant set time for {esp_devices[i][0]}")
+            self.server = make_server(http_host, http_port, create_web_app(), threaded=True)
+        except OSError as e:
+            logger.error(f"Cant start HTTP endpoint on {http_host}:{http_port}: {e}")
+            return
+        logger.info(f"Metrics and read API available on http://{http_host}:{http_port}")
+        self.server.serve_forever()
+
 
+http_service = HttpService()
+
+
+def push_param(device_ip: str, path: str, description: str, error: str, max_retries: int = 3) -> bool:
+    """
+    Sends one setting to a device, trying at most max_retries times with a timeout on every request.
+    """
+    import requests
+
+    for _ in range(max_retries):
         try:
-            while True:
-                url = f"http://{esp_devices[i][0]}/setTempDiff?difference={max_temp_difference_esp}"
-                response = requests.get(url)
-                if response.status_code == 200:
-                    break
-            logger.info(
-                f"Max temp difference ({max_temp_difference_esp}C) was set for {esp_devices[i][0]}")
-        except Exception:
-            logger.error(f"Cant set max temp difference for {esp_devices[i][0]}")
+            response = requests.get(device_url(device_ip, path), timeout=5)
+            if response.status_code == 200:
+                logger.info(f"{description} was set for {device_ip}")
+                return True
+        except requests.RequestException:
+            pass
+    logger.error(f"{error} for {device_ip}")
+    return False
 
 
-def internet_on() -> bool:
+def set_params(changed: set = None, device_ips: list = None) -> None:
+    """
+    Pushes the device settings whose config keys changed (all of them without `changed`) to the given devices, or to
+    every known device. The devices are updated concurrently, so an unreachable board only delays itself.
     """
-    Checks internet connection
+    pushes = []
+    if changed is None or 'device-time-measurement' in changed:
+        pushes.append((
+            f"/setinterval?interval={measurement_interval}",
+            f"Time for measurement ({measurement_interval} milliseconds)", "Cant set time"
+        ))
+    if changed is None or 'max_temp_difference_esp' in changed:
+        pushes.append((
+            f"/setTempDiff?difference={max_temp_difference_esp}",
+            f"Max temp difference ({max_temp_difference_esp}C)", "Cant set max temp difference"
+        ))
+    if not pushes:
+        return
+
+    executor = get_poll_executor()
+    if device_ips is None:
+        device_ips = registry.ips()
+    futures = [executor.submit(push_param, device_ip, *push) for device_ip in device_ips for push in pushes]
+    for future in futures:
+        future.result()
+
+
+config_watcher = ConfigWatcher(CONFIG_PATH, logger, interval_between_json_load / 1000)
+
+
+def reload_config() -> None:
+    """
+    Loads a changed config.json and pushes the changed device settings. A file that cant be read or parsed is
+    reported and the previous settings stay in place.
     """
     try:
-        s = socket.create_connection(
-            (LAN_host, 80))
-        if s is not None:
-            s.close
+        changed = load_config()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Cant reload {CONFIG_PATH}, keeping the previous settings: {e}")
+        return
+
+    if changed:
+        set_params(changed)
+        logger.info(f"Configuration params were successfully updated: {', '.join(sorted(changed))}")
+
+
+connectivity = ConnectivityProbe(logger)
+
+
+def check_internet_connection() -> bool:
+    """
+    Returns the last state seen by the connectivity probe without blocking. While the connection is down, every call
+    adds a dot or dash to the waiting animation.
+    """
+    if connectivity.online.is_set():
         return True
-    except OSError:
-        return False
+    connectivity.progress()
+    return False
+
+
+def run_workers(count: int) -> None:
+    """
+    Runs `count` sharded collector processes on this host (--workers) and restarts a worker that exits.
+    """
+    def start(index: int) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker-index', str(index)])
 
+    workers = {index: start(index) for index in range(count)}
+    logger.info(f"Started {count} collector workers")
+    try:
+        while True:
+            time.sleep(5)
+            for index, process in workers.items():
+                if process.poll() is not None:
+                    logger.error(f"Worker {index} exited with code {process.returncode}, starting it again")
+                    workers[index] = start(index)
+    except KeyboardInterrupt:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.wait()
+
+
+class CatchUp(threading.Thread):
+    """
+    Fetches the devices waiting for their first fetch (discovered, restored from the last run or taken over from
+    another worker) in the background, so draining their backlogs never holds up the main loop. The device settings
+    are pushed to them afterwards.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="catch-up", daemon=True)
 
-def check_internet_connection():
-    dots = 0
-    lines = 0
-    if not internet_on():
-        logger.warning("No internet connection.")
-        while not internet_on():
-            if dots < 5:
-                lines = 0
-                dot_or_dash(".")
-                dots += 1
-            elif lines < 5:
-                dot_or_dash("_")
-                lines += 1
-                if lines == 5:
-                    dots = 0
-            time.sleep(1)
-        dot_or_dash("\n")
-    return True
+    def run(self) -> None:
+        while True:
+            registry.added.wait(1)
+            registry.added.clear()
+            if not connectivity.online.is_set():
+                continue
+            new_devices = registry.take_new()
+            if new_devices:
+                poll_devices(new_devices)
+                set_params(device_ips=new_devices)
+
+
+catch_up = CatchUp()
+
+
+def open_database() -> None:
+    """
+    Connects the storage, loads the sensor cache and starts the spool writer. Without a spool the collector cant run
+    without its database and exits.
+    """
+    try:
+        get_database()
+    except database_errors():
+        if reading_spool is None:
+            exit()
+        logger.warning("Starting without the database, readings are spooled until it is reachable")
+    sensor_cache.resync()
+    if reading_spool is not None:
+        spool_writer.start()
 
 
 def setup():
+    """
+    Starts the collector. With 'fast-start' the devices of the last run are polled right away: the database is
+    connected in the background while readings go to the spool, and discovery and backlogs run in their own threads.
+    Otherwise setup waits for the database, the LAN and 'discovery-wait' seconds of discovery and fetches every
+    backlog before returning.
+    """
+    global started_at
+    started_at = time.perf_counter()
     load_config()
-    get_database()
+    registry.load()
+    if alert_engine is not None:
+        for cursors in registry.restored.values():
+            alert_engine.watch(cursors)
+    if spool_enabled and shard_enabled:
+        # The lease fence runs in the transaction that stores a page, which the spool writer does not know of
+        logger.info("Sharded workers store their readings directly, the spool is not used")
+    elif spool_enabled:
+        open_spool(start_writer=False)
+    if fast_start and reading_spool is not None:
+        # Nothing writes to the database before the sensor cache is loaded, the spool writer starts after it
+        threading.Thread(target=open_database, name="open-database", daemon=True).start()
+    else:
+        open_database()
+    if http_port:
+        http_service.start()
+
+    if fast_start:
+        restored = registry.restore_devices()
+        if restored:
+            logger.info(f"Polling {restored} devices of the last run, discovery confirms them in the background")
+        connectivity.check()
+        connectivity.start()
+        discovery.start()
+        if shard_enabled:
+            start_shard_service()
+        catch_up.start()
+        config_watcher.start()
+        return
+
     logger.info('Connecting devices...')
+    connectivity.check()
+    connectivity.start()
+    while not connectivity.online.wait(1):
+        connectivity.progress()
 
-    check_internet_connection()
+    discovery.start()
+    if shard_enabled:
+        start_shard_service()
+    time.sleep(discovery_wait)
 
-    for _ in range(5):
-        get_devices()
+    if check_internet_connection():
+        poll_devices(registry.take_new())
+        set_params()
 
-    for device in esp_devices:
-        if check_internet_connection():
-            get_esp8266_data(device_ip=device[0], start_time=lst_request_times, is_first_request=True)
-        else:
-            time.sleep(1)
+    catch_up.start()
+    config_watcher.start()
 
 
-logger.name(r'    ___________ ____  ______                     __  ___            _ __            ')
-logger.name(r'   / ____/ ___// __ \/_  __/__  ____ ___  ____  /  |/  /___  ____  (_) /_____  _____')
-logger.name(r'  / __/  \__ \/ /_/ / / / / _ \/ __ `__ \/ __ \/ /|_/ / __ \/ __ \/ / __/ __ \/ ___/')
-logger.name(r' / /___ ___/ / ____/ / / /  __/ / / / / / /_/ / /  / / /_/ / / / / / /_/ /_/ / /    ')
-logger.name(r'/_____//____/_/     /_/  \___/_/ /_/ /_/ .___/_/  /_/\____/_/ /_/_/\__/\____/_/     ')
-logger.name('              by yar2011t             /_/                             v1.4.0       \u00A9')
-
-if __name__ == '__main__':
+def run() -> None:
     """
     Main loop that continuously checks for an internet connection and performs the following tasks:
 
      1. Fetches data from ESP8266 devices if the connection is available, using get_esp8266_data().
-     2. Loads and updates configuration parameters periodically.
-     3. Discovers new devices and processes them if no devices are connected or if it's time to check for new ones.
-    """
+     2. Reloads the configuration when config.json changes and pushes the changed device settings.
+     3. Reloads the sensor cache every 'sensor-cache-resync' seconds.
+     4. Checks the no-data alert rules.
+     5. Adds the monthly partitions of temp_data for the coming months once a day.
 
-    setup()
+    Devices found by the background discovery service are fetched by the catch-up thread.
+    """
+    global lst_check
 
     while True:
+        online = check_internet_connection()
 
-        if check_internet_connection():
-            if time.time() - lst_check > interval / 1000:
-                disconnect = False
+        if online and time.time() - lst_check > interval / 1000:
+            with cycle_seconds.time():
+                poll_devices(registry.ips())
 
-                grouped_dict = defaultdict(list)
-                for key, value in esp_devices:
-                    grouped_dict[key].append(value)
+            lst_check = time.time()
 
-                devices = [(key, value) for key, value in grouped_dict.items()]
+        if config_watcher.changed.is_set():
+            config_watcher.changed.clear()
+            reload_config()
 
-                for ip, _ in devices:
-                    if not disconnect:
-                        get_esp8266_data(device_ip=ip, start_time=lst_request_times)
-                    else:
-                        break
+        if 0 < sensor_cache_resync < time.time() - sensor_cache.synced_at:
+            sensor_cache.resync()
 
-                lst_check = time.time()
+        if alert_engine is not None:
+            alert_engine.check_silence()
 
-        if time.time() - lst_measure > interval_between_json_load / 1000:
-            current_mtime = os.path.getmtime("data\\config.json")
+        if time.time() - partitions_checked > 86400:
+            maintain_partitions()
 
-            if current_mtime != last_mtime:
-                last_mtime = current_mtime
-                load_config()
-                set_params()
-                logger.info("Configuration params were successfully updated")
-                lst_measure = time.time()
+        time.sleep(1)
 
-        if time.time() - lst_device_upload > 60:  #or len(esp_devices) == 0:
-            logger.info('Pending new devices...')
-            for _ in range(10):
-                get_devices()
 
-            for device in exc:
-                if check_internet_connection():
-                    get_esp8266_data(device_ip=device[0], start_time=lst_request_times, is_first_request=True)
-                    exc.remove(device)
+def print_banner() -> None:
+    logger.name(r'    ___________ ____  ______                     __  ___            _ __            ')
+    logger.name(r'   / ____/ ___// __ \/_  __/__  ____ ___  ____  /  |/  /___  ____  (_) /_____  _____')
+    logger.name(r'  / __/  \__ \/ /_/ / / / / _ \/ __ `__ \/ __ \/ /|_/ / __ \/ __ \/ / __/ __ \/ ___/')
+    logger.name(r' / /___ ___/ / ____/ / / /  __/ / / / / / /_/ / /  / / /_/ / / / / / /_/ /_/ / /    ')
+    logger.name(r'/_____//____/_/     /_/  \___/_/ /_/ /_/ .___/_/  /_/\____/_/ /_/_/\__/\____/_/     ')
+    logger.name('              by yar2011t             /_/                             v1.4.0       \u00A9')
 
-            lst_device_upload = time.time()
-        else:
-            time.sleep(1)
+
+if __name__ == '__main__':
+    """
+    Starts the collector and runs its main loop. With --workers N it starts N sharded collector processes instead,
+    which split the devices between them.
+    """
+    parser = argparse.ArgumentParser(description="ESPTempMonitor collector")
+    parser.add_argument('--workers', type=int, default=1, help="run this many sharded collector processes")
+    parser.add_argument('--worker-index', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker_index is None:
+        print_banner()
+    if args.workers > 1:
+        run_workers(args.workers)
+        sys.exit()
+    if args.worker_index is not None:
+        worker_index = args.worker_index
+        registry.path = os.path.join('data', f'sync_state-{worker_index}.json')
+        logger.log_file = os.path.join('data', f'app-{worker_index}.log')
+        # terminate() from the parent, exit normally so the leases are handed back
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    setup()
+    run()
@@ -0,0 +1,708 @@
+######################################################################
+#                                                                    #
+#                ESPTempMonitor benchmarks                           #
+#                                                                    #
+#   schema  - latency of the collector's hot temp_data queries       #
+#             versus table size, with and without the indexes        #
+#             from mysql_database.ddl                                #
+#   ingest  - end-to-end collector run against a simulated fleet     #
+#             (simulator.py): readings/sec, sweep latency            #
+#             percentiles and database queries per reading           #
+#             (--spool polls through the local spool and waits       #
+#             until it is drained)                                   #
+#   transfer - payload size and decode time of a /temp page, JSON    #
+#              versus the binary format                              #
+#   storage - write path throughput of the storage backends,        #
+#             SQLite and (with --mysql) MySQL                        #
+#   shards  - backlog catch-up of 1, 2, 4... sharded collector       #
+#             processes splitting one simulated fleet                #
+#   startup - time from process start to the first stored reading,  #
+#             cold and with the device snapshot of a previous run    #
+#   alerts  - cost of the alert rules per reading, with a slow local #
+#             webhook receiving the events                           #
+#                                                                    #
+######################################################################
+
+from storage import MySQLStorage, SQLiteStorage
+from mysql.connector import Error
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import mysql.connector
+from os import getenv
+import statistics
+import simulator
+import threading
+import subprocess
+import argparse
+import tempfile
+import random
+import time
+import json
+import sys
+import os
+
+load_dotenv()
+
+BENCH_TABLE = "temp_data_bench"
+
+INDEXES = {
+    'temp_data_sensor_time': "(sensor_id, time)",
+    'temp_data_sensor_id': "(sensor_id, id)",
+}
+
+# The statements get_esp8266_data() runs for every reading before batching and caching
+HOT_QUERIES = {
+    'last two records': (
+        f"SELECT temp, time FROM {BENCH_TABLE} WHERE sensor_id = %s ORDER BY id DESC LIMIT 2",
+        lambda sensor_id, ts: (sensor_id,)
+    ),
+    'duplicate window': (
+        f"SELECT id FROM {BENCH_TABLE} WHERE sensor_id = %s AND temp = %s "
+        f"AND time BETWEEN DATE_SUB(%s, INTERVAL 5 SECOND) AND %s",
+        lambda sensor_id, ts: (sensor_id, 21.5, ts, ts)
+    ),
+    'move timestamp': (
+        f"UPDATE {BENCH_TABLE} SET time = time WHERE sensor_id = %s ORDER BY id DESC LIMIT 1",
+        lambda sensor_id, ts: (sensor_id,)
+    ),
+}
+
+
+def connect():
+    return mysql.connector.connect(
+        host=getenv('DATABASE_HOST'),
+        port=int(getenv('DATABASE_PORT')),
+        user=getenv('DATABASE_USER'),
+        password=getenv('DATABASE_PASSWORD'),
+        database=getenv('DATABASE'),
+        connection_timeout=60
+    )
+
+
+def fill(db, cursor, rows: int, sensors: int, start: datetime) -> None:
+    """
+    Appends rows of synthetic readings, one reading every 10 seconds per sensor.
+    """
+    cursor.execute(f"SELECT COUNT(*) FROM {BENCH_TABLE}")
+    existing = cursor.fetchone()[0]
+    chunk = []
+    for i in range(existing, existing + rows):
+        chunk.append((round(random.uniform(15, 30), 2), start + timedelta(seconds=10 * (i // sensors)), i % sensors + 1))
+        if len(chunk) == 10000:
+            cursor.executemany(f"INSERT INTO {BENCH_TABLE} (temp, time, sensor_id) VALUES (%s, %s, %s)", chunk)
+            db.commit()
+            chunk = []
+    if chunk:
+        cursor.executemany(f"INSERT INTO {BENCH_TABLE} (temp, time, sensor_id) VALUES (%s, %s, %s)", chunk)
+        db.commit()
+
+
+def measure(db, cursor, sensors: int, start: datetime, size: int, repeat: int) -> dict:
+    """
+    Returns the median latency in milliseconds of every hot query.
+    """
+    latest = start + timedelta(seconds=10 * (size // sensors))
+    results = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            sensor_id = random.randint(1, sensors)
+            ts = start + timedelta(seconds=random.uniform(0, (latest - start).total_seconds()))
+            began = time.perf_counter()
+            cursor.execute(query, params(sensor_id, ts))
+            if cursor.with_rows:
+                cursor.fetchall()
+            db.rollback()
+            samples.append((time.perf_counter() - began) * 1000)
+        results[name] = statistics.median(samples)
+    return results
+
+
+def set_indexes(db, cursor, enabled: bool) -> None:
+    for name, columns in INDEXES.items():
+        if enabled:
+            cursor.execute(f"ALTER TABLE {BENCH_TABLE} ADD INDEX {name} {columns}")
+        else:
+            cursor.execute(f"ALTER TABLE {BENCH_TABLE} DROP INDEX {name}")
+    db.commit()
+
+
+def schema_benchmark(sizes: list, sensors: int, repeat: int) -> None:
+    try:
+        db = connect()
+        cursor = db.cursor(buffered=True)
+    except Error as e:
+        print(f"Error connecting to MySQL database: {e}")
+        exit()
+
+    cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    cursor.execute(f"CREATE TABLE {BENCH_TABLE} LIKE temp_data")
+    for name in INDEXES:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+            (BENCH_TABLE, name)
+        )
+        if cursor.fetchone()[0]:
+            cursor.execute(f"ALTER TABLE {BENCH_TABLE} DROP INDEX {name}")
+    db.commit()
+
+    start = datetime(2024, 1, 1)
+    filled = 0
+    print(f"{'rows':>12} {'query':<18} {'no index ms':>12} {'indexed ms':>12} {'speedup':>9}")
+    try:
+        for size in sorted(sizes):
+            fill(db, cursor, size - filled, sensors, start)
+            filled = size
+            cursor.execute(f"ANALYZE TABLE {BENCH_TABLE}")
+            cursor.fetchall()
+
+            before = measure(db, cursor, sensors, start, size, repeat)
+            set_indexes(db, cursor, True)
+            after = measure(db, cursor, sensors, start, size, repeat)
+            set_indexes(db, cursor, False)
+
+            for name in HOT_QUERIES:
+                speedup = before[name] / after[name] if after[name] else float('inf')
+                print(f"{size:>12} {name:<18} {before[name]:>12.3f} {after[name]:>12.3f} {speedup:>8.1f}x")
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cursor.close()
+        db.close()
+
+
+class NullCursor:
+    """
+    Stand-in cursor that accepts every statement, counts it and returns no rows.
+    """
+    with_rows = False
+
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+
+    def execute(self, query, params=None) -> None:
+        self.stats['queries'] += 1
+
+    def executemany(self, query, seq_params) -> None:
+        self.stats['queries'] += 1
+
+    def fetchall(self) -> list:
+        return []
+
+    def fetchone(self):
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class NullConnection:
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+
+    def cursor(self, **kwargs) -> NullCursor:
+        return NullCursor(self.stats)
+
+    def commit(self) -> None:
+        self.stats['commits'] += 1
+
+    def rollback(self) -> None:
+        pass
+
+    def ping(self, **kwargs) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class NullPool:
+    """
+    Stand-in for the MySQL connection pool, so the collector can be measured without a database server.
+    """
+
+    def __init__(self) -> None:
+        self.stats = {'queries': 0, 'commits': 0}
+
+    def get_connection(self) -> NullConnection:
+        return NullConnection(self.stats)
+
+
+def server_questions(cursor) -> int:
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    return int(cursor.fetchone()[1])
+
+
+def percentile(samples: list, q: int) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[q - 1]
+
+
+def stored_readings(app) -> int:
+    with app.registry.lock:
+        return sum(sensor.readings for sensor in app.registry.sensors.values())
+
+
+def ingest_benchmark(args) -> None:
+    import app
+
+    app.load_config()
+    app.logger.current_log_level = app.logger.log_levels['WARNING']
+    app.discovery.configure(simulator.DISCOVERY_HOST, args.udp_port, 1)
+    app.device_port = args.port
+    app.poll_workers = args.workers
+    app.registry.path = os.path.join(tempfile.mkdtemp(), 'sync_state.json')
+
+    if args.db == 'null':
+        pool = NullPool()
+        app.storage = MySQLStorage(app.db_pool_size, pool=pool)
+
+        def queries():
+            return pool.stats['queries'] + pool.stats['commits']
+    elif args.db == 'sqlite':
+        app.storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'), app.db_pool_size)
+        app.sensor_cache.resync()
+
+        def queries():
+            return None
+    else:
+        print("Writing simulated readings into temp_data, use a scratch database")
+        app.get_database()
+        app.sensor_cache.resync()
+        status_db = connect()
+        status_cursor = status_db.cursor(buffered=True)
+
+        def queries():
+            return server_questions(status_cursor)
+
+    if args.spool:
+        app.spool_dir = tempfile.mkdtemp()
+        app.open_spool()
+
+    fleet = simulator.fleet_from_arguments(args)
+    fleet.start()
+    app.discovery.start()
+
+    deadline = time.time() + 15
+    while len(app.registry.devices) < len(fleet.boards) and time.time() < deadline:
+        time.sleep(0.1)
+    print(f"Discovered {len(app.registry.devices)} of {len(fleet.boards)} boards")
+
+    queries_before = queries()
+    began = time.perf_counter()
+    app.poll_devices(app.registry.take_new())
+    catch_up = time.perf_counter() - began
+    catch_up_readings = stored_readings(app)
+    catch_up_fetched = app.readings_total.values[()]
+
+    sweeps = []
+    for _ in range(args.sweeps):
+        time.sleep(args.sweep_interval)
+        sweep_began = time.perf_counter()
+        app.poll_devices(app.registry.ips())
+        sweeps.append((time.perf_counter() - sweep_began) * 1000)
+
+    while args.spool and app.reading_spool.pending_bytes():
+        time.sleep(0.01)
+    total = time.perf_counter() - began
+    readings = stored_readings(app)
+    query_count = queries() - queries_before if queries_before is not None else None
+    fleet.stop()
+
+    print(f"Backlog catch-up:   {catch_up_readings} readings in {catch_up:.2f} s "
+          f"({catch_up_readings / catch_up if catch_up else 0:.0f} readings/sec)")
+    if not args.spool:
+        # Spooled readings are still being stored when the catch-up ends
+        print(f"Fetched twice:      {max(0, catch_up_fetched - catch_up_readings)} readings during catch-up")
+    print(f"Steady state:       {readings - catch_up_readings} readings in {len(sweeps)} sweeps")
+    print(f"Overall:            {readings / total if total else 0:.0f} readings/sec")
+    if sweeps:
+        print(f"Sweep latency ms:   p50 {percentile(sweeps, 50):.1f}  p95 {percentile(sweeps, 95):.1f}  "
+              f"p99 {percentile(sweeps, 99):.1f}  max {max(sweeps):.1f}")
+    if query_count is not None:
+        print(f"DB queries/reading: {query_count / readings if readings else 0:.3f} ({query_count} queries)")
+
+
+def synthetic_pages(sensors: int, pages: int, start: float) -> list:
+    """
+    Pages of 100 readings, one per second and sensor, of temperatures drifting in 0.5 degree steps so the collector
+    both inserts rows and moves timestamps.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    per_sensor = max(1, 100 // sensors)
+    temps = np.full(sensors, 20.0)
+    result = []
+    for page in range(pages):
+        steps = rng.choice([-0.5, 0.0, 0.0, 0.0, 0.5], size=(per_sensor, sensors))
+        page_temps = temps + np.cumsum(steps, axis=0)
+        temps = page_temps[-1]
+        times = start + page * per_sensor + np.arange(per_sensor)
+        result.append((
+            page_temps.ravel(),
+            np.repeat(times, sensors).astype(np.float64),
+            np.tile(np.arange(100, 100 + sensors), per_sensor),
+        ))
+    return result
+
+
+def storage_benchmark(args) -> None:
+    import app
+
+    app.load_config()
+    app.logger.current_log_level = app.logger.log_levels['WARNING']
+    backends = {'sqlite': lambda: SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'), app.db_pool_size)}
+    if args.mysql:
+        print("Writing synthetic readings into temp_data, use a scratch database")
+        backends['mysql'] = lambda: MySQLStorage(
+            app.db_pool_size,
+            host=getenv('DATABASE_HOST'),
+            port=int(getenv('DATABASE_PORT')),
+            user=getenv('DATABASE_USER'),
+            password=getenv('DATABASE_PASSWORD'),
+            database=getenv('DATABASE'),
+        )
+
+    start = time.time() - args.pages * 100
+    print(f"{'backend':<8} {'readings/sec':>13} {'page p50 ms':>12} {'page p95 ms':>12}")
+    for name, make_storage in backends.items():
+        app.storage = make_storage()
+        app.sensor_cache.invalidate()
+        app.sensor_cache.resync()
+        pages = synthetic_pages(args.sensors, args.pages, start)
+
+        latencies = []
+        began = time.perf_counter()
+        for temps, timestamps, sensor_ids in pages:
+            page_began = time.perf_counter()
+            app.store_readings(temps, timestamps, sensor_ids)
+            latencies.append((time.perf_counter() - page_began) * 1000)
+        total = time.perf_counter() - began
+
+        readings = sum(len(page[0]) for page in pages)
+        print(f"{name:<8} {readings / total:>13.0f} {percentile(latencies, 50):>12.2f} "
+              f"{percentile(latencies, 95):>12.2f}")
+
+
+def shard_worker(args) -> None:
+    """
+    One collector process of the shards benchmark: joins the ring, waits until all workers are in and the leases
+    settled, drains the backlog of its boards at `start_at` and prints what it stored as JSON.
+    """
+    import app
+
+    app.load_config()
+    app.logger.current_log_level = app.logger.log_levels['WARNING']
+    app.discovery.configure(simulator.DISCOVERY_HOST, args.udp_port, 1)
+    app.device_port = args.port
+    app.poll_workers = args.workers
+    app.registry.path = os.path.join(tempfile.mkdtemp(), 'sync_state.json')
+    app.worker_id = f"bench-{os.getpid()}"
+    app.shard_lease_seconds, app.shard_heartbeat = 6.0, 1.0
+    if args.database:
+        app.storage = SQLiteStorage(args.database, app.db_pool_size)
+    app.get_database()
+    app.sensor_cache.resync()
+    app.discovery.start()
+    app.start_shard_service()
+
+    while time.time() < args.start_at - 2 and len(app.coordinator.workers) < args.processes:
+        time.sleep(0.2)
+    time.sleep(max(0.0, args.start_at - time.time()))
+
+    device_ips = [device_ip for device_ip in app.registry.ips() if app.coordinator.holds(device_ip)]
+    began = time.perf_counter()
+    app.poll_devices(device_ips)
+    print(json.dumps({
+        'devices': len(device_ips), 'readings': stored_readings(app), 'seconds': time.perf_counter() - began
+    }))
+
+
+def shards_benchmark(args) -> None:
+    """
+    Runs the simulated fleet in its own process and, for every process count, that many sharded collectors with a
+    fresh backlog on the boards. The collectors share one database: a temporary SQLite file, whose single writer
+    limits the scaling, or with --mysql the database from .env.
+    """
+    if args.mysql:
+        print("Writing simulated readings into temp_data, use a scratch database")
+    print(f"{'processes':>9} {'devices':>8} {'readings':>9} {'seconds':>8} {'readings/sec':>13}")
+    for processes in args.processes:
+        fleet = subprocess.Popen(
+            [sys.executable, 'simulator.py', '--boards', str(args.boards), '--sensors', str(args.sensors),
+             '--port', str(args.port), '--udp-port', str(args.udp_port), '--backlog', str(args.backlog)],
+            stdout=subprocess.DEVNULL
+        )
+        database = '' if args.mysql else os.path.join(tempfile.mkdtemp(), 'bench.db')
+        start_at = time.time() + args.settle
+        workers = [
+            subprocess.Popen(
+                [sys.executable, __file__, 'shard-worker', '--processes', str(processes), '--start-at', str(start_at),
+                 '--database', database, '--port', str(args.port), '--udp-port', str(args.udp_port),
+                 '--workers', str(args.workers)],
+                stdout=subprocess.PIPE, text=True
+            )
+            for _ in range(processes)
+        ]
+        results = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+        fleet.terminate()
+        fleet.wait()
+
+        readings = sum(result['readings'] for result in results)
+        seconds = max(result['seconds'] for result in results)
+        devices = sum(result['devices'] for result in results)
+        rate = readings / seconds if seconds else 0
+        print(f"{processes:>9} {devices:>8} {readings:>9} {seconds:>8.2f} {rate:>13.0f}")
+
+
+def startup_run(args) -> None:
+    """
+    One collector start of the startup benchmark: runs app.setup() and the main loop against the simulated fleet,
+    storing into SQLite through the spool, and prints the time from `launched` to the first stored reading as JSON.
+    """
+    imported = time.time()
+    import app
+    imported = time.time() - imported
+    import health
+
+    load_config = app.load_config
+
+    def bench_config() -> set:
+        changed = load_config()
+        app.discovery.configure(simulator.DISCOVERY_HOST, args.udp_port, 1)
+        app.device_port = args.port
+        app.storage_backend, app.sqlite_path = 'sqlite', os.path.join(args.directory, 'bench.db')
+        app.spool_enabled, app.spool_dir = True, os.path.join(args.directory, 'spool')
+        app.fast_start = not args.slow
+        app.http_port = 0
+        return changed
+
+    app.load_config = bench_config
+    health.internet_on = lambda host: True
+    app.logger.current_log_level = app.logger.log_levels['WARNING']
+    app.registry.path = os.path.join(args.directory, 'sync_state.json')
+    app.setup()
+    threading.Thread(target=app.run, daemon=True).start()
+    stored = app.first_readings.wait(60)
+    first = time.time() - args.launched
+
+    # Keep the device map for the next start but not the cursors, so the boards have a backlog again
+    app.registry.dirty = True
+    app.registry.save()
+    with open(app.registry.path) as f:
+        state = json.load(f)
+    with open(app.registry.path, 'w') as f:
+        json.dump({'sensors': state['sensors']}, f)
+    print(json.dumps({'import_ms': imported * 1000, 'first_ms': first * 1000 if stored else None}), flush=True)
+    # The pollers are still draining backlogs, dont wait for them
+    os._exit(0)
+
+
+def startup_benchmark(args) -> None:
+    """
+    Starts the collector three times against a simulated fleet in its own process: without a device snapshot, then
+    with the snapshot the first start saved, once with 'fast-start' off and once on.
+    """
+    fleet = subprocess.Popen(
+        [sys.executable, 'simulator.py', '--boards', str(args.boards), '--port', str(args.port),
+         '--udp-port', str(args.udp_port), '--backlog', '100'],
+        stdout=subprocess.DEVNULL
+    )
+    time.sleep(1)
+    directory = tempfile.mkdtemp()
+    print(f"{'start':<24} {'imports ms':>11} {'first reading ms':>17}")
+    try:
+        for name, options in (('cold, fast-start', []), ('snapshot, no fast-start', ['--slow']),
+                              ('snapshot, fast-start', [])):
+            launched = time.time()
+            output = subprocess.run(
+                [sys.executable, __file__, 'startup-run', '--launched', str(launched), '--directory', directory,
+                 '--port', str(args.port), '--udp-port', str(args.udp_port)] + options,
+                stdout=subprocess.PIPE, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            first = f"{result['first_ms']:.0f}" if result['first_ms'] is not None else "none"
+            print(f"{name:<24} {result['import_ms']:>11.0f} {first:>17}")
+    finally:
+        fleet.terminate()
+        fleet.wait()
+
+
+# Tight limits for one reading per second, so the synthetic readings fire and resolve alerts all the time
+ALERT_BENCH_RULES = [
+    {"name": "over-temperature", "type": "threshold", "above": 21, "hysteresis": 0.5, "smoothing": 10},
+    {"name": "under-temperature", "type": "threshold", "below": 19, "hysteresis": 0.5},
+    {"name": "fast-change", "type": "rate", "change": 2, "window": 60, "hysteresis": 0.5},
+    {"name": "flat-line", "type": "flat-line", "window": 10, "min-change": 0.1},
+    {"name": "disconnected", "type": "disconnected", "count": 3},
+]
+
+
+def alerts_benchmark(args) -> None:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from hot_tier import DISCONNECTED_TEMP
+    from alerts import AlertEngine
+
+    received = []
+
+    class Webhook(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            received.extend(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            time.sleep(args.sink_delay)
+            self.send_response(204)
+            self.end_headers()
+
+    server = HTTPServer(('127.0.0.1', 0), Webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    pages = synthetic_pages(args.sensors, args.pages, time.time() - args.pages * 100)
+    for temps, _, _ in pages[::50]:
+        temps[:] = DISCONNECTED_TEMP
+    print(f"{'rules':<18} {'readings/sec':>13} {'us/reading':>11} {'page p50 ms':>12} {'page p95 ms':>12} "
+          f"{'events':>7}")
+    runs = [(rule['name'], [rule]) for rule in ALERT_BENCH_RULES] + [('all + webhook', ALERT_BENCH_RULES)]
+    for name, rules in runs:
+        engine = AlertEngine()
+        sinks = [{"type": "webhook", "url": f"http://127.0.0.1:{server.server_port}/"}] if len(rules) > 1 else []
+        engine.configure(rules, sinks)
+
+        latencies = []
+        began = time.perf_counter()
+        for temps, timestamps, sensor_ids in pages:
+            page_began = time.perf_counter()
+            engine.add(temps, timestamps, sensor_ids)
+            latencies.append((time.perf_counter() - page_began) * 1000)
+        total = time.perf_counter() - began
+
+        readings = sum(len(page[0]) for page in pages)
+        events = sum(engine.events.values())
+        print(f"{name:<18} {readings / total:>13.0f} {total / readings * 1e6:>11.2f} "
+              f"{percentile(latencies, 50):>12.3f} {percentile(latencies, 95):>12.3f} {events:>7}")
+
+        if sinks:
+            delivered_began = time.perf_counter()
+            engine.close()
+            print(f"The webhook ({args.sink_delay * 1000:.0f} ms per request) received {len(received)} events, "
+                  f"{time.perf_counter() - delivered_began:.2f} s after the last page was evaluated")
+    server.shutdown()
+
+
+def transfer_benchmark(args) -> None:
+    import app
+
+    board = simulator.VirtualBoard(0, args.sensors, 0, interval=10000, backlog=args.backlog)
+    board.server.server_close()
+    params = {'limit': '100'}
+    json_payload = json.dumps(board.temp_page(params), separators=(',', ':')).encode()
+    binary_payload = board.binary_page(params)
+
+    from_json = app.decode_json_page(json.loads(json_payload))
+    from_binary = app.decode_binary_page(binary_payload)
+    for field in ('temps', 'ages', 'sensor_ids'):
+        if not (getattr(from_json, field) == getattr(from_binary, field)).all():
+            print(f"Decoded {field} differ between the formats")
+    records = len(from_binary)
+
+    def per_page(decode) -> float:
+        began = time.perf_counter()
+        for _ in range(args.repeat):
+            decode()
+        return (time.perf_counter() - began) / args.repeat * 1e6
+
+    json_us = per_page(lambda: app.decode_json_page(json.loads(json_payload)))
+    binary_us = per_page(lambda: app.decode_binary_page(binary_payload))
+    print(f"{'format':<8} {'bytes/page':>11} {'decode us/page':>15}  ({records} records per page)")
+    print(f"{'json':<8} {len(json_payload):>11} {json_us:>15.1f}")
+    print(f"{'binary':<8} {len(binary_payload):>11} {binary_us:>15.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ESPTempMonitor benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    schema = commands.add_parser("schema", help="hot query latency versus temp_data size, before and after indexes")
+    schema.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    schema.add_argument("--sensors", type=int, default=40)
+    schema.add_argument("--repeat", type=int, default=50)
+
+    ingest = commands.add_parser("ingest", help="collector throughput against simulated boards")
+    simulator.add_fleet_arguments(ingest)
+    ingest.add_argument("--db", choices=("null", "mysql", "sqlite"), default="null",
+                        help="'null' measures the collector alone, 'mysql' writes to the database from .env, "
+                             "'sqlite' to a temporary SQLite file")
+    ingest.add_argument("--workers", type=int, default=8, help="poll workers")
+    ingest.add_argument("--sweeps", type=int, default=20)
+    ingest.add_argument("--sweep-interval", type=float, default=0.5, help="seconds between sweeps")
+    ingest.add_argument("--spool", action="store_true", help="write readings through the local spool")
+    ingest.set_defaults(backlog=700, interval=1000)
+
+    transfer = commands.add_parser("transfer", help="/temp page size and decode time, JSON versus binary")
+    transfer.add_argument("--sensors", type=int, default=4)
+    transfer.add_argument("--backlog", type=int, default=200)
+    transfer.add_argument("--repeat", type=int, default=2000)
+
+    storage = commands.add_parser("storage", help="write path throughput, SQLite versus MySQL")
+    storage.add_argument("--sensors", type=int, default=8)
+    storage.add_argument("--pages", type=int, default=500)
+    storage.add_argument("--mysql", action="store_true", help="also write to the database from .env")
+
+    shards = commands.add_parser("shards", help="backlog catch-up of several sharded collector processes")
+    shards.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    shards.add_argument("--boards", type=int, default=40)
+    shards.add_argument("--sensors", type=int, default=4)
+    shards.add_argument("--backlog", type=int, default=700)
+    shards.add_argument("--port", type=int, default=8080)
+    shards.add_argument("--udp-port", type=int, default=4210)
+    shards.add_argument("--workers", type=int, default=8, help="poll workers per process")
+    shards.add_argument("--settle", type=float, default=15, help="seconds for the processes to split the boards")
+    shards.add_argument("--mysql", action="store_true", help="write to the database from .env instead of SQLite")
+
+    shard = commands.add_parser("shard-worker", help="one process of the shards benchmark, started by it")
+    shard.add_argument("--processes", type=int, required=True)
+    shard.add_argument("--start-at", type=float, required=True)
+    shard.add_argument("--database", default="", help="SQLite file, empty for the database from .env")
+    shard.add_argument("--port", type=int, default=8080)
+    shard.add_argument("--udp-port", type=int, default=4210)
+    shard.add_argument("--workers", type=int, default=8)
+
+    startup = commands.add_parser("startup", help="time from process start to the first stored reading")
+    startup.add_argument("--boards", type=int, default=40)
+    startup.add_argument("--port", type=int, default=8080)
+    startup.add_argument("--udp-port", type=int, default=4210)
+
+    startup_process = commands.add_parser("startup-run", help="one collector start of the startup benchmark")
+    startup_process.add_argument("--launched", type=float, required=True)
+    startup_process.add_argument("--directory", required=True)
+    startup_process.add_argument("--port", type=int, default=8080)
+    startup_process.add_argument("--udp-port", type=int, default=4210)
+    startup_process.add_argument("--slow", action="store_true", help="turn 'fast-start' off")
+
+    alerts = commands.add_parser("alerts", help="alert rule evaluation per reading, with a slow webhook sink")
+    alerts.add_argument("--sensors", type=int, default=8)
+    alerts.add_argument("--pages", type=int, default=2000)
+    alerts.add_argument("--sink-delay", type=float, default=0.05, help="seconds the webhook takes per request")
+
+    args = parser.parse_args()
+    if args.command == "schema":
+        schema_benchmark(args.sizes, args.sensors, args.repeat)
+    elif args.command == "ingest":
+        ingest_benchmark(args)
+    elif args.command == "transfer":
+        transfer_benchmark(args)
+    elif args.command == "storage":
+        storage_benchmark(args)
+    elif args.command == "shards":
+        shards_benchmark(args)
+    elif args.command == "shard-worker":
+        shard_worker(args)
+    elif args.command == "startup":
+        startup_benchmark(args)
+    elif args.command == "startup-run":
+        startup_run(args)
+    elif args.command == "alerts":
+        alerts_benchmark(args)
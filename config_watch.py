@@ -0,0 +1,93 @@
+######################################################################
+#                                                                    #
+#                 Config watcher                                     #
+#                                                                    #
+#   Notices writes to data/config.json without reading it on every   #
+#   loop: inotify on Linux, the modification time elsewhere.         #
+#                                                                    #
+######################################################################
+
+from collections.abc import Iterator
+import ctypes.util
+import threading
+import select
+import struct
+import time
+import sys
+import os
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Watches data/config.json and sets `changed` once the file was written. Uses inotify on Linux, watching the
+    directory so editors that replace the file are noticed too, and checks the modification time every
+    `poll_interval` seconds elsewhere. Bursts of events are merged, so a file that is still being written is not read.
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    SETTLE_TIME = 0.2
+
+    def __init__(self, path: str, logger, poll_interval: float = 5.0) -> None:
+        super().__init__(name="config-watcher", daemon=True)
+        self.path = path
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.changed = threading.Event()
+
+    def _inotify(self) -> int | None:
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            directory = os.path.dirname(os.path.abspath(self.path)).encode()
+            mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            if libc.inotify_add_watch(fd, directory, mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _events(self, fd: int) -> Iterator[bytes]:
+        data = os.read(fd, 4096)
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            yield data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+
+    def run(self) -> None:
+        fd = self._inotify()
+        if fd is None:
+            self.logger.info("inotify is not available, checking config.json for changes periodically")
+            self._poll()
+            return
+
+        name = os.path.basename(self.path).encode()
+        while True:
+            select.select([fd], [], [])
+            if name not in self._events(fd):
+                continue
+            while select.select([fd], [], [], self.SETTLE_TIME)[0]:
+                os.read(fd, 4096)
+            self.changed.set()
+
+    def _mtime(self) -> float:
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return 0.0
+
+    def _poll(self) -> None:
+        last_mtime = self._mtime()
+        while True:
+            time.sleep(self.poll_interval)
+            mtime = self._mtime()
+            if mtime != last_mtime:
+                last_mtime = mtime
+                self.changed.set()
@@ -0,0 +1,87 @@
+######################################################################
+#                                                                    #
+#                 Device discovery                                   #
+#                                                                    #
+#   Broadcasts DISCOVER on the LAN and reports the boards that       #
+#   answer with their sensor ids.                                    #
+#                                                                    #
+######################################################################
+
+import threading
+import socket
+import time
+import re
+
+
+def parse_device_reply(data: str) -> list | None:
+    """
+    Parses a "'DEVICE' ,<count>, [<sensor ids>]" discovery reply into the list of sensor ids, or None if the packet
+    is not a device reply.
+    """
+    if "DEVICE" not in data:
+        return None
+
+    match = re.search(r'\[([0-9, ]*)\]', data)
+    if match is None:
+        return None
+    return [int(sensor_id) for sensor_id in match.group(1).replace(' ', '').split(',') if sensor_id]
+
+
+class DiscoveryService(threading.Thread):
+    """
+    Background device discovery. Keeps one UDP socket bound to 'UDP_port', broadcasts DISCOVER every
+    'discovery-interval' seconds and hands every device that answers to `on_device`, so polling never waits for
+    discovery.
+    """
+
+    def __init__(self, logger, on_device) -> None:
+        super().__init__(name="discovery", daemon=True)
+        self.logger = logger
+        self.on_device = on_device
+        self.broadcast_ip = "192.168.0.255"
+        self.port = 4210
+        self.interval = 10.0
+        self.sock = None
+        self.bound_port = None
+        self.lst_broadcast = 0.0
+
+    def configure(self, broadcast_ip: str, port: int, interval: float) -> None:
+        self.broadcast_ip = broadcast_ip
+        self.port = port
+        self.interval = interval
+
+    def _bind(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.bind(("0.0.0.0", self.port))
+        self.sock.settimeout(0.5)
+        self.bound_port = self.port
+
+    def run(self) -> None:
+        while True:
+            try:
+                if self.sock is None or self.bound_port != self.port:
+                    self._bind()
+
+                if time.time() - self.lst_broadcast > self.interval:
+                    self.sock.sendto("DISCOVER".encode(), (self.broadcast_ip, self.port))
+                    self.lst_broadcast = time.time()
+
+                try:
+                    data, addr = self.sock.recvfrom(1024)
+                except TimeoutError:
+                    continue
+
+                sensor_ids = parse_device_reply(data.decode(errors='ignore'))
+                if sensor_ids:
+                    self.on_device(addr[0], sensor_ids)
+
+            except OSError as e:
+                self.logger.warning(f"Device discovery failed: {e}")
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                time.sleep(5)
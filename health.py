@@ -0,0 +1,82 @@
+######################################################################
+#                                                                    #
+#                 Connectivity                                       #
+#                                                                    #
+#   Background check of the connection to LAN_host. The collector    #
+#   reads the cached state instead of waiting on a TCP connect.      #
+#                                                                    #
+######################################################################
+
+import threading
+import socket
+import time
+
+
+def dot_or_dash(char: str) -> None:
+    print(char, end='', flush=True)
+
+
+def internet_on(host: str) -> bool:
+    """
+    Checks internet connection
+    """
+    try:
+        s = socket.create_connection((host, 80), timeout=2)
+        s.close()
+        return True
+    except OSError:
+        return False
+
+
+class ConnectivityProbe(threading.Thread):
+    """
+    Checks the connection to 'LAN_host' every 'probe-interval' seconds in the background and caches the result, so
+    the collector never waits on a TCP connect to know whether the LAN is up.
+    """
+
+    def __init__(self, logger) -> None:
+        super().__init__(name="connectivity", daemon=True)
+        self.logger = logger
+        self.host = ""
+        self.interval = 5.0
+        self.online = threading.Event()
+        self.checked_at = 0.0
+        self.dots = 0
+        self.lines = 0
+
+    def configure(self, host: str, interval: float) -> None:
+        self.host = host
+        self.interval = interval
+
+    def check(self) -> bool:
+        online = internet_on(self.host)
+        if online and not self.online.is_set():
+            if self.checked_at:
+                dot_or_dash("\n")
+                self.logger.info("Internet connection is back")
+            self.dots = self.lines = 0
+            self.online.set()
+        elif not online and (self.online.is_set() or not self.checked_at):
+            self.logger.warning("No internet connection.")
+            self.online.clear()
+        self.checked_at = time.time()
+        return online
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def progress(self) -> None:
+        """
+        Prints the next dot or dash of the waiting animation.
+        """
+        if self.dots < 5:
+            self.lines = 0
+            dot_or_dash(".")
+            self.dots += 1
+        elif self.lines < 5:
+            dot_or_dash("_")
+            self.lines += 1
+            if self.lines == 5:
+                self.dots = 0
@@ -0,0 +1,198 @@
+######################################################################
+#                                                                    #
+#                 Hot tier                                           #
+#                                                                    #
+#   The recent readings of every sensor in fixed-size NumPy ring     #
+#   buffers, fed straight from the device pages. Questions about     #
+#   the last hours (current value, min/max/average of a window, a    #
+#   chart) are answered from memory without a database query.       #
+#                                                                    #
+#   Memory per sensor is capacity * 12 bytes, allocated once and     #
+#   again only when the capacity is changed.                         #
+#                                                                    #
+######################################################################
+
+import numpy as np
+import threading
+import time
+
+# A disconnected DS18B20 reads -127 C, which encode() in the firmware clamps to -120.0 C on the wire. The sensor
+# measures down to -55 C, so anything at or below the clamp is this sentinel and not a temperature.
+DISCONNECTED_TEMP = -120.0
+
+
+def is_connected(temps):
+    """
+    True for the readings of connected sensors, elementwise for arrays.
+    """
+    return temps > DISCONNECTED_TEMP + 0.05
+
+
+class SensorRing:
+    """
+    Ring buffer of (time, temp) samples of one sensor, oldest to newest. Appending newer samples costs O(1) per
+    sample; samples older than the newest one (a backlog drained after a restart) are merged in order.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.times = np.empty(capacity, dtype=np.float64)
+        self.temps = np.empty(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _ordered(self) -> tuple[np.ndarray, np.ndarray]:
+        index = (self.start + np.arange(self.count)) % self.capacity
+        return self.times[index], self.temps[index]
+
+    def _write(self, times: np.ndarray, temps: np.ndarray) -> None:
+        end = (self.start + self.count) % self.capacity
+        first = min(len(times), self.capacity - end)
+        self.times[end:end + first], self.temps[end:end + first] = times[:first], temps[:first]
+        self.times[:len(times) - first], self.temps[:len(times) - first] = times[first:], temps[first:]
+        overflow = max(0, self.count + len(times) - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.count += len(times) - overflow
+
+    def append(self, times: np.ndarray, temps: np.ndarray) -> None:
+        order = np.argsort(times, kind='stable')
+        with self.lock:
+            times, temps = times[order][-self.capacity:], temps[order][-self.capacity:]
+            newest = self.times[(self.start + self.count - 1) % self.capacity] if self.count else -np.inf
+            if times[0] > newest:
+                self._write(times, temps)
+                return
+
+            old_times, old_temps = self._ordered()
+            merged_times = np.concatenate((old_times, times))
+            merged_temps = np.concatenate((old_temps, temps))
+            merged_times, unique = np.unique(merged_times, return_index=True)
+            merged_temps = merged_temps[unique]
+            self.start = self.count = 0
+            self._write(merged_times[-self.capacity:], merged_temps[-self.capacity:])
+
+    def resize(self, capacity: int) -> None:
+        """
+        Reallocates the buffer for `capacity` samples, keeping the newest ones that fit.
+        """
+        with self.lock:
+            times, temps = self._ordered()
+            self.times = np.empty(capacity, dtype=np.float64)
+            self.temps = np.empty(capacity, dtype=np.float32)
+            self.capacity = capacity
+            self.start = self.count = 0
+            self._write(times[-capacity:], temps[-capacity:])
+
+    def window(self, since: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns copies of the samples not older than since.
+        """
+        with self.lock:
+            times, temps = self._ordered()
+        first = np.searchsorted(times, since)
+        return times[first:], temps[first:]
+
+
+class HotTier:
+    """
+    Ring buffers of all sensors. Samples older than `retention` seconds are never returned.
+    """
+
+    def __init__(self, capacity: int = 17280, retention: float = 86400.0) -> None:
+        self.capacity = capacity
+        self.retention = retention
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def configure(self, capacity: int, retention: float) -> None:
+        """
+        Applies changed settings; the rings of known sensors are resized at once, a capacity of 0 drops them.
+        """
+        with self.lock:
+            self.retention = retention
+            if capacity == self.capacity:
+                return
+            self.capacity = capacity
+            if capacity <= 0:
+                self.rings.clear()
+                return
+            rings = list(self.rings.values())
+        for ring in rings:
+            ring.resize(capacity)
+
+    def add(self, temps: np.ndarray, timestamps: np.ndarray, sensor_ids: np.ndarray) -> None:
+        """
+        Adds the readings of a page, skipping disconnected sensors.
+        """
+        if self.capacity <= 0:
+            return
+        valid = is_connected(temps)
+        for sensor_id in np.unique(sensor_ids[valid]).tolist():
+            of_sensor = valid & (sensor_ids == sensor_id)
+            with self.lock:
+                ring = self.rings.get(sensor_id)
+                if ring is None:
+                    ring = self.rings[sensor_id] = SensorRing(self.capacity)
+            ring.append(timestamps[of_sensor], temps[of_sensor])
+
+    def _window(self, sensor_id, seconds: float = None) -> tuple[np.ndarray, np.ndarray]:
+        ring = self.rings.get(sensor_id)
+        if ring is None:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+        seconds = self.retention if seconds is None else min(seconds, self.retention)
+        return ring.window(time.time() - seconds)
+
+    def sensors(self) -> list:
+        with self.lock:
+            return sorted(self.rings)
+
+    def latest(self, sensor_id) -> tuple[float, float] | None:
+        """
+        Returns the time and temperature of the newest sample of a sensor within the retention window.
+        """
+        times, temps = self._window(sensor_id)
+        if not len(times):
+            return None
+        return float(times[-1]), round(float(temps[-1]), 2)
+
+    def stats(self, sensor_id, seconds: float) -> dict | None:
+        """
+        Returns min, max, average and sample count of the last `seconds` seconds.
+        """
+        times, temps = self._window(sensor_id, seconds)
+        if not len(times):
+            return None
+        return {
+            'min': round(float(temps.min()), 2),
+            'max': round(float(temps.max()), 2),
+            'avg': round(float(temps.mean(dtype=np.float64)), 2),
+            'samples': len(temps),
+            'first': float(times[0]),
+            'last': float(times[-1]),
+        }
+
+    def series(self, sensor_id, seconds: float, points: int) -> list:
+        """
+        Returns the last `seconds` seconds downsampled to at most `points` equally long buckets, as
+        (bucket start, min, max, average) tuples of the buckets that have samples.
+        """
+        times, temps = self._window(sensor_id, seconds)
+        if not len(times) or points <= 0:
+            return []
+        start = time.time() - min(seconds, self.retention)
+        width = min(seconds, self.retention) / points
+        buckets = np.minimum(((times - start) // width).astype(np.int64), points - 1)
+
+        # Samples are in time order, so every bucket is one contiguous run
+        edges = np.flatnonzero(np.diff(buckets)) + 1
+        starts = np.concatenate(([0], edges))
+        counts = np.diff(np.concatenate((starts, [len(buckets)])))
+        temps = temps.astype(np.float64)
+        minimum = np.minimum.reduceat(temps, starts)
+        maximum = np.maximum.reduceat(temps, starts)
+        average = np.add.reduceat(temps, starts) / counts
+        return [
+            (start + int(bucket) * width, round(float(low), 2), round(float(high), 2), round(float(mean), 2))
+            for bucket, low, high, mean in zip(buckets[starts], minimum, maximum, average)
+        ]
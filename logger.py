@@ -0,0 +1,231 @@
+######################################################################
+#                                                                    #
+#                 Collector log                                      #
+#                                                                    #
+#   Console and data/app.log output of the collector. Records can    #
+#   be queued and written in batches by a background thread;         #
+#   app.log is rotated by size and age and per-reading messages      #
+#   are sampled.                                                     #
+#                                                                    #
+######################################################################
+
+from collections import deque
+from datetime import datetime
+import threading
+import atexit
+import time
+import sys
+import os
+
+
+class Logger:
+    """
+    Custom logger to log program info and exceptions. In queued mode callers only append the record to a queue and a
+    background thread formats and writes the queued records in batches. app.log is rotated by size and age, and
+    per-reading messages logged with sampled() are limited to a few per second.
+    """
+    LOG_COLORS = {
+        'DEBUG': '\033[92m',
+        'INFO': '\033[94m',
+        'WARNING': '\033[93m',
+        'ERROR': '\033[91m',
+        'CRITICAL': '\033[41m'
+    }
+    RESET_COLOR = '\033[0m'
+
+    def __init__(self, log_file: str = 'data/app.log', log_level: str = 'INFO') -> None:
+        self.log_file = log_file
+        self.log_level = log_level
+        self.colored = sys.stdout.isatty() or 'PYCHARM_HOSTED' in os.environ
+        self.log_levels = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+        self.console_log_levels = {'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'}
+        self.file_log_levels = {'WARNING', 'ERROR', 'CRITICAL'}
+        self.current_log_level = self.log_levels.get(log_level, 50)
+
+        self.max_bytes = 1048576
+        self.rotate_seconds = 86400.0
+        self.backups = 5
+        self.sample_rate = 20
+        self.samples = {}
+        self.sample_lock = threading.Lock()
+
+        self.queue = None
+        self.dropped = 0
+        self.writer = None
+        self.write_lock = threading.Lock()
+        self.file = None
+        self.opened_at = 0.0
+        self.stamp_second = -1
+        self.stamp = ''
+
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+
+    def configure(self, queued: bool, max_bytes: int, rotate_seconds: float, backups: int, sample_rate: int,
+                  queue_size: int = 100000) -> None:
+        """
+        Applies the 'log-*' settings. Switching to queued mode starts the writer thread.
+        """
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.sample_rate = sample_rate
+
+        if queued and self.queue is None:
+            self.queue = deque(maxlen=queue_size)
+            self.writer = threading.Thread(target=self._write_loop, name="logger", daemon=True)
+            self.writer.start()
+            atexit.register(self.flush)
+        elif not queued and self.queue is not None:
+            queue, self.queue = self.queue, None
+            self._write_records(queue)
+
+    def enabled(self, level: str) -> bool:
+        return self.log_levels[level] >= self.current_log_level
+
+    def _log(self, level: str, message: str) -> None:
+        if level == 'IGNORE':
+            print(message)
+            return
+
+        if self.log_levels[level] >= self.current_log_level:
+            queue = self.queue
+            if queue is None:
+                self._write_records(((time.time(), level, message),))
+                return
+            if len(queue) == queue.maxlen:
+                self.dropped += 1
+            queue.append((time.time(), level, message))
+
+    def _timestamp(self, created: float) -> str:
+        # Records arrive in bursts within the same second, so the formatted time is reused
+        second = int(created)
+        if second != self.stamp_second:
+            self.stamp_second = second
+            self.stamp = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        return self.stamp
+
+    def _write_records(self, records) -> None:
+        console = []
+        file_lines = []
+        with self.write_lock:
+            for created, level, message in records:
+                timestamp = self._timestamp(created)
+                if level in self.console_log_levels:
+                    color = self.LOG_COLORS.get(level, self.RESET_COLOR) if self.colored else ""
+                    reset_color = self.RESET_COLOR if self.colored else ""
+                    console.append(f"{timestamp} - {color}{level}{reset_color} - {message}\n")
+                if level in self.file_log_levels:
+                    file_lines.append(f"{timestamp} - {level} - {message}\n")
+
+            if console:
+                sys.stdout.write(''.join(console))
+                sys.stdout.flush()
+            if file_lines:
+                self._write_file(''.join(file_lines))
+
+    def _write_file(self, text: str) -> None:
+        try:
+            if self.file is None:
+                self.file = open(self.log_file, 'a')
+                self.opened_at = self.opened_at or time.time()
+            if self._should_rotate():
+                self._rotate()
+                self.file = open(self.log_file, 'a')
+                self.opened_at = time.time()
+            self.file.write(text)
+            self.file.flush()
+        except OSError as e:
+            print(f"Cant write {self.log_file}: {e}", file=sys.stderr)
+            self.file = None
+        finally:
+            if self.queue is None and self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self.opened_at >= self.rotate_seconds
+
+    def _rotate(self) -> None:
+        """
+        Renames app.log to app.log.1, app.log.1 to app.log.2 and so on, keeping 'log-backups' old files.
+        """
+        self.file.close()
+        self.file = None
+        if self.backups <= 0:
+            os.remove(self.log_file)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.log_file}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.log_file}.{index + 1}")
+        os.replace(self.log_file, f"{self.log_file}.1")
+
+    def _write_loop(self) -> None:
+        while True:
+            time.sleep(0.1)
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes all queued records.
+        """
+        queue = self.queue
+        if queue is None:
+            return
+        records = []
+        try:
+            while queue:
+                records.append(queue.popleft())
+        except IndexError:
+            pass
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.append((time.time(), 'WARNING', f"Log queue full, {dropped} messages were dropped"))
+        if records:
+            self._write_records(records)
+
+    def sampled(self, kind: str, message: str, level: str = 'INFO') -> None:
+        """
+        Logs a per-reading message, at most 'log-reading-rate' messages of one kind per second. The number of skipped
+        messages is reported with the next message of that kind in a later second.
+        """
+        if self.log_levels[level] < self.current_log_level:
+            return
+        if not self.sample_rate:
+            self._log(level, message)
+            return
+
+        second = int(time.time())
+        with self.sample_lock:
+            window = self.samples.get(kind)
+            if window is None or window[0] != second:
+                skipped = window[2] if window is not None else 0
+                window = self.samples[kind] = [second, 0, 0]
+                if skipped:
+                    message = f"{message} ({skipped} similar messages skipped)"
+            if window[1] >= self.sample_rate:
+                window[2] += 1
+                return
+            window[1] += 1
+        self._log(level, message)
+
+    def name(self, message: str) -> None:
+        self._log('IGNORE', message)
+
+    def debug(self, message: str) -> None:
+        self._log('DEBUG', message)
+
+    def info(self, message: str) -> None:
+        self._log('INFO', message)
+
+    def warning(self, message: str) -> None:
+        self._log('WARNING', message)
+
+    def error(self, message: str) -> None:
+        self._log('ERROR', message)
+
+    def critical(self, message: str) -> None:
+        self._log('CRITICAL', message)
+
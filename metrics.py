@@ -0,0 +1,173 @@
+######################################################################
+#                                                                    #
+#                 Collector instrumentation                          #
+#                                                                    #
+#   Counters, gauges and fixed-bucket latency histograms kept in     #
+#   memory and rendered in the Prometheus text format. Recording     #
+#   is a dict lookup and an addition under a lock, cheap enough to   #
+#   stay on in production.                                           #
+#                                                                    #
+######################################################################
+
+from bisect import bisect_left
+import threading
+import time
+
+# Upper bounds in seconds, from a fast cache hit to a board that hits the request timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, one value per combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {} if labels else {(): 0}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values.items()]
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, like the records still waiting on a device.
+    """
+    kind = 'gauge'
+
+    def set(self, *label_values, value: float) -> None:
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Timer:
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram: 'Histogram', label_values: tuple) -> None:
+        self.histogram = histogram
+        self.label_values = label_values
+        self.started = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.histogram.observe(*self.label_values, value=time.perf_counter() - self.started)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets. Only the bucket counts, sum and count are kept, so memory does not grow
+    with the number of observations.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, *label_values, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values) -> Timer:
+        """
+        Context manager observing the time spent in its block.
+        """
+        return Timer(self, label_values)
+
+    def samples(self) -> list:
+        with self.lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self.series.items()}
+
+        lines = []
+        for key, (counts, total, count) in series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Metrics:
+    """
+    Registry of all metrics. Collectors are callables run on every scrape that return extra, freshly filled metrics,
+    for values that are already counted elsewhere and would only be copied on the hot path.
+    """
+
+    def __init__(self) -> None:
+        self.metrics = []
+        self.collectors = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, description: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, description, labels, buckets))
+
+    def add_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            metrics.extend(collector())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
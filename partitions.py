@@ -0,0 +1,80 @@
+######################################################################
+#                                                                    #
+#                 Monthly partitions of temp_data                    #
+#                                                                    #
+#   setup.py can partition temp_data by month, p202401 holding the   #
+#   readings before 2024-01-01, and a catch-all p_future for the     #
+#   rest. The collector splits the months ahead off p_future once a  #
+#   day, while it is still empty, so new readings never pile up in   #
+#   it and old months can be dropped as a whole.                     #
+#                                                                    #
+######################################################################
+
+from datetime import datetime
+import re
+
+SELECT_PARTITIONS = (
+    "SELECT partition_name FROM information_schema.partitions "
+    "WHERE table_schema = DATABASE() AND table_name = 'temp_data' AND partition_name IS NOT NULL"
+)
+MONTH_PARTITION = re.compile(r'p(\d{4})(\d{2})')
+
+
+def next_month(year: int, month: int) -> tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def month_partition(year: int, month: int) -> str:
+    # Named after its upper bound, the first day of the month
+    return f"PARTITION p{year:04d}{month:02d} VALUES LESS THAN (UNIX_TIMESTAMP('{year:04d}-{month:02d}-01'))"
+
+
+def month_partitions(first: datetime, months: int) -> list:
+    """
+    One partition per month from the month of `first` on, plus a catch-all so inserts never fail.
+    """
+    partitions = []
+    year, month = first.year, first.month
+    for _ in range(months):
+        year, month = next_month(year, month)
+        partitions.append(month_partition(year, month))
+    partitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    return partitions
+
+
+def partition_names(cursor) -> list:
+    cursor.execute(SELECT_PARTITIONS)
+    return [name for name, in cursor.fetchall()]
+
+
+def is_partitioned(cursor) -> bool:
+    return bool(partition_names(cursor))
+
+
+def extend(cursor, months_ahead: int = 3, now: datetime = None) -> list:
+    """
+    Splits partitions for every month up to `months_ahead` months from now off p_future. Returns the names of the
+    added partitions, none if temp_data is not partitioned by month.
+    """
+    names = partition_names(cursor)
+    bounds = [tuple(map(int, match.groups())) for match in map(MONTH_PARTITION.fullmatch, names) if match]
+    if 'p_future' not in names or not bounds:
+        return []
+
+    now = now or datetime.now()
+    target = (now.year, now.month)
+    for _ in range(months_ahead + 1):
+        target = next_month(*target)
+
+    added = []
+    year, month = max(bounds)
+    while (year, month) < target:
+        year, month = next_month(year, month)
+        added.append((year, month))
+    if added:
+        cursor.execute(
+            "ALTER TABLE temp_data REORGANIZE PARTITION p_future INTO ("
+            + ", ".join(month_partition(year, month) for year, month in added)
+            + ", PARTITION p_future VALUES LESS THAN MAXVALUE)"
+        )
+    return [f"p{year:04d}{month:02d}" for year, month in added]
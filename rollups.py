@@ -0,0 +1,195 @@
+######################################################################
+#                                                                    #
+#                 Rollup tables                                      #
+#                                                                    #
+#   Min/max/sum/count of temp_data per sensor and minute, hour and   #
+#   day. The collector rebuilds the buckets touched by every write   #
+#   in the same transaction, so long-range charts read a few         #
+#   thousand rollup rows instead of millions of readings.            #
+#                                                                    #
+#   python rollups.py backfill [--days 7] [--since 2024-01-01]       #
+#   builds them from the existing history, one chunk per commit.     #
+#                                                                    #
+######################################################################
+
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from os import getenv
+import argparse
+import time
+
+MINUTE = timedelta(minutes=1)
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+# Writes further apart than this are rebuilt as separate ranges
+MERGE_GAP = timedelta(minutes=10)
+
+ROLLUP_COLUMNS = "(sensor_id, bucket, temp_min, temp_max, temp_sum, samples)"
+
+# table, source table, source time column, aggregates, bucket length.
+# Every level is built from the one below it, so an hour reads at most 60 minute rows.
+MERGE_AGGREGATES = "MIN(temp_min), MAX(temp_max), SUM(temp_sum), SUM(samples)"
+ROLLUP_LEVELS = (
+    ('temp_rollup_minute', 'temp_data', 'time', "MIN(temp), MAX(temp), SUM(temp), COUNT(*)", MINUTE),
+    ('temp_rollup_hour', 'temp_rollup_minute', 'bucket', MERGE_AGGREGATES, HOUR),
+    ('temp_rollup_day', 'temp_rollup_hour', 'bucket', MERGE_AGGREGATES, DAY),
+)
+
+# Start of the bucket of a source row, per database and level
+BUCKET_EXPRESSIONS = {
+    'mysql': (
+        "TIMESTAMP(DATE(time), MAKETIME(HOUR(time), MINUTE(time), 0))",
+        "TIMESTAMP(DATE(bucket), MAKETIME(HOUR(bucket), 0, 0))",
+        "TIMESTAMP(DATE(bucket))",
+    ),
+    'sqlite': (
+        "strftime('%Y-%m-%d %H:%M:00', time)",
+        "strftime('%Y-%m-%d %H:00:00', bucket)",
+        "strftime('%Y-%m-%d 00:00:00', bucket)",
+    ),
+}
+
+ROLLUP_TABLES = {
+    'minute': 'temp_rollup_minute',
+    'hour': 'temp_rollup_hour',
+    'day': 'temp_rollup_day',
+}
+
+CREATE_ROLLUP_TABLE = """
+CREATE TABLE IF NOT EXISTS `{table}` (
+  `sensor_id` int NOT NULL,
+  `bucket` datetime NOT NULL,
+  `temp_min` float NOT NULL,
+  `temp_max` float NOT NULL,
+  `temp_sum` double NOT NULL,
+  `samples` int NOT NULL,
+  PRIMARY KEY (`sensor_id`,`bucket`)
+)"""
+MYSQL_TABLE_OPTIONS = " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci"
+
+
+def create_tables(cursor, dialect: str = 'mysql') -> None:
+    options = MYSQL_TABLE_OPTIONS if dialect == 'mysql' else ''
+    for table in ROLLUP_TABLES.values():
+        cursor.execute(CREATE_ROLLUP_TABLE.format(table=table) + options)
+
+
+def floor_time(moment: datetime, length: timedelta) -> datetime:
+    if length >= DAY:
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if length >= HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+def ceil_time(moment: datetime, length: timedelta) -> datetime:
+    floor = floor_time(moment, length)
+    return floor if floor == moment else floor + length
+
+
+def rebuild(cursor, ranges: list, dialect: str = 'mysql') -> None:
+    """
+    Recomputes the buckets of every level overlapping the given (sensor_id, start, end) ranges. Buckets are deleted
+    and selected again rather than adjusted, so rows whose timestamp moved out of a bucket are handled exactly. The
+    caller commits.
+    """
+    if not ranges:
+        return
+
+    for (table, source, column, aggregates, length), bucket in zip(ROLLUP_LEVELS, BUCKET_EXPRESSIONS[dialect]):
+        level_ranges = {
+            (sensor_id, floor_time(start, length), ceil_time(end, length)) for sensor_id, start, end in ranges
+        }
+        params = [value for level_range in sorted(level_ranges) for value in level_range]
+        condition = " OR ".join(["(sensor_id = %s AND {column} >= %s AND {column} < %s)"] * len(level_ranges))
+
+        cursor.execute(f"DELETE FROM {table} WHERE " + condition.format(column='bucket'), params)
+        cursor.execute(
+            f"INSERT INTO {table} {ROLLUP_COLUMNS} "
+            f"SELECT sensor_id, {bucket} AS rollup_bucket, {aggregates} FROM {source} "
+            f"WHERE {condition.format(column=column)} GROUP BY sensor_id, rollup_bucket",
+            params
+        )
+
+
+def dirty_ranges(touched: dict) -> list:
+    """
+    Turns the written timestamps of each sensor into (sensor_id, start, end) minute ranges to rebuild.
+    """
+    ranges = []
+    for sensor_id, times in touched.items():
+        current = None
+        for minute in sorted({floor_time(moment, MINUTE) for moment in times}):
+            if current is not None and minute - current[2] <= MERGE_GAP:
+                current[2] = minute + MINUTE
+            else:
+                current = [sensor_id, minute, minute + MINUTE]
+                ranges.append(current)
+    return [tuple(item) for item in ranges]
+
+
+def refresh(cursor, touched: dict, dialect: str = 'mysql') -> None:
+    """
+    Brings the rollups up to date after writes. `touched` maps sensor ids to the old and new timestamps of the rows
+    that were inserted or moved.
+    """
+    rebuild(cursor, dirty_ranges(touched), dialect)
+
+
+def connect():
+    import mysql.connector
+
+    return mysql.connector.connect(
+        host=getenv('DATABASE_HOST'),
+        port=int(getenv('DATABASE_PORT')),
+        user=getenv('DATABASE_USER'),
+        password=getenv('DATABASE_PASSWORD'),
+        database=getenv('DATABASE')
+    )
+
+
+def backfill(days: int, since: datetime = None) -> None:
+    """
+    Builds the rollups from the stored history, sensor by sensor in chunks of `days` days committed one at a time,
+    so the backfill can run next to the collector and be restarted with --since.
+    """
+    from mysql.connector import Error
+
+    load_dotenv()
+    try:
+        db = connect()
+    except Error as e:
+        print(f"Error connecting to MySQL database: {e}")
+        return
+    cursor = db.cursor()
+    create_tables(cursor)
+
+    cursor.execute("SELECT sensor_id, MIN(time), MAX(time) FROM temp_data GROUP BY sensor_id")
+    sensors = cursor.fetchall()
+    chunk = timedelta(days=max(1, days))
+    started = time.perf_counter()
+    for sensor_id, first, last in sensors:
+        start = floor_time(max(first, since) if since else first, DAY)
+        while start <= last:
+            end = start + chunk
+            rebuild(cursor, [(sensor_id, start, end)])
+            db.commit()
+            print(f"sensor {sensor_id}: {start:%Y-%m-%d} - {end:%Y-%m-%d} done ({time.perf_counter() - started:.1f} s)")
+            start = end
+
+    cursor.close()
+    db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ESPTempMonitor rollup tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = commands.add_parser("backfill", help="build the rollup tables from existing temp_data rows")
+    backfill_parser.add_argument("--days", type=int, default=7, help="days of readings per transaction")
+    backfill_parser.add_argument("--since", type=datetime.fromisoformat, help="only rebuild from this date on")
+
+    args = parser.parse_args()
+    if args.command == "backfill":
+        backfill(args.days, args.since)
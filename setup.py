@@ -1,4 +1,8 @@
+from partitions import month_partitions, is_partitioned, extend
+from rollups import create_tables, backfill
+from transfer import import_readings, open_storage
 from mysql.connector import Error
+from datetime import datetime
 from dotenv import load_dotenv
 import mysql.connector
 from os import getenv
@@ -70,39 +74,93 @@ if create == "Y" or create == "y" or create == "Yes" or create == "yes":
     with open('mysql_database.ddl', 'r') as ddl_file:
         ddl_content = ddl_file.read()
 
-    x = ddl_content.split("\n")
-
-    y = []
-    y1 = []
-    bo = False
-    for i in range(0, len(x)):
-        if x[i] == '':
-            bo = True
-        if bo == False:
-            y.append(x[i])
-        else:
-            y1.append(x[i])
-
-    query_string = ''.join(y)
-    query_string2 = ''.join(y1)
-
-    try:
-        esp_cursor.execute(query_string)
-        esp_db.commit()
-    except mysql.connector.errors.ProgrammingError:
-        print("Maybe you already created table (check your database)")
+    # One statement per ';', whatever the blank lines in between
+    for statement in ddl_content.split(';'):
+        if statement.strip() == '':
+            continue
+        try:
+            esp_cursor.execute(statement)
+            esp_db.commit()
+        except mysql.connector.errors.ProgrammingError:
+            print("Maybe you already created table (check your database)")
 
     try:
-        esp_cursor.execute(query_string2)
+        create_tables(esp_cursor)
         esp_db.commit()
-    except mysql.connector.errors.ProgrammingError:
-        print("Maybe you already created table (check your database)")
-
-    esp_cursor.close()
-    esp_db.close()
+    except Error as e:
+        print(f"Cant create rollup tables: {e}")
 else:
     create = False
 
+
+def index_exists(table, index):
+    esp_cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, index)
+    )
+    return esp_cursor.fetchone()[0] > 0
+
+
+# Indexes used by the collector's hot queries: duplicate window and dead-band lookups by (sensor_id, time),
+# last records and timestamp moves by (sensor_id, id)
+TEMP_DATA_INDEXES = {
+    'temp_data_sensor_time': "ALTER TABLE temp_data ADD INDEX temp_data_sensor_time (sensor_id, time), ALGORITHM=INPLACE, LOCK=NONE",
+    'temp_data_sensor_id': "ALTER TABLE temp_data ADD INDEX temp_data_sensor_id (sensor_id, id), ALGORITHM=INPLACE, LOCK=NONE",
+}
+
+migrate = input("Do you want to upgrade existing tables with missing indexes (Y/N):")
+if migrate == "Y" or migrate == "y" or migrate == "Yes" or migrate == "yes":
+    for index_name, query in TEMP_DATA_INDEXES.items():
+        try:
+            if index_exists('temp_data', index_name):
+                print(f"Index {index_name} already exists")
+                continue
+            print(f"Creating index {index_name}, this can take a while on big tables...")
+            esp_cursor.execute(query)
+            esp_db.commit()
+        except Error as e:
+            print(f"Cant create index {index_name}: {e}")
+
+    partition = input("Do you want to partition temp_data by month (recommended above tens of millions of rows) (Y/N):")
+    if partition == "Y" or partition == "y" or partition == "Yes" or partition == "yes":
+        try:
+            if is_partitioned(esp_cursor):
+                print("Table temp_data is already partitioned")
+                for name in extend(esp_cursor):
+                    print(f"Added partition {name}")
+            else:
+                esp_cursor.execute("SELECT MIN(time) FROM temp_data")
+                first_time = esp_cursor.fetchone()[0] or datetime.now()
+                months = (datetime.now().year - first_time.year) * 12 + datetime.now().month - first_time.month + 13
+
+                print("Partitioning temp_data, the table is rebuilt so this can take a while...")
+                # Every unique key of a partitioned table has to contain the partitioning column
+                esp_cursor.execute("ALTER TABLE temp_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, time)")
+                esp_cursor.execute(
+                    "ALTER TABLE temp_data PARTITION BY RANGE (UNIX_TIMESTAMP(time)) ("
+                    + ", ".join(month_partitions(first_time, months)) + ")"
+                )
+                esp_db.commit()
+        except Error as e:
+            print(f"Cant partition temp_data: {e}")
+
+    rollup = input("Do you want to build minute/hour/day rollup tables from existing readings (Y/N):")
+    if rollup == "Y" or rollup == "y" or rollup == "Yes" or rollup == "yes":
+        print("Building rollups, this can take a while on big tables...")
+        backfill(7)
+
+esp_cursor.close()
+esp_db.close()
+
+history = input("Import readings exported from another site (path of a .csv/.ndjson(.gz) file, leave blank to skip):")
+if history != "":
+    try:
+        import_readings(open_storage(), history)
+    except (OSError, ValueError, Error) as e:
+        print(f"Import stopped: {e}")
+        print(f"Run 'python transfer.py import {history}' to continue where it stopped")
+
 print("Congratulations! Setup is finished. Exiting...")
 time.sleep(2)
 exit()
\ No newline at end of file
@@ -0,0 +1,249 @@
+######################################################################
+#                                                                    #
+#                 Sharded collector workers                          #
+#                                                                    #
+#   Several collector processes, on one host or several, share the   #
+#   boards. Every worker heartbeats into collector_workers; the      #
+#   live workers form a consistent hash ring and each board belongs  #
+#   to the worker its IP hashes to. Only the holder of the board's   #
+#   row in device_leases polls it:                                   #
+#   - leases are taken and renewed with conditional UPDATEs against  #
+#     the database clock, so two workers never hold the same one     #
+#   - a worker stops using a lease before it can expire in the       #
+#     database, and every write batch re-checks it before commit     #
+#   - leases of a dead worker run out and are taken over by the      #
+#     next worker on the ring, together with the sync cursors        #
+#                                                                    #
+######################################################################
+
+from bisect import bisect
+import hashlib
+import socket
+import json
+import time
+import os
+
+# Current time of the database server in epoch seconds, so the clocks of the workers do not matter
+DATABASE_NOW = {
+    'mysql': "UNIX_TIMESTAMP(NOW(6))",
+    'sqlite': "((julianday('now') - 2440587.5) * 86400.0)",
+}
+
+CREATE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS collector_workers (
+      worker_id varchar(64) NOT NULL,
+      heartbeat double NOT NULL,
+      expires double NOT NULL,
+      PRIMARY KEY (worker_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS device_leases (
+      device_ip varchar(45) NOT NULL,
+      sensors varchar(255) NOT NULL DEFAULT '',
+      worker_id varchar(64) DEFAULT NULL,
+      token bigint NOT NULL DEFAULT 0,
+      expires double NOT NULL DEFAULT 0,
+      cursors text,
+      PRIMARY KEY (device_ip)
+    )""",
+)
+MYSQL_TABLE_OPTIONS = " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci"
+
+UPSERT_WORKER = {
+    'mysql': "INSERT INTO collector_workers (worker_id, heartbeat, expires) VALUES (%s, {now}, {now} + %s) "
+             "ON DUPLICATE KEY UPDATE heartbeat = VALUES(heartbeat), expires = VALUES(expires)",
+    'sqlite': "INSERT INTO collector_workers (worker_id, heartbeat, expires) VALUES (%s, {now}, {now} + %s) "
+              "ON CONFLICT (worker_id) DO UPDATE SET heartbeat = excluded.heartbeat, expires = excluded.expires",
+}
+UPSERT_DEVICE = {
+    'mysql': "INSERT INTO device_leases (device_ip, sensors) VALUES (%s, %s) "
+             "ON DUPLICATE KEY UPDATE sensors = VALUES(sensors)",
+    'sqlite': "INSERT INTO device_leases (device_ip, sensors) VALUES (%s, %s) "
+              "ON CONFLICT (device_ip) DO UPDATE SET sensors = excluded.sensors",
+}
+SELECT_LIVE_WORKERS = "SELECT worker_id FROM collector_workers WHERE expires > {now}"
+DELETE_DEAD_WORKERS = "DELETE FROM collector_workers WHERE expires < {now} - 3600"
+DELETE_WORKER = "DELETE FROM collector_workers WHERE worker_id = %s"
+SELECT_DEVICES = "SELECT device_ip, sensors, worker_id, token, expires > {now}, cursors FROM device_leases"
+RENEW_LEASES = "UPDATE device_leases SET expires = {now} + %s WHERE worker_id = %s AND expires > {now}"
+SELECT_HELD = "SELECT device_ip, token FROM device_leases WHERE worker_id = %s AND expires > {now}"
+# Compare-and-set on the token: of two workers racing for a free lease only the first UPDATE matches
+ACQUIRE_LEASE = (
+    "UPDATE device_leases SET worker_id = %s, token = token + 1, expires = {now} + %s "
+    "WHERE device_ip = %s AND token = %s AND (worker_id IS NULL OR expires <= {now})"
+)
+SAVE_CURSORS = "UPDATE device_leases SET cursors = %s WHERE device_ip = %s AND worker_id = %s AND token = %s"
+RELEASE_LEASE = (
+    "UPDATE device_leases SET worker_id = NULL, expires = 0, cursors = %s "
+    "WHERE device_ip = %s AND worker_id = %s AND token = %s"
+)
+# Locking read: a takeover of the lease waits until the write batch committed, or the batch sees the new holder
+CHECK_LEASE = {
+    'mysql': "SELECT token FROM device_leases "
+             "WHERE device_ip = %s AND worker_id = %s AND token = %s AND expires > {now} FOR SHARE",
+    'sqlite': "SELECT token FROM device_leases "
+              "WHERE device_ip = %s AND worker_id = %s AND token = %s AND expires > {now}",
+}
+
+
+class LeaseLost(Exception):
+    """
+    Raised by a write fence when the lease of the board was taken over before the batch was committed.
+    """
+
+
+def statement(sql, dialect: str) -> str:
+    if isinstance(sql, dict):
+        sql = sql[dialect]
+    return sql.format(now=DATABASE_NOW[dialect])
+
+
+def create_tables(cursor, dialect: str = 'mysql') -> None:
+    options = MYSQL_TABLE_OPTIONS if dialect == 'mysql' else ''
+    for sql in CREATE_TABLES:
+        cursor.execute(sql + options)
+
+
+def default_worker_id() -> str:
+    """
+    Host name and process id: unique among the running workers, which is what keeps their leases apart.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"[-64:]
+
+
+class HashRing:
+    """
+    Consistent hash ring of worker ids with `replicas` virtual nodes per worker. When a worker joins or leaves, only
+    the keys between its nodes and their predecessors change owner, about 1/N of them.
+    """
+
+    def __init__(self, workers, replicas: int = 64) -> None:
+        self.workers = sorted(set(workers))
+        self.nodes = sorted((self.hash(f"{worker}#{index}"), worker) for worker in self.workers
+                            for index in range(replicas))
+        self.points = [point for point, _ in self.nodes]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def owner(self, key: str) -> str | None:
+        if not self.nodes:
+            return None
+        return self.nodes[bisect(self.points, self.hash(key)) % len(self.nodes)][1]
+
+
+class ShardCoordinator:
+    """
+    The leases of one worker. heartbeat() runs every few seconds in one transaction; holds() and fence() are called
+    by the pollers. A lease is used locally until `lease_seconds - margin` after the start of the heartbeat that last
+    renewed it, which is before it can expire in the database.
+    """
+
+    def __init__(self, worker_id: str, lease_seconds: float = 30.0, replicas: int = 64) -> None:
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.margin = lease_seconds / 3
+        self.replicas = replicas
+        self.held = {}
+        self.deadline = 0.0
+        self.published = {}
+        self.workers = []
+        self.created = False
+
+    def holds(self, device_ip: str) -> int | None:
+        """
+        Returns the fencing token of the board's lease while it is valid, else None.
+        """
+        token = self.held.get(device_ip)
+        if token is None or time.monotonic() >= self.deadline:
+            return None
+        return token
+
+    def fence(self, device_ip: str):
+        """
+        Returns a check for the write batches of a board: run in the batch's transaction right before the commit, it
+        raises LeaseLost unless this worker still holds the lease it had when the page was fetched.
+        """
+        token = self.holds(device_ip)
+
+        def check(session) -> None:
+            if token is not None:
+                session.cursor.execute(statement(CHECK_LEASE, session.dialect), (device_ip, self.worker_id, token))
+                if session.cursor.fetchall():
+                    return
+            raise LeaseLost(f"lease of device {device_ip} is no longer held by {self.worker_id}")
+        return check
+
+    def heartbeat(self, session, devices: dict, cursors: dict) -> tuple:
+        """
+        Publishes the worker and the boards it discovered ({ip: sensor ids}), renews its leases, takes the free ones
+        of the boards the ring assigns to it and releases the others, saving the sync cursors ({ip: {sensor id:
+        time}}) with them. Returns the acquired leases as {ip: (sensor ids, cursors)} and the released IPs.
+        """
+        dialect = session.dialect
+        cursor = session.cursor
+        started = time.monotonic()
+        if not self.created:
+            create_tables(cursor, dialect)
+            self.created = True
+
+        cursor.execute(statement(UPSERT_WORKER, dialect), (self.worker_id, self.lease_seconds))
+        cursor.execute(statement(DELETE_DEAD_WORKERS, dialect))
+        for device_ip, sensor_ids in devices.items():
+            sensors = ','.join(str(sensor_id) for sensor_id in sorted(sensor_ids))
+            if self.published.get(device_ip) != sensors:
+                cursor.execute(statement(UPSERT_DEVICE, dialect), (device_ip, sensors))
+                self.published[device_ip] = sensors
+
+        cursor.execute(statement(RENEW_LEASES, dialect), (self.lease_seconds, self.worker_id))
+        cursor.execute(statement(SELECT_HELD, dialect), (self.worker_id,))
+        held = dict(cursor.fetchall())
+        cursor.executemany(SAVE_CURSORS, [
+            (json.dumps(cursors[device_ip]), device_ip, self.worker_id, token)
+            for device_ip, token in held.items() if cursors.get(device_ip)
+        ])
+
+        cursor.execute(statement(SELECT_LIVE_WORKERS, dialect))
+        self.workers = sorted(worker_id for worker_id, in cursor.fetchall())
+        ring = HashRing(self.workers, self.replicas)
+        cursor.execute(statement(SELECT_DEVICES, dialect))
+
+        acquired = {}
+        released = []
+        for device_ip, sensors, worker_id, token, valid, saved in cursor.fetchall():
+            owner = ring.owner(device_ip)
+            if owner != self.worker_id:
+                if device_ip in held:
+                    cursor.execute(RELEASE_LEASE, (json.dumps(cursors.get(device_ip, {})), device_ip,
+                                                   self.worker_id, held.pop(device_ip)))
+                    released.append(device_ip)
+                continue
+            if device_ip in held or (worker_id is not None and valid):
+                continue
+
+            cursor.execute(statement(ACQUIRE_LEASE, dialect), (self.worker_id, self.lease_seconds, device_ip, token))
+            if cursor.rowcount == 1:
+                held[device_ip] = token + 1
+                sensor_ids = [int(sensor_id) for sensor_id in sensors.split(',') if sensor_id]
+                saved = {int(sensor_id): float(value) for sensor_id, value in json.loads(saved or '{}').items()}
+                acquired[device_ip] = (sensor_ids, saved)
+
+        session.commit()
+        self.held = held
+        self.deadline = started + self.lease_seconds - self.margin
+        return acquired, released
+
+    def release_all(self, session, cursors: dict) -> None:
+        """
+        Hands all leases back and leaves the ring, so the other workers take the boards over without waiting for
+        the leases to expire.
+        """
+        held, self.held = self.held, {}
+        session.cursor.executemany(RELEASE_LEASE, [
+            (json.dumps(cursors.get(device_ip, {})), device_ip, self.worker_id, token)
+            for device_ip, token in held.items()
+        ])
+        session.cursor.execute(DELETE_WORKER, (self.worker_id,))
+        session.commit()
@@ -0,0 +1,341 @@
+######################################################################
+#                                                                    #
+#                 ESP8266 board simulator                            #
+#                                                                    #
+#   Emulates a fleet of boards running Esp8266-code on loopback:     #
+#   - /temp paging (time, limit, skip, sensor_id, remain)            #
+#   - /setinterval, /setTempDiff, /exit, /status                     #
+#   - UDP DISCOVER / DEVICE handshake                                #
+#                                                                    #
+#   Every board listens on its own 127.0.x.y address, so this        #
+#   needs the whole 127.0.0.0/8 loopback range (Linux).              #
+#                                                                    #
+######################################################################
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qsl
+import threading
+import argparse
+import random
+import socket
+import struct
+import time
+import json
+
+DISCOVERY_HOST = "127.0.0.2"
+MAX_RECORDS = 7000
+
+
+def board_ip(index: int) -> str:
+    """
+    Loopback address of the board with the given index, starting after the discovery address.
+    """
+    host = index + 3
+    return f"127.0.{host // 254}.{host % 254 + 1}" if host >= 254 else f"127.0.0.{host}"
+
+
+def encode(temp: float, sensor_id: int) -> int:
+    # Same 16 bit packing as encode() in encoder_decoder.cpp
+    sensor_id = min(7, max(0, sensor_id))
+    temp_negative = 1 if temp < 0 else 0
+    temp_enc = min(1200, int(-temp * 10 if temp < 0 else temp * 10))
+    return temp_enc | (temp_negative << 12) | (sensor_id << 13)
+
+
+def decode_temp(encoded: int) -> float:
+    temp = encoded & 0b11111111111
+    return temp * -0.1 if encoded >> 12 & 1 else temp * 0.1
+
+
+class VirtualBoard:
+    """
+    One simulated board: a ring buffer of encoded readings filled like measurement_store.cpp does, answering HTTP
+    requests one at a time like ESP8266WebServer. Sensor ids are kept next to the encoded words instead of in their
+    3 bits, so every board of a big fleet can report its own unique ids. The binary /temp format carries only those
+    3 bits, so boards with higher ids answer format=bin requests with JSON, like boards with older firmware.
+    """
+
+    def __init__(self, index: int, sensors: int, port: int, interval: int = 10000, temp_diff: float = 0.2,
+                 latency: float = 0.0, failure_rate: float = 0.0, backlog: int = 0, max_records: int = MAX_RECORDS) -> None:
+        self.ip = board_ip(index)
+        self.port = port
+        self.sensor_ids = [index * sensors + i + 1 for i in range(sensors)]
+        self.interval = interval
+        self.temp_diff = temp_diff
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.binary = max(self.sensor_ids) <= 7
+        self.temps = {sensor_id: random.uniform(18, 26) for sensor_id in self.sensor_ids}
+        self.requests = 0
+
+        self.boot = time.time() - backlog * interval / 1000 - 1
+        self.buff = []
+        self.times = []
+        self.ids = []
+        self.lst_measure = 0
+        for i in range(backlog):
+            self.measure(1 + i * interval)
+        self.lst_measure = 1 + (backlog - 1) * interval if backlog else 0
+
+        self.server = HTTPServer((self.ip, port), self._handler())
+
+    def millis(self) -> int:
+        return int((time.time() - self.boot) * 1000)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.buff, self.times, self.ids = [], [], []
+            self.boot = time.time()
+            self.lst_measure = 0
+
+    def measure(self, millis_now: int) -> None:
+        for sensor_id in self.sensor_ids:
+            self.temps[sensor_id] += random.choice((0, 0, 0, 0.1, -0.1, 0.3, -0.3))
+            self.save_temperature(self.temps[sensor_id], millis_now, sensor_id)
+
+    def tick(self) -> None:
+        with self.lock:
+            millis_now = self.millis()
+            if millis_now - self.lst_measure >= self.interval:
+                self.lst_measure = millis_now
+                self.measure(millis_now)
+
+    def save_temperature(self, temp: float, millis_now: int, sensor_id: int) -> None:
+        # Port of saveTemperature() from measurement_store.cpp
+        encoded = encode(temp, sensor_id)
+        last_index = second_last_index = -1
+        for index in range(len(self.buff) - 1, -1, -1):
+            if self.ids[index] == sensor_id:
+                second_last_index, last_index = last_index, index
+                if second_last_index != -1:
+                    break
+
+        diff_last = abs(temp - decode_temp(self.buff[last_index])) if last_index != -1 else float('inf')
+        diff_second_last = abs(temp - decode_temp(self.buff[second_last_index])) if second_last_index != -1 else float('inf')
+
+        if second_last_index == -1 or last_index == -1 or millis_now - self.times[second_last_index] >= 300000 \
+                or diff_last > self.temp_diff or diff_second_last > self.temp_diff:
+            self.buff.append(encoded)
+            self.times.append(millis_now)
+            self.ids.append(sensor_id)
+            if len(self.buff) > self.max_records:
+                del self.buff[:len(self.buff) - self.max_records]
+                del self.times[:len(self.times) - self.max_records]
+                del self.ids[:len(self.ids) - self.max_records]
+        elif self.ids[-1] == sensor_id:
+            self.times[-1] = millis_now
+        else:
+            self.times[second_last_index] = millis_now
+
+    def temp_page(self, params: dict) -> dict:
+        """
+        Builds a /temp response: newest readings first, at most 100, filtered by age and sensor, after skipping the
+        first 'skip' matching records.
+        """
+        records, remain, skipped = self.scan(params)
+        return {
+            "temperature_data": [
+                {"t": round(decode_temp(word), 2), "ti": age, "id": sensor_id} for word, age, sensor_id in records
+            ],
+            "remain": remain,
+            "skip": skipped
+        }
+
+    def binary_page(self, params: dict) -> bytes:
+        """
+        Builds a format=bin /temp response like the firmware's writeBinaryPage().
+        """
+        records, remain, skipped = self.scan(params)
+        page = bytearray(struct.pack('<cBHI', b'T', 1, len(records), remain))
+        for word, age, sensor_id in records:
+            page += struct.pack('<HI', word, age)
+        return bytes(page)
+
+    def scan(self, params: dict) -> tuple[list, int, int]:
+        """
+        Returns the matching (word, age, sensor id) records, newest first, the number of matching records left out
+        after them and the number of skipped ones.
+        """
+        with self.lock:
+            current_millis = self.millis()
+            limit = int(params.get('limit') or 0)
+            limit = 10 if limit <= 0 else min(limit, 100)
+            filter_by_time = 'time' in params
+            time_frame = current_millis - int(params.get('time') or 0) if filter_by_time else 0
+            sensor_id = int(params['sensor_id']) if params.get('sensor_id') else None
+            skip = int(params.get('skip') or 0)
+
+            data = []
+            skipped = 0
+            total_matched = 0
+            for index in range(len(self.buff) - 1, -1, -1):
+                record_sensor = self.ids[index]
+                if filter_by_time and self.times[index] > time_frame:
+                    continue
+                if sensor_id is not None and record_sensor != sensor_id:
+                    continue
+                total_matched += 1
+                if skipped < skip:
+                    skipped += 1
+                elif len(data) < limit:
+                    age = current_millis - self.times[index] if self.times[index] else 0
+                    data.append((self.buff[index], age, record_sensor))
+            return data, total_matched - skipped - len(data), skipped
+
+    def _handler(self):
+        board = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status: int, content_type: str, body: str | bytes) -> None:
+                payload = body if isinstance(body, bytes) else body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                board.requests += 1
+                if board.latency:
+                    time.sleep(board.latency * random.uniform(0.5, 1.5))
+                if random.random() < board.failure_rate:
+                    self.reply(500, "text/html", "Internal error")
+                    return
+
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                if url.path == "/status":
+                    self.reply(200, "text/html", "OK")
+                elif url.path == "/temp" and params.get('format') == 'bin' and board.binary:
+                    self.reply(200, "application/octet-stream", board.binary_page(params))
+                elif url.path == "/temp":
+                    self.reply(200, "application/json", json.dumps(board.temp_page(params), separators=(',', ':')))
+                elif url.path == "/setinterval":
+                    new_interval = int(float(params.get('interval') or 0))
+                    if 0 < new_interval <= 60000:
+                        board.interval = new_interval
+                        self.reply(200, "text/html", "<p>Interval set</p>")
+                    else:
+                        self.reply(400, "text/html", "<p>Invalid interval</p>")
+                elif url.path == "/setTempDiff":
+                    new_temp_diff = float(params.get('difference') or 0)
+                    if 0 < new_temp_diff <= 2:
+                        board.temp_diff = new_temp_diff
+                        self.reply(200, "text/html", "<p>Difference set</p>")
+                    else:
+                        self.reply(400, "text/html", "<p>Invalid differnce</p>")
+                elif url.path == "/exit":
+                    self.reply(200, "text/html", "Exiting")
+                    board.reset()
+                else:
+                    self.reply(404, "text/plain", "Not found")
+
+        return Handler
+
+    def discovery_reply(self) -> str:
+        return "'DEVICE' ," + str(len(self.sensor_ids)) + ", [" + ", ".join(map(str, self.sensor_ids)) + "]"
+
+
+class Fleet:
+    """
+    N virtual boards plus the UDP responder answering DISCOVER broadcasts sent to DISCOVERY_HOST.
+    """
+
+    def __init__(self, boards: int, sensors: int = 4, port: int = 8080, udp_port: int = 4210, **board_options) -> None:
+        if not 1 <= sensors <= 8:
+            raise ValueError("A board supports 1 to 8 sensors")
+        self.udp_port = udp_port
+        self.boards = [VirtualBoard(i, sensors, port, **board_options) for i in range(boards)]
+        self.running = False
+        self.threads = []
+
+    def start(self) -> None:
+        self.running = True
+        for board in self.boards:
+            self._spawn(board.server.serve_forever)
+        self._spawn(self._measure_loop)
+        self._spawn(self._discovery_loop)
+
+    def stop(self) -> None:
+        self.running = False
+        for board in self.boards:
+            board.server.shutdown()
+            board.server.server_close()
+
+    def _spawn(self, target) -> None:
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _measure_loop(self) -> None:
+        while self.running:
+            for board in self.boards:
+                board.tick()
+            time.sleep(0.05)
+
+    def _discovery_loop(self) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((DISCOVERY_HOST, self.udp_port))
+        sock.settimeout(0.5)
+
+        # Every board answers from its own address, like separate hosts on a LAN
+        senders = {}
+        for board in self.boards:
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sender.bind((board.ip, 0))
+            senders[board.ip] = sender
+
+        while self.running:
+            try:
+                data, addr = sock.recvfrom(255)
+            except TimeoutError:
+                continue
+            if b"DISCOVER" not in data:
+                continue
+            for board in self.boards:
+                senders[board.ip].sendto(board.discovery_reply().encode(), (addr[0], self.udp_port))
+
+        sock.close()
+        for sender in senders.values():
+            sender.close()
+
+
+def add_fleet_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--boards", type=int, default=40)
+    parser.add_argument("--sensors", type=int, default=4, help="sensors per board (1-8)")
+    parser.add_argument("--port", type=int, default=8080, help="HTTP port of every board ('device-port' in config)")
+    parser.add_argument("--udp-port", type=int, default=4210)
+    parser.add_argument("--interval", type=int, default=10000, help="measurement interval in milliseconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response delay in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--backlog", type=int, default=0, help="measurements already stored on every board")
+
+
+def fleet_from_arguments(args) -> Fleet:
+    return Fleet(
+        args.boards, sensors=args.sensors, port=args.port, udp_port=args.udp_port, interval=args.interval,
+        latency=args.latency, failure_rate=args.failure_rate, backlog=args.backlog
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated ESP8266 fleet")
+    add_fleet_arguments(parser)
+    args = parser.parse_args()
+
+    fleet = fleet_from_arguments(args)
+    fleet.start()
+    print(f"{len(fleet.boards)} boards running on {fleet.boards[0].ip}-{fleet.boards[-1].ip} port {args.port}")
+    print(f"Set \"UDP_host\": \"{DISCOVERY_HOST}\", \"UDP_port\": {args.udp_port} and \"device-port\": {args.port} "
+          f"in data/config.json to collect from them")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fleet.stop()
@@ -0,0 +1,303 @@
+######################################################################
+#                                                                    #
+#                 Local reading spool                                #
+#                                                                    #
+#   Append-only segment files between the device pollers and         #
+#   MySQL. Pollers append every page of readings and return once     #
+#   it is on disk; a writer thread drains the spool into the         #
+#   database in bulk whenever it is reachable.                       #
+#                                                                    #
+#   - records: length, CRC32 and the readings of one page            #
+#   - appends of all pollers share one fsync (group commit)          #
+#   - the drained position is kept in a small cursor file and in     #
+#     the database, written in the transaction of the readings; a    #
+#     torn record at the end of the last segment is cut off on open  #
+#   - above the size cap the oldest segments are dropped             #
+#                                                                    #
+######################################################################
+
+import numpy as np
+import threading
+import struct
+import zlib
+import uuid
+import json
+import time
+import os
+
+SPOOL_RECORD = np.dtype([('time', '<f8'), ('temp', '<f8'), ('sensor_id', '<i4')])
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_SUFFIX = '.seg'
+
+# Drained position of every spool directory, stored with the readings it covers
+CREATE_PROGRESS_TABLE = """
+CREATE TABLE IF NOT EXISTS spool_progress (
+  spool_id varchar(32) NOT NULL,
+  segment bigint NOT NULL,
+  byte_offset bigint NOT NULL,
+  PRIMARY KEY (spool_id)
+)"""
+MYSQL_TABLE_OPTIONS = " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci"
+SELECT_PROGRESS = "SELECT segment, byte_offset FROM spool_progress WHERE spool_id = %s"
+UPSERT_PROGRESS = {
+    'mysql': "INSERT INTO spool_progress (spool_id, segment, byte_offset) VALUES (%s, %s, %s) "
+             "ON DUPLICATE KEY UPDATE segment = VALUES(segment), byte_offset = VALUES(byte_offset)",
+    'sqlite': "INSERT INTO spool_progress (spool_id, segment, byte_offset) VALUES (%s, %s, %s) "
+              "ON CONFLICT (spool_id) DO UPDATE SET segment = excluded.segment, byte_offset = excluded.byte_offset",
+}
+
+
+def create_progress_table(cursor, dialect: str = 'mysql') -> None:
+    cursor.execute(CREATE_PROGRESS_TABLE + (MYSQL_TABLE_OPTIONS if dialect == 'mysql' else ''))
+
+
+def stored_position(cursor, spool_id: str) -> tuple | None:
+    cursor.execute(SELECT_PROGRESS, (spool_id,))
+    rows = cursor.fetchall()
+    return tuple(rows[0]) if rows else None
+
+
+def store_position(cursor, dialect: str, spool_id: str, position: tuple) -> None:
+    cursor.execute(UPSERT_PROGRESS[dialect], (spool_id, *position))
+
+
+class Spool:
+    """
+    Durable FIFO of readings. append() may be called from any thread, read() and commit() from a single drainer.
+    Delivery is at least once: readings drained just before a crash are drained again on restart, unless the drainer
+    stores the position with them (store_position()) and commits the stored position first. `spool_id` names the
+    directory in the database, a new directory gets a new id.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 << 20, segment_bytes: int = 4 << 20,
+                 fsync_interval: float = 0.005) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Dropping the older segments always brings the spool back under the cap
+        self.segment_bytes = max(1, min(segment_bytes, max_bytes // 2))
+        self.fsync_interval = fsync_interval
+        self.cursor_path = os.path.join(directory, 'cursor.json')
+        self.id_path = os.path.join(directory, 'spool-id')
+        self.spool_id = None
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.unsynced = threading.Condition(self.lock)
+        self.segments = {}
+        self.active = None
+        self.file = None
+        self.position = (0, 0)
+        self.appended = 0
+        self.synced_seq = 0
+        self.dropped_bytes = 0
+        self.flusher = None
+        self.stopped = False
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:012d}{SEGMENT_SUFFIX}")
+
+    def open(self) -> None:
+        """
+        Restores the segments and the drained position and cuts off a record that was only partly written.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.id_path) as f:
+                self.spool_id = f.read().strip()
+        except OSError:
+            self.spool_id = uuid.uuid4().hex
+            with open(self.id_path, 'w') as f:
+                f.write(self.spool_id)
+                f.flush()
+                os.fsync(f.fileno())
+        segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                          if name.endswith(SEGMENT_SUFFIX))
+        for segment in segments:
+            self.segments[segment] = os.path.getsize(self.segment_path(segment))
+
+        try:
+            with open(self.cursor_path) as f:
+                cursor = json.load(f)
+            self.position = (cursor['segment'], cursor['offset'])
+        except (OSError, ValueError, KeyError):
+            self.position = (segments[0], 0) if segments else (0, 0)
+
+        if segments:
+            last = segments[-1]
+            valid = self._valid_length(last)
+            if valid < self.segments[last]:
+                with open(self.segment_path(last), 'r+b') as f:
+                    f.truncate(valid)
+                    os.fsync(f.fileno())
+                self.segments[last] = valid
+            self.active = last
+        else:
+            self.active = max(self.position[0], 1)
+            self.segments[self.active] = 0
+        if self.position[0] not in self.segments:
+            # The segment was dropped by the size cap
+            following = [number for number in self.segments if number >= self.position[0]]
+            self.position = (min(following), 0) if following else (self.active, 0)
+        self.file = open(self.segment_path(self.active), 'ab', buffering=0)
+
+        self.flusher = threading.Thread(target=self._flush_loop, name="spool-fsync", daemon=True)
+        self.flusher.start()
+
+    def _valid_length(self, segment: int) -> int:
+        offset = 0
+        with open(self.segment_path(segment), 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return offset
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    return offset
+                offset += RECORD_HEADER.size + length
+
+    def append(self, temps: np.ndarray, timestamps: np.ndarray, sensor_ids: np.ndarray) -> None:
+        """
+        Appends the readings of a page and returns once they were synced to disk.
+        """
+        records = np.empty(len(temps), dtype=SPOOL_RECORD)
+        records['time'], records['temp'], records['sensor_id'] = timestamps, temps, sensor_ids
+        payload = records.tobytes()
+        size = RECORD_HEADER.size + len(payload)
+
+        with self.lock:
+            if self.segments[self.active] and self.segments[self.active] + size > self.segment_bytes:
+                self._rotate()
+            self._enforce_cap(size)
+            self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.segments[self.active] += size
+            self.appended += 1
+            seq = self.appended
+            self.unsynced.notify()
+            while self.synced_seq < seq and not self.stopped:
+                self.synced.wait()
+
+    def _rotate(self) -> None:
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.active += 1
+        self.segments[self.active] = 0
+        self.file = open(self.segment_path(self.active), 'ab', buffering=0)
+        self._fsync_directory()
+
+    def _enforce_cap(self, incoming: int = 0) -> None:
+        while sum(self.segments.values()) + incoming > self.max_bytes and len(self.segments) > 1:
+            oldest = min(self.segments)
+            segment, offset = self.position
+            if oldest >= segment:
+                self.dropped_bytes += self.segments[oldest] - (offset if oldest == segment else 0)
+                self.position = (oldest + 1, 0)
+            os.remove(self.segment_path(oldest))
+            del self.segments[oldest]
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self.lock:
+                while self.synced_seq == self.appended and not self.stopped:
+                    self.unsynced.wait()
+                if self.stopped:
+                    return
+            # Appends of other pollers arriving meanwhile share this fsync
+            if self.fsync_interval > 0:
+                time.sleep(self.fsync_interval)
+            with self.lock:
+                if self.file is None:
+                    return
+                seq = self.appended
+                # Appends go on while the copy is synced, a rotation syncs the old segment by itself
+                fd = os.dup(self.file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self.lock:
+                self.synced_seq = max(self.synced_seq, seq)
+                self.synced.notify_all()
+
+    def _fsync_directory(self) -> None:
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def pending_bytes(self) -> int:
+        with self.lock:
+            segment, offset = self.position
+            return sum(size for number, size in self.segments.items() if number >= segment) - offset
+
+    def read(self, max_readings: int) -> tuple[np.ndarray, tuple] | None:
+        """
+        Returns up to about max_readings undrained readings, whole pages only, and the position after them to
+        commit() once they are stored. Returns None if the spool is drained.
+        """
+        with self.lock:
+            segment, offset = self.position
+            sizes = dict(self.segments)
+        chunks = []
+        count = 0
+        while count < max_readings:
+            if segment not in sizes or offset >= sizes[segment]:
+                following = [number for number in sizes if number > segment]
+                if not following:
+                    break
+                segment, offset = min(following), 0
+                continue
+
+            try:
+                with open(self.segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    while count < max_readings and offset < sizes[segment]:
+                        length, checksum = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                        payload = f.read(length)
+                        offset += RECORD_HEADER.size + length
+                        if zlib.crc32(payload) == checksum:
+                            records = np.frombuffer(payload, dtype=SPOOL_RECORD)
+                            chunks.append(records)
+                            count += len(records)
+            except FileNotFoundError:
+                # Dropped by the size cap while it was read
+                offset = sizes[segment]
+
+        if not chunks and (segment, offset) == self.position:
+            return None
+        records = np.concatenate(chunks) if chunks else np.empty(0, dtype=SPOOL_RECORD)
+        return records, (segment, offset)
+
+    def commit(self, position: tuple) -> None:
+        """
+        Marks everything before position as stored and removes the segments that were drained completely. A position
+        that is not ahead of the current one, because the size cap dropped the readings meanwhile, is ignored.
+        """
+        with self.lock:
+            if tuple(position) <= self.position:
+                return
+        tmp_path = self.cursor_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.cursor_path)
+
+        with self.lock:
+            if tuple(position) > self.position:
+                self.position = tuple(position)
+            for segment in [number for number in self.segments if number < self.position[0] and number != self.active]:
+                os.remove(self.segment_path(segment))
+                del self.segments[segment]
+
+    def close(self) -> None:
+        with self.lock:
+            self.stopped = True
+            if self.file is not None:
+                os.fsync(self.file.fileno())
+                self.synced_seq = self.appended
+                self.file.close()
+                self.file = None
+            self.synced.notify_all()
+            self.unsynced.notify_all()
@@ -0,0 +1,482 @@
+######################################################################
+#                                                                    #
+#                 Storage backends                                   #
+#                                                                    #
+#   Every statement the collector runs against temp_data, behind     #
+#   one interface with two implementations:                          #
+#   - MySQLStorage: connection pool, the per-reading statements as   #
+#     server-side prepared statements kept per connection, bulk      #
+#     writes as multi-row INSERTs                                    #
+#   - SQLiteStorage: one embedded database file in WAL mode for      #
+#     small sites without a MySQL server                             #
+#                                                                    #
+#   A session is one borrowed connection. Sessions nest per thread,  #
+#   so a whole page is decided and written on the same connection.  #
+#   Streamed reads get a connection of their own, outside the pool.  #
+#                                                                    #
+######################################################################
+
+from contextlib import contextmanager
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+import threading
+import weakref
+import rollups
+import sqlite3
+import queue
+import sys
+
+DUPLICATE_WINDOW = timedelta(seconds=5)
+
+SELECT_LAST_RECORDS_ALL = """
+SELECT sensor_id, temp, time
+FROM (
+    SELECT sensor_id, temp, time, id,
+           ROW_NUMBER() OVER (PARTITION BY sensor_id ORDER BY id DESC) AS row_num
+    FROM temp_data
+) AS ranked
+WHERE row_num <= 2
+ORDER BY sensor_id, id DESC
+"""
+SELECT_LAST_RECORDS = "SELECT temp, time FROM temp_data WHERE sensor_id = %s ORDER BY id DESC LIMIT 2"
+SELECT_STORED_ROWS = "SELECT temp, time FROM temp_data WHERE sensor_id = %s AND time BETWEEN %s AND %s"
+SELECT_DUPLICATE = "SELECT id FROM temp_data WHERE sensor_id = %s AND temp = %s AND time BETWEEN %s AND %s LIMIT 1"
+INSERT_ROW = "INSERT INTO temp_data (temp, time, sensor_id) VALUES (%s, %s, %s)"
+
+
+class PoolTimeout(Exception):
+    """
+    No connection became free within the acquire timeout.
+    """
+
+
+def database_errors() -> tuple:
+    """
+    The exceptions of failed database calls of both backends, for except clauses. mysql.connector is only imported
+    by MySQLStorage, before that nothing can raise its errors.
+    """
+    mysql = sys.modules.get('mysql.connector')
+    if mysql is None:
+        return sqlite3.Error, PoolTimeout
+    return mysql.Error, sqlite3.Error, PoolTimeout
+
+
+class Session:
+    """
+    Statements of the collector on one connection. Subclasses provide execute() for the hot per-reading statements
+    and the SQL that differs between the databases.
+    """
+    dialect = ''
+    MOVE_ROW = ''
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.cursor = None
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        """
+        Runs one of the module's statements and returns all its rows.
+        """
+        raise NotImplementedError
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        """
+        Runs an ad hoc read-only query and ends the transaction it opened.
+        """
+        self.cursor.execute(sql, params)
+        rows = self.cursor.fetchall()
+        self.connection.rollback()
+        return rows
+
+    def stream(self, sql: str, params: tuple = (), size: int = 1000) -> Iterator[list]:
+        """
+        Yields the rows of a query in chunks of size rows without loading all of them.
+        """
+        raise NotImplementedError
+
+    def last_records_all(self) -> list:
+        return self.execute(SELECT_LAST_RECORDS_ALL)
+
+    def last_records(self, sensor_id) -> list:
+        return self.execute(SELECT_LAST_RECORDS, (sensor_id,))
+
+    def stored_rows(self, sensor_id, start: datetime, end: datetime) -> list:
+        return self.execute(SELECT_STORED_ROWS, (sensor_id, start, end))
+
+    def is_duplicate(self, sensor_id, temp, timestamp: datetime) -> bool:
+        """
+        True if an equal reading of the sensor is stored within 5 seconds before timestamp.
+        """
+        return bool(self.execute(SELECT_DUPLICATE, (sensor_id, temp, timestamp - DUPLICATE_WINDOW, timestamp)))
+
+    def insert(self, temp, timestamp: datetime, sensor_id) -> None:
+        self.execute(INSERT_ROW, (temp, timestamp, sensor_id))
+
+    def move(self, sensor_id, new_time: datetime) -> None:
+        """
+        Moves the timestamp of the newest row of a sensor.
+        """
+        self.execute(self.MOVE_ROW, (new_time, sensor_id))
+
+    def insert_many(self, rows: list) -> None:
+        self.cursor.executemany(INSERT_ROW, rows)
+
+    def move_many(self, updates: dict) -> None:
+        for sensor_id, new_time in updates.items():
+            self.move(sensor_id, new_time)
+
+    def refresh_rollups(self, touched: dict) -> None:
+        rollups.refresh(self.cursor, touched, self.dialect)
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.connection.rollback()
+
+
+class Storage:
+    """
+    Database behind the collector. Subclasses borrow and return connections; session() handles nesting.
+    """
+    session_class = Session
+
+    def __init__(self, pool_size: int = 10, stream_size: int = 2, acquire_timeout: float = 30.0) -> None:
+        self.pool_size = pool_size
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.stream_slots = threading.BoundedSemaphore(stream_size)
+        self.acquire_timeout = acquire_timeout
+        self.local = threading.local()
+
+    def open(self) -> None:
+        """
+        Connects and creates missing tables. Raises one of database_errors() if the database is not reachable.
+        """
+        raise NotImplementedError
+
+    def _acquire(self):
+        raise NotImplementedError
+
+    def _release(self, session: Session) -> None:
+        raise NotImplementedError
+
+    def _connect_stream(self) -> Session:
+        raise NotImplementedError
+
+    def _close_stream(self, session: Session) -> None:
+        raise NotImplementedError
+
+    def _take_slot(self, slots: threading.BoundedSemaphore) -> None:
+        if not slots.acquire(timeout=self.acquire_timeout):
+            raise PoolTimeout(f"No database connection free within {self.acquire_timeout:g} s")
+
+    @contextmanager
+    def session(self) -> Iterator[Session]:
+        """
+        Borrows a connection for the current thread. Nested calls in the same thread reuse it, it is returned when
+        the outermost block exits.
+        """
+        current = getattr(self.local, 'session', None)
+        if current is not None:
+            yield current
+            return
+
+        self.open()
+        self._take_slot(self.slots)
+        try:
+            session = self._acquire()
+            self.local.session = session
+            try:
+                yield session
+            finally:
+                self.local.session = None
+                self._release(session)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def stream_session(self) -> Iterator[Session]:
+        """
+        Opens a session on a connection of its own for a long read sent to a client while it runs, so a slow download
+        does not hold a connection of the pool. At most stream_size are open at once.
+        """
+        self.open()
+        self._take_slot(self.stream_slots)
+        try:
+            session = self._connect_stream()
+            try:
+                yield session
+            finally:
+                self._close_stream(session)
+        finally:
+            self.stream_slots.release()
+
+
+class MySQLSession(Session):
+    dialect = 'mysql'
+    # MySQL cannot select from the table an UPDATE changes, but sorts and limits the UPDATE itself
+    MOVE_ROW = "UPDATE temp_data SET time = %s WHERE sensor_id = %s ORDER BY id DESC LIMIT 1"
+
+    def __init__(self, connection, prepared: dict) -> None:
+        super().__init__(connection)
+        self.cursor = connection.cursor(buffered=True)
+        self.prepared = prepared
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        # A prepared cursor keeps one statement, so there is one per statement and connection. The statement is
+        # parsed by the server once and afterwards only the parameters are sent.
+        cursor = self.prepared.get(sql)
+        if cursor is None:
+            cursor = self.prepared[sql] = self.connection.cursor(prepared=True)
+        cursor.execute(sql, params)
+        return cursor.fetchall() if cursor.with_rows else []
+
+    def stream(self, sql: str, params: tuple = (), size: int = 1000) -> Iterator[list]:
+        # Unbuffered cursor: rows are read from the server chunk by chunk
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            # A client that went away leaves rows unread, the connection only takes statements again once they are
+            self.connection.consume_results()
+            cursor.close()
+            self.connection.rollback()
+
+
+class MySQLStorage(Storage):
+    """
+    MySQL server. Pooled connections keep their session between borrows, so their prepared statements stay valid
+    until the connection is lost.
+    """
+    session_class = MySQLSession
+
+    def __init__(self, pool_size: int = 10, create_rollups: bool = True, pool=None, stream_size: int = 2,
+                 acquire_timeout: float = 30.0, **connect_args) -> None:
+        super().__init__(pool_size, stream_size, acquire_timeout)
+        self.connect_args = connect_args
+        self.create_rollups = create_rollups
+        self.pool = pool
+        # Per pooled connection: the server session id and its prepared cursors by statement
+        self.prepared = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def open(self) -> None:
+        if self.pool is not None:
+            return
+        from mysql.connector.pooling import MySQLConnectionPool
+
+        with self.lock:
+            if self.pool is not None:
+                return
+            pool = MySQLConnectionPool(
+                pool_name="esp_pool", pool_size=self.pool_size, pool_reset_session=False, **self.connect_args
+            )
+            if self.create_rollups:
+                connection = pool.get_connection()
+                try:
+                    cursor = connection.cursor()
+                    rollups.create_tables(cursor)
+                    cursor.close()
+                finally:
+                    connection.close()
+            self.pool = pool
+
+    def _acquire(self) -> MySQLSession:
+        from mysql.connector import Error
+
+        connection = self.pool.get_connection()
+        try:
+            connection.ping(reconnect=True, attempts=3, delay=1)
+            # The pool hands out a new wrapper around the same connection every time. A connection the pool drops
+            # takes its cursors along, a reconnect gets a new connection id and a fresh set of prepared statements.
+            pooled = getattr(connection, '_cnx', connection)
+            connection_id = getattr(connection, 'connection_id', None)
+            stale = {}
+            with self.lock:
+                known_id, prepared = self.prepared.get(pooled, (None, None))
+                if prepared is None or known_id != connection_id:
+                    stale = prepared or {}
+                    prepared = {}
+                    self.prepared[pooled] = (connection_id, prepared)
+            for cursor in stale.values():
+                try:
+                    cursor.close()
+                except Error:
+                    pass
+            return MySQLSession(connection, prepared)
+        except Error:
+            connection.close()
+            raise
+
+    def _release(self, session: MySQLSession) -> None:
+        session.cursor.close()
+        session.connection.close()
+
+    def _connect_stream(self) -> MySQLSession:
+        from mysql.connector import connect
+
+        return MySQLSession(connect(**self.connect_args), {})
+
+    def _close_stream(self, session: MySQLSession) -> None:
+        try:
+            session.cursor.close()
+        finally:
+            session.connection.close()
+
+
+class SQLiteSession(Session):
+    dialect = 'sqlite'
+    MOVE_ROW = "UPDATE temp_data SET time = %s WHERE id = (SELECT MAX(id) FROM temp_data WHERE sensor_id = %s)"
+
+    def __init__(self, connection) -> None:
+        super().__init__(connection)
+        self.cursor = SQLiteCursor(connection.cursor())
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        # sqlite3 keeps compiled statements in a per-connection cache, the SQL text is the key
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def stream(self, sql: str, params: tuple = (), size: int = 1000) -> Iterator[list]:
+        cursor = SQLiteCursor(self.connection.cursor())
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            self.connection.rollback()
+
+    def move_many(self, updates: dict) -> None:
+        self.cursor.executemany(self.MOVE_ROW, [(new_time, sensor_id) for sensor_id, new_time in updates.items()])
+
+
+class SQLiteCursor:
+    """
+    sqlite3 cursor accepting the %s placeholders of the MySQL statements.
+    """
+    translated = {}
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self.inner = cursor
+
+    @classmethod
+    def translate(cls, sql: str) -> str:
+        translated = cls.translated.get(sql)
+        if translated is None:
+            translated = cls.translated[sql] = sql.replace('%s', '?')
+        return translated
+
+    def execute(self, sql: str, params=()) -> None:
+        self.inner.execute(self.translate(sql), tuple(params))
+
+    def executemany(self, sql: str, seq_params) -> None:
+        self.inner.executemany(self.translate(sql), seq_params)
+
+    def fetchall(self) -> list:
+        return self.inner.fetchall()
+
+    def fetchmany(self, size: int) -> list:
+        return self.inner.fetchmany(size)
+
+    def fetchone(self):
+        return self.inner.fetchone()
+
+    @property
+    def rowcount(self) -> int:
+        return self.inner.rowcount
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+SQLITE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS sensorId_list (
+      id INTEGER NOT NULL UNIQUE,
+      location VARCHAR(100) DEFAULT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS temp_data (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      temp FLOAT NOT NULL,
+      time TIMESTAMP NOT NULL,
+      sensor_id INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS temp_data_sensor_time ON temp_data (sensor_id, time)",
+    "CREATE INDEX IF NOT EXISTS temp_data_sensor_id ON temp_data (sensor_id, id)",
+)
+
+# Timestamps are stored as 'YYYY-MM-DD HH:MM:SS[.ffffff]' text, which sorts and compares like the time itself
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded SQLite database in WAL mode: readers never wait for the writer and a commit is one sequential log
+    append, synced at checkpoints rather than on every transaction.
+    """
+    session_class = SQLiteSession
+
+    def __init__(self, path: str, pool_size: int = 10, create_rollups: bool = True, stream_size: int = 2,
+                 acquire_timeout: float = 30.0) -> None:
+        super().__init__(pool_size, stream_size, acquire_timeout)
+        self.path = path
+        self.create_rollups = create_rollups
+        self.idle = queue.LifoQueue()
+        self.opened = False
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def open(self) -> None:
+        if self.opened:
+            return
+        with self.lock:
+            if self.opened:
+                return
+            connection = self._connect()
+            cursor = SQLiteCursor(connection.cursor())
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            if self.create_rollups:
+                rollups.create_tables(cursor, 'sqlite')
+            connection.commit()
+            self.idle.put(connection)
+            self.opened = True
+
+    def _acquire(self) -> SQLiteSession:
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+        return SQLiteSession(connection)
+
+    def _release(self, session: SQLiteSession) -> None:
+        session.connection.rollback()
+        session.cursor.close()
+        self.idle.put(session.connection)
+
+    def _connect_stream(self) -> SQLiteSession:
+        return SQLiteSession(self._connect())
+
+    def _close_stream(self, session: SQLiteSession) -> None:
+        session.cursor.close()
+        session.connection.close()
@@ -0,0 +1,41 @@
+from alerts import AlertEngine
+from hot_tier import HotTier
+import numpy as np
+import simulator
+
+RULES = [
+    {"name": "under-temperature", "type": "threshold", "below": 5, "hysteresis": 0.5},
+    {"name": "fast-change", "type": "rate", "change": 5, "window": 600},
+    {"name": "disconnected", "type": "disconnected", "count": 2},
+]
+
+
+def wire_temps(temps: list) -> np.ndarray:
+    """
+    Temperatures as the collector receives them: packed by the board's encode() and decoded again.
+    """
+    return np.array([simulator.decode_temp(simulator.encode(temp, 1)) for temp in temps])
+
+
+def events(engine: AlertEngine) -> list:
+    return sorted((rule, state) for (rule, state), count in engine.events.items() for _ in range(count))
+
+
+def test_disconnected_sensor_from_the_wire():
+    temps = wire_temps([21.0, -127.0, -127.0, -127.0, 21.5, 21.5])
+    assert temps[1] == -120.0
+
+    engine = AlertEngine()
+    engine.configure(RULES, [])
+    engine.add(temps, 1000.0 + np.arange(len(temps)) * 10, np.full(len(temps), 1))
+
+    # Only the disconnected rule sees the sentinel, the threshold and rate rules skip it
+    assert events(engine) == [('disconnected', 'firing'), ('disconnected', 'resolved')]
+
+
+def test_hot_tier_skips_disconnected_readings():
+    hot_tier = HotTier(capacity=16, retention=1e12)
+    temps = wire_temps([21.0, -127.0, 22.0])
+    hot_tier.add(temps, 1000.0 + np.arange(3), np.full(3, 1))
+
+    assert hot_tier.stats(1, 1e12)['samples'] == 2
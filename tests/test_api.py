@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from storage import SQLiteStorage
+from api_cache import ResponseCache
+from api import LOCATIONS, create_read_api
+from hot_tier import HotTier
+from flask import Flask
+import pytest
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'temp.db'), pool_size=1, stream_size=1, acquire_timeout=1)
+    storage.open()
+    with storage.session() as session:
+        start = datetime(2024, 1, 1)
+        session.insert_many([(20.0, start + timedelta(seconds=i), 1) for i in range(2500)])
+        session.commit()
+    return storage
+
+
+def client(storage, cache: ResponseCache):
+    web_app = Flask(__name__)
+    web_app.register_blueprint(create_read_api(storage.session, cache, HotTier(10, 3600), storage.stream_session))
+    return web_app.test_client()
+
+
+def test_stream_does_not_hold_a_pooled_connection(storage):
+    api = client(storage, ResponseCache())
+    response = api.get('/api/sensors/1/series?format=csv', buffered=False)
+    chunks = response.iter_encoded()
+    assert next(chunks) == b'time,temp\n'
+
+    # The only pooled connection stays free for the collector while the download is open
+    with storage.session() as session:
+        assert session.query("SELECT COUNT(*) FROM temp_data") == [(2500,)]
+    # A second download waits for the stream slot and gives up
+    assert api.get('/api/sensors/1/series?format=ndjson').status_code == 503
+
+    response.close()
+    assert len(api.get('/api/sensors/1/series?format=csv').data.splitlines()) == 2501
+
+
+
+def test_stale_answer_is_not_cached():
+    cache = ResponseCache()
+    generation = cache.generation(1)
+    # Readings of the sensor are written while its answer is built
+    cache.invalidate((1,))
+    cache.put('/api/sensors/1/series?', b'[]', 'etag', 1, generation)
+    assert cache.get('/api/sensors/1/series?') is None
+
+    generation = cache.generation(1)
+    cache.invalidate((2,))
+    cache.put('/api/sensors/1/series?', b'[]', 'etag', 1, generation)
+    assert cache.get('/api/sensors/1/series?') == (b'[]', 'etag')
+
+
+def test_locations_survive_written_readings():
+    cache = ResponseCache()
+    cache.put('/api/sensors?', b'[]', 'etag', LOCATIONS, cache.generation(LOCATIONS))
+    cache.put('/api/latest?', b'[]', 'etag', None, cache.generation())
+    cache.invalidate((1, 2))
+    assert cache.get('/api/sensors?') == (b'[]', 'etag')
+    assert cache.get('/api/latest?') is None
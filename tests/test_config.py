@@ -0,0 +1,53 @@
+import pytest
+import app
+
+DEVICES = ['192.168.0.50', '192.168.0.51']
+
+
+@pytest.fixture
+def pushed(monkeypatch) -> list:
+    pushes = []
+
+    def push_param(device_ip: str, path: str, description: str, error: str, max_retries: int = 3) -> bool:
+        pushes.append((device_ip, path.split('?')[0]))
+        return True
+
+    monkeypatch.setattr(app, 'push_param', push_param)
+    monkeypatch.setattr(app, 'measurement_interval', 10000)
+    monkeypatch.setattr(app, 'max_temp_difference_esp', 0.5)
+    return pushes
+
+
+@pytest.mark.parametrize('changed, paths', [
+    (None, ['/setinterval', '/setTempDiff']),
+    ({'device-time-measurement'}, ['/setinterval']),
+    ({'max_temp_difference_esp', 'server-time-get'}, ['/setTempDiff']),
+    ({'device-time-measurement', 'max_temp_difference_esp'}, ['/setinterval', '/setTempDiff']),
+    ({'server-time-get', 'max-difference'}, []),
+    (set(), []),
+])
+def test_only_changed_settings_are_pushed(pushed, changed, paths):
+    app.set_params(changed, DEVICES)
+    assert sorted(pushed) == sorted((device_ip, path) for device_ip in DEVICES for path in paths)
+
+
+def test_settings_go_to_every_known_device(pushed, monkeypatch):
+    monkeypatch.setattr(app.registry, 'ips', lambda: DEVICES)
+    app.set_params({'device-time-measurement'})
+    assert sorted(pushed) == [(device_ip, '/setinterval') for device_ip in DEVICES]
+
+
+def test_reload_pushes_the_changed_keys(pushed, monkeypatch):
+    monkeypatch.setattr(app.registry, 'ips', lambda: DEVICES)
+    monkeypatch.setattr(app, 'load_config', lambda: {'max_temp_difference_esp'})
+    app.reload_config()
+    assert sorted(pushed) == [(device_ip, '/setTempDiff') for device_ip in DEVICES]
+
+
+def test_unreadable_config_keeps_the_settings(pushed, monkeypatch):
+    def load_config() -> set:
+        raise ValueError("Expecting ',' delimiter")
+
+    monkeypatch.setattr(app, 'load_config', load_config)
+    app.reload_config()
+    assert pushed == []
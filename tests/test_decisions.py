@@ -0,0 +1,71 @@
+from storage import SQLiteStorage
+from hot_tier import is_connected
+import numpy as np
+import pytest
+import app
+
+# Quarter degrees are exact floats, so readings land right on the dead band
+MAX_TEMP_DIFFERENCE = 0.5
+MAX_TIME_DIFFERENCE = 60.0
+
+
+@pytest.fixture
+def sqlite_app(monkeypatch):
+    monkeypatch.setattr(app, 'max_temp_difference', MAX_TEMP_DIFFERENCE)
+    monkeypatch.setattr(app, 'max_time_difference', MAX_TIME_DIFFERENCE)
+    # Batches are committed in the middle of a page too
+    monkeypatch.setattr(app, 'db_flush_size', 7)
+    app.sensor_cache.invalidate()
+    yield app
+    app.sensor_cache.invalidate()
+
+
+def random_pages(seed: int, sensors: int = 3, pages: int = 12) -> list:
+    """
+    Pages of readings of a few sensors. Temperatures change by nothing, less than, exactly and more than
+    max-difference, gaps hit max-time-difference exactly and some readings are disconnected or sent twice.
+    """
+    rng = np.random.default_rng(seed)
+    temps = {sensor_id: 20.0 for sensor_id in range(1, sensors + 1)}
+    times = {sensor_id: 1700000000.0 for sensor_id in range(1, sensors + 1)}
+    result = []
+    for _ in range(pages):
+        page = []
+        for _ in range(int(rng.integers(1, 80))):
+            sensor_id = int(rng.integers(1, sensors + 1))
+            if page and rng.random() < 0.05:
+                page.append(page[-1])
+                continue
+            times[sensor_id] += float(rng.choice([1, 5, 20, MAX_TIME_DIFFERENCE, MAX_TIME_DIFFERENCE + 1, 300]))
+            temps[sensor_id] += float(rng.choice([0, 0, 0, 0.25, -0.25, 0.5, -0.5, 0.75, -1.0]))
+            temp = -120.0 if rng.random() < 0.03 else temps[sensor_id]
+            page.append((temp, times[sensor_id], sensor_id))
+        rng.shuffle(page)
+        result.append(tuple(np.array(column) for column in zip(*page)))
+    return result
+
+
+def stored(sqlite_app) -> list:
+    with sqlite_app.db_session() as session:
+        return session.query("SELECT sensor_id, time, temp FROM temp_data ORDER BY sensor_id, time, id")
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_pages_store_the_rows_of_single_readings(sqlite_app, tmp_path, monkeypatch, seed):
+    pages = random_pages(seed)
+
+    monkeypatch.setattr(app, 'storage', SQLiteStorage(str(tmp_path / 'single.db'), 1))
+    sqlite_app.sensor_cache.invalidate()
+    for temps, timestamps, sensor_ids in pages:
+        valid = is_connected(temps)
+        for index in np.lexsort((temps, timestamps)):
+            if valid[index]:
+                sqlite_app.check_and_insert_data(float(temps[index]), float(timestamps[index]), int(sensor_ids[index]))
+    single = stored(sqlite_app)
+
+    monkeypatch.setattr(app, 'storage', SQLiteStorage(str(tmp_path / 'pages.db'), 1))
+    sqlite_app.sensor_cache.invalidate()
+    for temps, timestamps, sensor_ids in pages:
+        assert sqlite_app.store_readings(temps, timestamps, sensor_ids) is not None
+    assert stored(sqlite_app) == single
+    assert len(single) > len(pages)
@@ -0,0 +1,18 @@
+from discovery import parse_device_reply
+import pytest
+
+
+@pytest.mark.parametrize('reply, sensor_ids', [
+    ("'DEVICE' ,3, [1, 2, 3]", [1, 2, 3]),
+    ("'DEVICE' ,1, [7]", [7]),
+    ("'DEVICE' ,2, [12,40]", [12, 40]),
+    ("'DEVICE' ,1, [5, ]", [5]),
+    ("'DEVICE' ,0, []", []),
+])
+def test_device_reply(reply, sensor_ids):
+    assert parse_device_reply(reply) == sensor_ids
+
+
+@pytest.mark.parametrize('packet', ["DISCOVER", "'DEVICE' ,2,", "'DEVICE' ,2, [1, two]", "[1, 2]", ""])
+def test_other_packets_are_ignored(packet):
+    assert parse_device_reply(packet) is None
@@ -0,0 +1,106 @@
+from health import ConnectivityProbe
+import health
+import pytest
+import app
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1700000000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(app, 'time', clock)
+    monkeypatch.setattr(app, 'breaker_failures', 2)
+    monkeypatch.setattr(app, 'breaker_backoff', 10.0)
+    monkeypatch.setattr(app, 'breaker_max_backoff', 600.0)
+    # No jitter
+    monkeypatch.setattr(app.random, 'uniform', lambda low, high: high)
+    return clock
+
+
+def test_breaker_opens_after_failures_in_a_row(clock):
+    registry = app.DeviceRegistry()
+    registry.add('192.168.0.50', [1])
+    device = registry.get('192.168.0.50')
+
+    assert device.record_failure() == 0
+    assert not device.is_open()
+    assert device.record_failure() == 10
+    assert device.is_open()
+    assert registry.claim(['192.168.0.50']) == []
+
+    # Half-open after the backoff: one fetch is tried, a failure doubles the backoff
+    clock.now += 10
+    assert registry.claim(['192.168.0.50']) == ['192.168.0.50']
+    assert registry.claim(['192.168.0.50']) == []
+    registry.done('192.168.0.50')
+    assert device.record_failure() == 20
+    clock.now += 19
+    assert device.is_open()
+    clock.now += 1
+    assert not device.is_open()
+
+    # The first success closes the breaker, the next failure does not open it again
+    device.record_success()
+    assert not device.is_open()
+    assert device.record_failure() == 0
+
+
+def test_backoff_is_capped(clock):
+    device = app.DeviceState('192.168.0.50')
+    backoffs = [device.record_failure() for _ in range(12)]
+    assert backoffs == [0, 10, 20, 40, 80, 160, 320, 600, 600, 600, 600, 600]
+    assert device.open_until == clock.now + 600
+
+
+def test_jitter_only_shortens_the_backoff(monkeypatch):
+    monkeypatch.setattr(app, 'breaker_failures', 1)
+    monkeypatch.setattr(app, 'breaker_backoff', 10.0)
+    device = app.DeviceState('192.168.0.50')
+    for _ in range(20):
+        device.consecutive_failures = 0
+        assert 5 <= device.record_failure() <= 10
+
+
+@pytest.fixture
+def probe(monkeypatch) -> tuple:
+    checks = []
+    online = [True]
+
+    def internet_on(host: str) -> bool:
+        checks.append(host)
+        return online[0]
+
+    monkeypatch.setattr(health, 'internet_on', internet_on)
+    probe = ConnectivityProbe(app.logger)
+    probe.configure('192.168.0.1', 5)
+    return probe, checks, online
+
+
+def test_probe_caches_the_state(probe, monkeypatch):
+    probe, checks, online = probe
+    monkeypatch.setattr(app, 'connectivity', probe)
+
+    assert probe.check()
+    assert checks == ['192.168.0.1']
+    # The collector reads the cached state without connecting
+    for _ in range(3):
+        assert app.check_internet_connection()
+    assert len(checks) == 1
+
+    online[0] = False
+    assert not probe.check()
+    assert not app.check_internet_connection()
+    assert len(checks) == 2
+    assert probe.dots == 1
+
+    online[0] = True
+    probe.check()
+    assert app.check_internet_connection()
+    assert probe.dots == 0
@@ -0,0 +1,21 @@
+from hot_tier import HotTier
+import numpy as np
+import time
+
+
+def test_reload_resizes_existing_rings():
+    tier = HotTier(100, 3600)
+    now = time.time()
+    tier.add(np.arange(50, dtype=float), now - 50 + np.arange(50), np.full(50, 1))
+
+    tier.configure(10, 3600)
+    assert tier.rings[1].capacity == 10
+    assert tier.stats(1, 3600)['samples'] == 10
+    assert tier.latest(1) == (now - 1, 49.0)
+
+    tier.configure(20, 3600)
+    tier.add(np.array([50.0]), np.array([now]), np.array([1]))
+    assert tier.stats(1, 3600)['samples'] == 11
+
+    tier.configure(0, 3600)
+    assert tier.sensors() == []
@@ -0,0 +1,58 @@
+from hot_tier import DISCONNECTED_TEMP
+import struct
+import pytest
+import app
+
+
+def encode(temp: float, sensor_id: int) -> int:
+    """
+    encode() of the firmware: tenths of a degree clamped to 1200, the sign in bit 12 and the sensor id above.
+    """
+    tenths = min(int(abs(temp) * 10 + 0.5), 1200)
+    return tenths | (temp < 0) << 12 | sensor_id << 13
+
+
+def binary_page(readings: list, remain: int = 0) -> bytes:
+    """
+    A format=bin /temp page as the firmware writes it: the '<cBHI' header, then a '<u2' word and a '<u4' age in
+    milliseconds per reading.
+    """
+    page = struct.pack('<cBHI', b'T', 1, len(readings), remain)
+    for temp, age, sensor_id in readings:
+        page += struct.pack('<HI', encode(temp, sensor_id), age)
+    return page
+
+
+def test_binary_page_round_trip():
+    readings = [(21.5, 0, 0), (-5.3, 1000, 1), (0.0, 60000, 7), (-127.0, 4294967295, 3), (85.0, 250, 2)]
+    page = app.decode_binary_page(binary_page(readings, remain=40000))
+
+    assert page.remain == 40000
+    assert page.skips
+    assert page.temps.tolist() == [21.5, -5.3, 0.0, -120.0, 85.0]
+    assert page.ages.tolist() == [0, 1000, 60000, 4294967295, 250]
+    assert page.sensor_ids.tolist() == [0, 1, 7, 3, 2]
+    # A disconnected sensor reads -127 C, the firmware clamps it to the sentinel
+    assert page.temps[3] == DISCONNECTED_TEMP
+
+
+def test_empty_binary_page():
+    page = app.decode_binary_page(binary_page([], remain=3))
+    assert len(page) == 0
+    assert page.remain == 3
+
+
+# Inside the last record, a whole record and inside the header
+@pytest.mark.parametrize('cut', [1, 6, 15])
+def test_truncated_binary_page_raises(cut):
+    content = binary_page([(21.5, 0, 0), (22.0, 1000, 1)])
+    with pytest.raises((ValueError, struct.error)):
+        app.decode_binary_page(content[:-cut])
+
+
+def test_unknown_page_format_raises():
+    content = binary_page([(21.5, 0, 0)])
+    with pytest.raises(ValueError):
+        app.decode_binary_page(b'J' + content[1:])
+    with pytest.raises(ValueError):
+        app.decode_binary_page(content[:1] + b'\x02' + content[2:])
@@ -0,0 +1,43 @@
+from datetime import datetime
+import partitions
+
+
+class Cursor:
+    """
+    Answers the partition query of information_schema with a fixed list and records the other statements.
+    """
+
+    def __init__(self, names: list) -> None:
+        self.names = names
+        self.statements = []
+        self.rows = []
+
+    def execute(self, sql: str, params=()) -> None:
+        if sql == partitions.SELECT_PARTITIONS:
+            self.rows = [(name,) for name in self.names]
+        else:
+            self.statements.append(sql)
+
+    def fetchall(self) -> list:
+        return self.rows
+
+
+def test_months_ahead_are_split_off_the_catch_all():
+    cursor = Cursor(['p202411', 'p202412', 'p_future'])
+    added = partitions.extend(cursor, 3, now=datetime(2024, 12, 15))
+    assert added == ['p202501', 'p202502', 'p202503', 'p202504']
+    assert cursor.statements == [
+        "ALTER TABLE temp_data REORGANIZE PARTITION p_future INTO ("
+        "PARTITION p202501 VALUES LESS THAN (UNIX_TIMESTAMP('2025-01-01')), "
+        "PARTITION p202502 VALUES LESS THAN (UNIX_TIMESTAMP('2025-02-01')), "
+        "PARTITION p202503 VALUES LESS THAN (UNIX_TIMESTAMP('2025-03-01')), "
+        "PARTITION p202504 VALUES LESS THAN (UNIX_TIMESTAMP('2025-04-01')), "
+        "PARTITION p_future VALUES LESS THAN MAXVALUE)"
+    ]
+
+
+def test_nothing_to_do():
+    cursor = Cursor(['p202504', 'p_future'])
+    assert partitions.extend(cursor, 3, now=datetime(2024, 12, 15)) == []
+    assert partitions.extend(Cursor([]), 3) == []
+    assert not cursor.statements
@@ -0,0 +1,81 @@
+from app import DeviceRegistry
+import json
+import pytest
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'sync_state.json')
+
+
+def test_save_and_load_round_trip(path):
+    registry = DeviceRegistry(path)
+    registry.add('192.168.0.50', [1, 2])
+    registry.add('192.168.0.51', [3])
+    registry.advance('192.168.0.50', {1: 1700000100.5, 2: 1700000200.0})
+    registry.save()
+    assert not registry.dirty
+
+    restarted = DeviceRegistry(path)
+    restarted.load()
+    assert restarted.restore_devices() == 2
+    assert restarted.device_sensors() == {'192.168.0.50': [1, 2], '192.168.0.51': [3]}
+    assert restarted.all_cursors() == {'192.168.0.50': {1: 1700000100.5, 2: 1700000200.0}, '192.168.0.51': {}}
+    assert sorted(restarted.take_new()) == ['192.168.0.50', '192.168.0.51']
+
+
+def test_cursors_of_missing_devices_are_kept(path):
+    registry = DeviceRegistry(path)
+    registry.add('192.168.0.50', [1])
+    registry.add('192.168.0.51', [2])
+    registry.advance('192.168.0.50', {1: 1700000100.0})
+    registry.advance('192.168.0.51', {2: 1700000200.0})
+    registry.save()
+
+    # Only one board was discovered after the restart, the other one keeps its cursor in the next save
+    restarted = DeviceRegistry(path)
+    restarted.load()
+    restarted.add('192.168.0.51', [2])
+    restarted.advance('192.168.0.51', {2: 1700000300.0})
+    restarted.save()
+    assert restarted.cursors('192.168.0.50') == {1: 1700000100.0}
+
+    with open(path) as f:
+        state = json.load(f)
+    assert state['devices'] == {'192.168.0.50': {'1': 1700000100.0}, '192.168.0.51': {'2': 1700000300.0}}
+    assert state['sensors'] == {'192.168.0.50': [1], '192.168.0.51': [2]}
+
+
+def test_board_on_a_new_address_keeps_its_cursor(path):
+    registry = DeviceRegistry(path)
+    registry.add('192.168.0.50', [1])
+    registry.advance('192.168.0.50', {1: 1700000100.0})
+    assert registry.add('192.168.0.60', [1]) == [1]
+    assert registry.device_sensors() == {'192.168.0.60': [1]}
+    assert registry.cursors('192.168.0.60') == {1: 1700000100.0}
+
+
+@pytest.mark.parametrize('content', ['{"devices": {"192.168.0.50": {"1": 17', '[]', '{"devices": {"192.168.0.50": 5}}',
+                                     '{"sensors": {"192.168.0.50": ["x"]}}'])
+def test_corrupt_state_file_means_a_full_resync(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+    registry = DeviceRegistry(path)
+    registry.load()
+    assert registry.restored == {}
+    assert registry.restore_devices() == 0
+
+    # The next save replaces the corrupt file
+    registry.add('192.168.0.50', [1])
+    registry.save()
+    restarted = DeviceRegistry(path)
+    restarted.load()
+    assert restarted.restore_devices() == 1
+
+
+def test_missing_state_file(path):
+    registry = DeviceRegistry(path)
+    registry.load()
+    assert registry.restore_devices() == 0
+    registry.save()
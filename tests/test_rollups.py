@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from collections import defaultdict
+from storage import SQLiteStorage
+import numpy as np
+import rollups
+import pytest
+
+START = datetime(2024, 3, 30, 22, 0)
+LEVELS = [('temp_rollup_minute', rollups.MINUTE), ('temp_rollup_hour', rollups.HOUR), ('temp_rollup_day', rollups.DAY)]
+
+
+@pytest.fixture
+def session(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'temp.db'), 1)
+    with storage.session() as session:
+        yield session
+
+
+def expected(session) -> dict:
+    """
+    Every rollup level computed from the readings in Python.
+    """
+    rows = session.query("SELECT sensor_id, time, temp FROM temp_data")
+    levels = {}
+    for table, length in LEVELS:
+        buckets = defaultdict(list)
+        for sensor_id, moment, temp in rows:
+            buckets[sensor_id, rollups.floor_time(moment, length)].append(temp)
+        levels[table] = {key: (min(temps), max(temps), sum(temps), len(temps)) for key, temps in buckets.items()}
+    return levels
+
+
+def stored(session) -> dict:
+    return {
+        table: {
+            (sensor_id, bucket): (temp_min, temp_max, temp_sum, samples)
+            for sensor_id, bucket, temp_min, temp_max, temp_sum, samples in session.query(f"SELECT * FROM {table}")
+        }
+        for table, _ in LEVELS
+    }
+
+
+def test_dirty_ranges_rebuild_the_touched_buckets(session):
+    rng = np.random.default_rng(1)
+    # Two sensors over two days, readings every 37 s, quarter degrees so the sums are exact
+    rows = [
+        (float(rng.integers(60, 100)) / 4, START + timedelta(seconds=37 * index), sensor_id)
+        for sensor_id in (1, 2) for index in range(5000)
+    ]
+    session.insert_many(rows)
+    rollups.rebuild(session.cursor, [(sensor_id, START, START + timedelta(days=3)) for sensor_id in (1, 2)], 'sqlite')
+    session.commit()
+    assert stored(session) == expected(session)
+
+    # New readings of sensor 1 on both sides of midnight and hours later
+    inserted = [START + timedelta(hours=2, seconds=seconds) for seconds in (-1, 0, 20, 61, 3600 * 5)]
+    session.insert_many([(30.5, moment, 1) for moment in inserted])
+    # The newest row of sensor 2 moves into the next hour
+    old_time = session.last_records(2)[0][1]
+    new_time = rollups.ceil_time(old_time, rollups.HOUR) + timedelta(minutes=1)
+    session.move(2, new_time)
+    rollups.refresh(session.cursor, {1: inserted, 2: [old_time, new_time]}, 'sqlite')
+    session.commit()
+    assert stored(session) == expected(session)
+
+
+def test_dirty_ranges_merge_close_writes():
+    base = datetime(2024, 1, 1, 12, 0, 30)
+    touched = {
+        1: [base, base + timedelta(minutes=4), base + timedelta(minutes=30)],
+        2: [base],
+    }
+    assert sorted(rollups.dirty_ranges(touched)) == [
+        (1, datetime(2024, 1, 1, 12, 0), datetime(2024, 1, 1, 12, 5)),
+        (1, datetime(2024, 1, 1, 12, 30), datetime(2024, 1, 1, 12, 31)),
+        (2, datetime(2024, 1, 1, 12, 0), datetime(2024, 1, 1, 12, 1)),
+    ]
@@ -0,0 +1,59 @@
+from storage import SQLiteStorage
+import numpy as np
+import pytest
+import app
+
+
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'storage', SQLiteStorage(str(tmp_path / 'temp.db'), 2))
+    monkeypatch.setattr(app, 'max_temp_difference', 0.5)
+    monkeypatch.setattr(app, 'max_time_difference', 60.0)
+    app.sensor_cache.invalidate()
+    yield app
+    app.sensor_cache.invalidate()
+
+
+def last_two_rows(sqlite_app, sensor_id) -> list:
+    """
+    What the collector read before every decision before it had the cache.
+    """
+    with sqlite_app.db_session() as session:
+        return session.query("SELECT temp, time FROM temp_data WHERE sensor_id = %s ORDER BY id DESC LIMIT 2",
+                             (sensor_id,))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_cache_matches_the_last_two_rows(sqlite_app, seed):
+    rng = np.random.default_rng(seed)
+    sensors = (1, 2, 3)
+    temps = np.full(len(sensors), 20.0)
+    now = 1700000000.0
+    for step in range(60):
+        now += float(rng.choice([1, 30, 60, 61, 600]))
+        temps += rng.choice([0, 0, 0.25, -0.5, 1.0], len(sensors))
+        if step % 3:
+            # One reading per sensor through the single-reading path
+            for sensor_id, temp in zip(sensors, temps.tolist()):
+                sqlite_app.check_and_insert_data(temp, now + sensor_id, sensor_id)
+        else:
+            # A page of a few readings per sensor through the batched path
+            timestamps = now + np.arange(4)[:, None] * 20.0 + np.array(sensors)
+            page_temps = temps + rng.choice([0, 0.25, 0.75], (4, len(sensors)))
+            sensor_ids = np.broadcast_to(np.array(sensors), (4, len(sensors)))
+            sqlite_app.store_readings(page_temps.ravel(), timestamps.ravel(), sensor_ids.ravel())
+            now += 80
+
+        for sensor_id in sensors:
+            assert sqlite_app.sensor_cache.get(sensor_id) == last_two_rows(sqlite_app, sensor_id)
+
+    # A warm cache loaded with one query holds the same records
+    sqlite_app.sensor_cache.resync()
+    for sensor_id in sensors:
+        assert sqlite_app.sensor_cache.records[sensor_id] == last_two_rows(sqlite_app, sensor_id)
+
+
+def test_unknown_sensor(sqlite_app):
+    assert sqlite_app.sensor_cache.get(9) == []
+    sqlite_app.check_and_insert_data(21.0, 1700000000.0, 9)
+    assert sqlite_app.sensor_cache.get(9) == last_two_rows(sqlite_app, 9)
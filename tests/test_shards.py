@@ -0,0 +1,50 @@
+from storage import SQLiteStorage
+from shards import ShardCoordinator, LeaseLost
+import numpy as np
+import pytest
+import app
+
+DEVICE = '192.168.0.50'
+
+
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'storage', SQLiteStorage(str(tmp_path / 'temp.db'), 2))
+    monkeypatch.setattr(app, 'max_temp_difference', 0.2)
+    monkeypatch.setattr(app, 'max_time_difference', 3600.0)
+    app.sensor_cache.invalidate()
+    yield app
+    app.sensor_cache.invalidate()
+
+
+def heartbeat(app, coordinator: ShardCoordinator) -> dict:
+    with app.db_session() as session:
+        acquired, _ = coordinator.heartbeat(session, {DEVICE: [1]}, {})
+    return acquired
+
+
+def test_worker_that_lost_its_lease_writes_nothing(sqlite_app):
+    first = ShardCoordinator('first')
+    assert DEVICE in heartbeat(sqlite_app, first)
+    fence = first.fence(DEVICE)
+
+    # The first worker stalls until its lease and heartbeat ran out, the second one takes the board over
+    with sqlite_app.db_session() as session:
+        session.cursor.execute("UPDATE device_leases SET expires = 0")
+        session.cursor.execute("UPDATE collector_workers SET expires = 0")
+        session.commit()
+    second = ShardCoordinator('second')
+    assert DEVICE in heartbeat(sqlite_app, second)
+
+    with sqlite_app.db_session() as session:
+        with pytest.raises(LeaseLost):
+            fence(session)
+    temps = np.array([21.0, 22.0, 23.0])
+    timestamps = 1000.0 + np.arange(3) * 60
+    assert sqlite_app.store_readings(temps, timestamps, np.full(3, 1), fence) is None
+    with sqlite_app.db_session() as session:
+        assert session.query("SELECT COUNT(*) FROM temp_data") == [(0,)]
+
+    assert sqlite_app.store_readings(temps, timestamps, np.full(3, 1), second.fence(DEVICE)) is not None
+    with sqlite_app.db_session() as session:
+        assert session.query("SELECT COUNT(*) FROM temp_data") == [(3,)]
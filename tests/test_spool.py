@@ -0,0 +1,84 @@
+from storage import SQLiteStorage
+from spool import Spool
+import numpy as np
+import pytest
+import app
+
+
+def page(start: float, count: int, sensor_id: int = 1) -> tuple:
+    timestamps = start + np.arange(count, dtype=float)
+    return np.full(count, 21.0), timestamps, np.full(count, sensor_id)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = Spool(str(tmp_path / 'spool'), max_bytes=4096, segment_bytes=1 << 20, fsync_interval=0)
+    spool.open()
+    yield spool
+    spool.close()
+
+
+def test_size_cap_holds_within_one_segment(spool):
+    for start in range(0, 2000, 10):
+        spool.append(*page(start, 10))
+        assert sum(spool.segments.values()) <= spool.max_bytes
+    assert spool.dropped_bytes > 0
+
+    records, _ = spool.read(10_000)
+    # Only the newest pages are left
+    assert records['time'].max() == 1999
+
+
+def test_commit_ignores_positions_behind(spool):
+    spool.append(*page(0, 10))
+    records, position = spool.read(100)
+    spool.append(*page(10, 10))
+    _, later = spool.read(100)
+    spool.commit(later)
+    spool.commit(position)
+    assert spool.position == later
+    assert spool.read(100) is None
+
+
+def test_spool_id_survives_a_restart(spool, tmp_path):
+    again = Spool(str(tmp_path / 'spool'), fsync_interval=0)
+    again.open()
+    assert again.spool_id == spool.spool_id
+    again.close()
+    other = Spool(str(tmp_path / 'other'), fsync_interval=0)
+    other.open()
+    assert other.spool_id != spool.spool_id
+    other.close()
+
+
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'storage', SQLiteStorage(str(tmp_path / 'temp.db'), 2))
+    monkeypatch.setattr(app, 'max_temp_difference', 0.2)
+    monkeypatch.setattr(app, 'max_time_difference', 3600.0)
+    app.sensor_cache.invalidate()
+    yield app
+    app.sensor_cache.invalidate()
+
+
+def rows(app) -> list:
+    with app.db_session() as session:
+        return session.query("SELECT temp, time FROM temp_data ORDER BY id")
+
+
+def test_readings_stored_before_a_crash_are_not_replayed(sqlite_app, spool, monkeypatch):
+    monkeypatch.setattr(sqlite_app, 'reading_spool', spool)
+    temps = np.array([21.0, 21.0, 21.1, 25.0, 25.0])
+    spool.append(temps, 1000.0 + np.arange(5) * 10, np.full(5, 1))
+
+    # The collector dies after the transaction, before the spool file saw the commit
+    with monkeypatch.context() as crash:
+        crash.setattr(spool, 'commit', lambda position: None)
+        assert sqlite_app.SpoolWriter().drain() == 5
+    stored = rows(sqlite_app)
+    assert spool.read(100) is not None
+
+    sqlite_app.sensor_cache.invalidate()
+    assert sqlite_app.SpoolWriter().drain() == 0
+    assert rows(sqlite_app) == stored
+    assert spool.read(100) is None
@@ -0,0 +1,74 @@
+from storage import MySQLStorage
+import gc
+
+
+class Cursor:
+    with_rows = False
+
+    def __init__(self) -> None:
+        self.closed = False
+
+    def execute(self, sql, params=()) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class Connection:
+    """
+    The server connection inside the pool, kept across borrows.
+    """
+
+    def __init__(self) -> None:
+        self.connection_id = 1
+
+
+class Pooled:
+    """
+    The wrapper the pool hands out on every borrow.
+    """
+
+    def __init__(self, cnx: Connection) -> None:
+        self._cnx = cnx
+        self.connection_id = cnx.connection_id
+
+    def ping(self, **kwargs) -> None:
+        pass
+
+    def cursor(self, **kwargs) -> Cursor:
+        return Cursor()
+
+    def close(self) -> None:
+        pass
+
+
+class Pool:
+    def __init__(self) -> None:
+        self.cnx = Connection()
+
+    def get_connection(self) -> Pooled:
+        return Pooled(self.cnx)
+
+
+def test_prepared_cursors_follow_the_pooled_connection():
+    pool = Pool()
+    storage = MySQLStorage(1, pool=pool)
+    with storage.session() as session:
+        session.execute("SELECT 1")
+        first = session.prepared["SELECT 1"]
+    with storage.session() as session:
+        session.execute("SELECT 1")
+        assert session.prepared["SELECT 1"] is first
+
+    # A reconnect starts a new server session, the old statements are gone
+    pool.cnx.connection_id = 2
+    with storage.session() as session:
+        session.execute("SELECT 1")
+        assert session.prepared["SELECT 1"] is not first
+    assert first.closed
+
+    # Cursors of a connection the pool dropped go with it
+    pool.cnx = session = None
+    gc.collect()
+    assert len(storage.prepared) == 0
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import transfer
+import pytest
+
+START = datetime(2024, 1, 1)
+
+
+def indexes(storage) -> set:
+    with storage.session() as session:
+        return transfer.existing_indexes(session)
+
+
+def count(storage) -> int:
+    with storage.session() as session:
+        return session.query("SELECT COUNT(*) FROM temp_data")[0][0]
+
+
+@pytest.fixture
+def export_file(tmp_path):
+    source = transfer.open_storage(str(tmp_path / 'source.db'))
+    with source.session() as session:
+        session.insert_many([(20.0 + i % 7, START + timedelta(seconds=10 * i), i % 3 + 1) for i in range(1000)])
+        session.commit()
+    path = str(tmp_path / 'readings.csv.gz')
+    transfer.export_readings(source, path, chunk=300)
+    return path
+
+
+def interrupt_after(monkeypatch, chunks: int) -> None:
+    original = transfer.note_ranges
+    calls = []
+
+    def note_ranges(ranges, rows):
+        calls.append(len(rows))
+        if len(calls) > chunks:
+            raise KeyboardInterrupt
+        original(ranges, rows)
+    monkeypatch.setattr(transfer, 'note_ranges', note_ranges)
+
+
+def test_interrupted_import_resumes_with_indexes(tmp_path, monkeypatch, export_file):
+    target = transfer.open_storage(str(tmp_path / 'target.db'))
+    interrupt_after(monkeypatch, 2)
+    with pytest.raises(KeyboardInterrupt):
+        transfer.import_readings(target, export_file, chunk=200)
+    # The collector gets its indexes back while the import waits to be resumed
+    assert indexes(target) == set(transfer.INDEXES)
+    assert count(target) == 400
+
+    monkeypatch.undo()
+    transfer.import_readings(target, export_file, chunk=200)
+    assert count(target) == 1000
+    assert indexes(target) == set(transfer.INDEXES)
+
+
+def test_resume_keeps_indexes_of_a_live_table(tmp_path, monkeypatch, export_file):
+    target = transfer.open_storage(str(tmp_path / 'target.db'))
+    with target.session() as session:
+        session.insert_many([(21.0, START - timedelta(days=1), 1)])
+        session.commit()
+
+    interrupt_after(monkeypatch, 1)
+    with pytest.raises(KeyboardInterrupt):
+        transfer.import_readings(target, export_file, chunk=200)
+    monkeypatch.undo()
+
+    dropped = []
+    monkeypatch.setattr(transfer, 'drop_indexes', dropped.append)
+    transfer.import_readings(target, export_file, chunk=200)
+    assert not dropped
+    assert count(target) == 1001
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from storage import SQLiteStorage
+import sqlite3
+import pytest
+import app
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'storage', SQLiteStorage(str(tmp_path / 'temp.db'), 2))
+    app.sensor_cache.invalidate()
+    yield app
+    app.sensor_cache.invalidate()
+
+
+def stored(sqlite_app) -> list:
+    with sqlite_app.db_session() as session:
+        return session.query("SELECT temp, time, sensor_id FROM temp_data ORDER BY id")
+
+
+def test_rows_are_written_on_flush(sqlite_app):
+    batch = sqlite_app.WriteBatch(flush_size=10)
+    assert batch.insert(20.0, START, 1)
+    assert batch.insert(25.0, START + timedelta(seconds=60), 1)
+    batch.update_timestamp(1, START + timedelta(seconds=90))
+    # An equal reading within 5 seconds of a queued one is dropped
+    assert not batch.insert(25.0, START + timedelta(seconds=93), 1)
+    assert stored(sqlite_app) == []
+
+    assert batch.flush() == 2
+    assert stored(sqlite_app) == [(20.0, START, 1), (25.0, START + timedelta(seconds=90), 1)]
+    assert sqlite_app.sensor_cache.get(1) == [(25.0, START + timedelta(seconds=90)), (20.0, START)]
+    assert batch.flush() == 0
+
+
+def test_full_batch_is_written_right_away(sqlite_app):
+    batch = sqlite_app.WriteBatch(flush_size=3)
+    for second in range(2):
+        batch.insert(20.0 + second, START + timedelta(seconds=second * 60), 1)
+    assert stored(sqlite_app) == []
+    batch.insert(30.0, START + timedelta(seconds=120), 2)
+    assert len(stored(sqlite_app)) == 3
+    assert not batch.inserts
+
+
+def test_failed_write_rolls_the_batch_back(sqlite_app):
+    sqlite_app.check_and_insert_data(20.0, START.timestamp(), 1)
+    sqlite_app.check_and_insert_data(30.0, START.timestamp() + 60, 1)
+    rows = stored(sqlite_app)
+
+    def fail(session) -> None:
+        raise sqlite3.OperationalError("disk I/O error")
+
+    failures = sqlite_app.batch_failures_total.values.get((), 0)
+    batch = sqlite_app.WriteBatch(flush_size=10)
+    batch.before_commit = fail
+    batch.update_timestamp(1, START + timedelta(seconds=90))
+    batch.insert(40.0, START + timedelta(seconds=120), 2)
+    assert batch.flush() == 0
+
+    assert batch.failed
+    assert sqlite_app.batch_failures_total.values[()] == failures + 1
+    # Neither the move nor the insert is stored, and the cache reads the database again
+    assert stored(sqlite_app) == rows
+    assert 1 not in sqlite_app.sensor_cache.records
+    assert sqlite_app.sensor_cache.get(1) == [(30.0, START + timedelta(seconds=60)), (20.0, START)]
@@ -0,0 +1,489 @@
+######################################################################
+#                                                                    #
+#                 Bulk import and export of readings                 #
+#                                                                    #
+#   Moves the history of temp_data between sites or into a fresh     #
+#   install as CSV or NDJSON files, gzip compressed if the name      #
+#   ends in .gz:                                                     #
+#                                                                    #
+#   python transfer.py export readings.csv.gz [--since] [--until]    #
+#   python transfer.py import readings.csv.gz                        #
+#                                                                    #
+#   Both run in chunks of --chunk rows, so memory stays bounded, and #
+#   resume where an interrupted run stopped. Import loads a chunk    #
+#   with LOAD DATA LOCAL INFILE where the server allows it, else     #
+#   with one multi-row INSERT. Indexes are rebuilt once at the end   #
+#   when the table was empty, then so are the rollups of the         #
+#   imported range.                                                  #
+#                                                                    #
+######################################################################
+
+from storage import MySQLStorage, SQLiteStorage, Storage, SQLITE_SCHEMA, database_errors
+from mysql.connector import Error
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from itertools import islice
+from dotenv import load_dotenv
+from os import getenv
+import tempfile
+import argparse
+import rollups
+import gzip
+import time
+import json
+import csv
+import sys
+import os
+
+CHUNK_ROWS = 50000
+COLUMNS = ('sensor_id', 'time', 'temp')
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+# LOAD DATA LOCAL reads chunk files from this directory only
+INFILE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'esp-transfer')
+LOAD_CHUNK = (
+    "LOAD DATA LOCAL INFILE %s INTO TABLE temp_data "
+    "FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' (temp, time, sensor_id)"
+)
+# Server or client refusing LOAD DATA LOCAL: local_infile off, or the file outside the allowed directory
+LOCAL_INFILE_ERRORS = {1148, 2068, 3948, 3950}
+
+# The secondary indexes of temp_data, see mysql_database.ddl
+INDEXES = {
+    'temp_data_sensor_time': "(sensor_id, time)",
+    'temp_data_sensor_id': "(sensor_id, id)",
+}
+SELECT_INDEXES = {
+    'mysql': "SELECT DISTINCT index_name FROM information_schema.statistics "
+             "WHERE table_schema = DATABASE() AND table_name = 'temp_data'",
+    'sqlite': "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'temp_data'",
+}
+
+# Rows of every import file already committed, written in the transaction of each chunk, and whether the import
+# defers the indexes
+CREATE_PROGRESS_TABLE = """
+CREATE TABLE IF NOT EXISTS transfer_progress (
+  source varchar(255) NOT NULL,
+  rows_done bigint NOT NULL DEFAULT 0,
+  ranges text,
+  finished int NOT NULL DEFAULT 0,
+  deferred int NOT NULL DEFAULT 0,
+  PRIMARY KEY (source)
+)"""
+MYSQL_TABLE_OPTIONS = " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci"
+SELECT_PROGRESS = "SELECT rows_done, ranges, finished, deferred FROM transfer_progress WHERE source = %s"
+UPSERT_PROGRESS = {
+    'mysql': "INSERT INTO transfer_progress (source, rows_done, ranges, finished, deferred) "
+             "VALUES (%s, %s, %s, %s, %s) "
+             "ON DUPLICATE KEY UPDATE rows_done = VALUES(rows_done), ranges = VALUES(ranges), "
+             "finished = VALUES(finished), deferred = VALUES(deferred)",
+    'sqlite': "INSERT INTO transfer_progress (source, rows_done, ranges, finished, deferred) "
+              "VALUES (%s, %s, %s, %s, %s) "
+              "ON CONFLICT (source) DO UPDATE SET rows_done = excluded.rows_done, ranges = excluded.ranges, "
+              "finished = excluded.finished, deferred = excluded.deferred",
+}
+
+
+def file_format(path: str) -> tuple[str, bool]:
+    """
+    Returns the format of a file from its name, csv or ndjson, and whether it is gzip compressed.
+    """
+    compressed = path.endswith('.gz')
+    name = path[:-3] if compressed else path
+    for extension, fmt in FORMATS.items():
+        if name.endswith(extension):
+            return fmt, compressed
+    raise ValueError(f"Cant tell the format of {path}, name it .csv, .ndjson or .jsonl (+ .gz to compress)")
+
+
+def open_storage(sqlite_path: str | None = None) -> Storage:
+    """
+    The SQLite file at sqlite_path, else the MySQL database from .env with LOAD DATA LOCAL allowed for the chunk
+    files of an import.
+    """
+    if sqlite_path:
+        storage = SQLiteStorage(sqlite_path, pool_size=1)
+    else:
+        load_dotenv()
+        os.makedirs(INFILE_DIRECTORY, exist_ok=True)
+        storage = MySQLStorage(
+            1,
+            host=getenv('DATABASE_HOST'),
+            port=int(getenv('DATABASE_PORT', 3306)),
+            user=getenv('DATABASE_USER'),
+            password=getenv('DATABASE_PASSWORD'),
+            database=getenv('DATABASE'),
+            allow_local_infile_in_path=INFILE_DIRECTORY,
+        )
+    storage.open()
+    return storage
+
+
+def report(verb: str, rows: int, total: int, began: float) -> None:
+    elapsed = time.perf_counter() - began
+    print(f"{total} rows {verb} ({rows / elapsed if elapsed else 0:.0f} rows/sec)")
+
+
+def format_rows(rows: list, fmt: str) -> str:
+    if fmt == 'csv':
+        return ''.join(f"{sensor_id},{moment.isoformat(' ')},{round(temp, 4)}\n" for _, sensor_id, moment, temp in rows)
+    return ''.join(
+        json.dumps({'sensor_id': sensor_id, 'time': moment.isoformat(' '), 'temp': round(temp, 4)}) + '\n'
+        for _, sensor_id, moment, temp in rows
+    )
+
+
+def save_json(path: str, data: dict) -> None:
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def export_readings(storage: Storage, path: str, since: datetime = None, until: datetime = None,
+                    sensors: list = None, chunk: int = CHUNK_ROWS, restart: bool = False) -> None:
+    """
+    Writes the readings matching the filters to path in id order, chunk by chunk. A compressed file gets one gzip
+    member per chunk. After every chunk the file is synced and the last exported id and the file size are saved to
+    path + '.progress'; a new run with the same filters cuts the file back to that size and continues after the id.
+    """
+    fmt, compressed = file_format(path)
+    progress_path = path + '.progress'
+    filters = {
+        'since': since.isoformat(' ') if since else None,
+        'until': until.isoformat(' ') if until else None,
+        'sensors': sorted(sensors) if sensors else None,
+    }
+
+    progress = None
+    if not restart and os.path.exists(progress_path) and os.path.exists(path):
+        with open(progress_path) as f:
+            progress = json.load(f)
+        if progress['filters'] != filters:
+            raise ValueError(f"{path} was started with other filters {progress['filters']}, use --restart")
+
+    sql = "SELECT id, sensor_id, time, temp FROM temp_data WHERE id > %s"
+    params = []
+    if since is not None:
+        sql += " AND time >= %s"
+        params.append(since)
+    if until is not None:
+        sql += " AND time < %s"
+        params.append(until)
+    if sensors:
+        sql += f" AND sensor_id IN ({', '.join(['%s'] * len(sensors))})"
+        params.extend(sensors)
+    sql += " ORDER BY id LIMIT %s"
+
+    def encode(text: str) -> bytes:
+        return gzip.compress(text.encode(), compresslevel=6) if compressed else text.encode()
+
+    with open(path, 'r+b' if progress else 'wb') as f:
+        if progress:
+            last_id, total = progress['last_id'], progress['rows']
+            f.truncate(progress['bytes'])
+            f.seek(progress['bytes'])
+            print(f"Resuming {path} after {total} rows")
+        else:
+            last_id, total = 0, 0
+            if fmt == 'csv':
+                f.write(encode(','.join(COLUMNS) + '\n'))
+
+        rows_written = 0
+        began = time.perf_counter()
+        while True:
+            with storage.session() as session:
+                rows = session.query(sql, (last_id, *params, chunk))
+            if not rows:
+                break
+            f.write(encode(format_rows(rows, fmt)))
+            f.flush()
+            os.fsync(f.fileno())
+            last_id = rows[-1][0]
+            rows_written += len(rows)
+            total += len(rows)
+            save_json(progress_path, {'filters': filters, 'last_id': last_id, 'bytes': f.tell(), 'rows': total})
+            report('exported', rows_written, total, began)
+
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    print(f"Exported {total} rows to {path} in {time.perf_counter() - began:.1f} s")
+
+
+def parse_time(value: str) -> datetime:
+    moment = datetime.fromisoformat(value)
+    # temp_data holds local times, like the collector writes them
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def read_records(path: str) -> Iterator[tuple]:
+    """
+    Yields the readings of a file as (temp, time, sensor_id) rows. CSV files need a header naming the sensor_id, time
+    and temp columns, other columns are ignored.
+    """
+    fmt, compressed = file_format(path)
+    with (gzip.open(path, 'rt', newline='') if compressed else open(path, newline='')) as f:
+        if fmt == 'csv':
+            reader = csv.reader(f)
+            header = next(reader, [])
+            missing = [column for column in COLUMNS if column not in header]
+            if missing:
+                raise ValueError(f"{path} has no {', '.join(missing)} column")
+            sensor_column, time_column, temp_column = (header.index(column) for column in COLUMNS)
+            for row in reader:
+                if not row:
+                    continue
+                try:
+                    yield float(row[temp_column]), parse_time(row[time_column]), int(row[sensor_column])
+                except (ValueError, IndexError) as e:
+                    raise ValueError(f"{path} line {reader.line_num}: {e}") from e
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    yield float(record['temp']), parse_time(record['time']), int(record['sensor_id'])
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{path} line {line_number}: {e!r}") from e
+
+
+def chunks(records: Iterator[tuple], size: int, skip: int = 0) -> Iterator[list]:
+    records = islice(records, skip, None)
+    while True:
+        rows = list(islice(records, size))
+        if not rows:
+            return
+        yield rows
+
+
+def create_tables(cursor, dialect: str = 'mysql') -> None:
+    cursor.execute(CREATE_PROGRESS_TABLE + (MYSQL_TABLE_OPTIONS if dialect == 'mysql' else ''))
+
+
+def existing_indexes(session) -> set:
+    session.cursor.execute(SELECT_INDEXES[session.dialect])
+    return {name for name, in session.cursor.fetchall()} & set(INDEXES)
+
+
+def drop_indexes(session) -> None:
+    present = sorted(existing_indexes(session))
+    if not present:
+        return
+    print(f"Dropping index {', '.join(present)} until the import is done")
+    if session.dialect == 'mysql':
+        session.cursor.execute("ALTER TABLE temp_data " + ", ".join(f"DROP INDEX {name}" for name in present))
+    else:
+        for name in present:
+            session.cursor.execute(f"DROP INDEX {name}")
+    session.commit()
+
+
+def add_indexes(session) -> None:
+    missing = sorted(set(INDEXES) - existing_indexes(session))
+    if not missing:
+        return
+    print(f"Building index {', '.join(missing)}, this can take a while on big tables...")
+    if session.dialect == 'mysql':
+        session.cursor.execute(
+            "ALTER TABLE temp_data " + ", ".join(f"ADD INDEX {name} {INDEXES[name]}" for name in missing)
+            + ", ALGORITHM=INPLACE, LOCK=NONE"
+        )
+    else:
+        for statement in SQLITE_SCHEMA:
+            if 'CREATE INDEX' in statement:
+                session.cursor.execute(statement)
+    session.commit()
+
+
+def load_chunk(session, rows: list) -> None:
+    """
+    Writes a chunk to a file in INFILE_DIRECTORY and has the server load it with LOAD DATA LOCAL INFILE.
+    """
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=INFILE_DIRECTORY)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(''.join(f"{temp},{moment.isoformat(' ')},{sensor_id}\n" for temp, moment, sensor_id in rows))
+        session.cursor.execute(LOAD_CHUNK, (path,))
+        # LOAD DATA LOCAL turns bad values into warnings, a chunk is only committed if every row went in unchanged
+        if session.cursor.rowcount != len(rows) or session.cursor.warning_count:
+            raise ValueError(f"LOAD DATA stored {session.cursor.rowcount} of {len(rows)} rows with "
+                             f"{session.cursor.warning_count} warnings, check the file")
+    finally:
+        os.remove(path)
+
+
+def note_ranges(ranges: dict, rows: list) -> None:
+    """
+    Widens the imported time range of every sensor of the chunk, kept as ISO strings by sensor id.
+    """
+    bounds = {}
+    for _, moment, sensor_id in rows:
+        first, last = bounds.get(sensor_id, (moment, moment))
+        bounds[sensor_id] = (min(first, moment), max(last, moment))
+    for sensor_id, (first, last) in bounds.items():
+        key = str(sensor_id)
+        if key in ranges:
+            first = min(first, datetime.fromisoformat(ranges[key][0]))
+            last = max(last, datetime.fromisoformat(ranges[key][1]))
+        ranges[key] = [first.isoformat(' '), last.isoformat(' ')]
+
+
+def rebuild_rollups(storage: Storage, ranges: dict, days: int = 7) -> None:
+    """
+    Recomputes the rollups over the imported range of every sensor, `days` days per transaction.
+    """
+    step = timedelta(days=days)
+    for key, (first, last) in sorted(ranges.items()):
+        start = rollups.floor_time(datetime.fromisoformat(first), rollups.DAY)
+        last = datetime.fromisoformat(last)
+        while start <= last:
+            with storage.session() as session:
+                rollups.rebuild(session.cursor, [(int(key), start, start + step)], session.dialect)
+                session.commit()
+            start += step
+        print(f"Rollups of sensor {key} rebuilt")
+
+
+def import_readings(storage: Storage, path: str, method: str = 'auto', indexes: str = 'auto',
+                    chunk: int = CHUNK_ROWS, rebuild: bool = True, restart: bool = False) -> None:
+    """
+    Appends the readings of a file to temp_data, one transaction per chunk. The rows committed so far are recorded
+    in transfer_progress in the same transaction, keyed by file name and size, so a new run of the same file skips
+    them and nothing is imported twice. `method` is load-data, insert (multi-row INSERTs) or auto (load-data on
+    MySQL if the server allows it). `indexes` defer drops the secondary indexes and builds them once at the end,
+    auto does so only if temp_data was empty when the import started; a resumed import keeps that decision. If the
+    import stops early the indexes are built again before the error is passed on, the collector does not run
+    without them until the next run.
+    """
+    source = f"{os.path.basename(path)}:{os.path.getsize(path)}"[-255:]
+    file_format(path)
+
+    with storage.session() as session:
+        dialect = session.dialect
+        create_tables(session.cursor, dialect)
+        session.cursor.execute(SELECT_PROGRESS, (source,))
+        progress = session.cursor.fetchall()
+        session.cursor.execute("SELECT 1 FROM temp_data LIMIT 1")
+        empty = not session.cursor.fetchall()
+        session.commit()
+
+    rows_done, ranges, finished, deferred = (0, {}, 0, int(empty))
+    if progress and not restart:
+        rows_done, ranges, finished, deferred = progress[0]
+        ranges = json.loads(ranges or '{}')
+    if finished:
+        print(f"{path} was imported already ({rows_done} rows), use --restart to import it again")
+        return
+    if rows_done:
+        print(f"Resuming {path} after {rows_done} rows")
+    if method == 'load-data' and dialect != 'mysql':
+        raise ValueError("LOAD DATA needs MySQL, use --method insert")
+    use_load = method != 'insert' and dialect == 'mysql'
+    if indexes != 'auto':
+        deferred = int(indexes == 'defer')
+
+    began = time.perf_counter()
+    rows_imported = 0
+
+    def import_chunk(session, rows: list) -> None:
+        nonlocal use_load, rows_done, rows_imported
+        if use_load:
+            try:
+                load_chunk(session, rows)
+            except Error as e:
+                if method == 'load-data' or e.errno not in LOCAL_INFILE_ERRORS:
+                    raise
+                session.rollback()
+                print(f"LOAD DATA LOCAL INFILE is not allowed ({e.msg}), importing with multi-row INSERTs")
+                use_load = False
+        if not use_load:
+            session.insert_many(rows)
+
+        rows_done += len(rows)
+        rows_imported += len(rows)
+        note_ranges(ranges, rows)
+        session.cursor.execute(UPSERT_PROGRESS[dialect], (source, rows_done, json.dumps(ranges), 0, deferred))
+        session.commit()
+        report('imported', rows_imported, rows_done, began)
+
+    with storage.session() as session:
+        if deferred:
+            drop_indexes(session)
+
+        try:
+            for rows in chunks(read_records(path), chunk, rows_done):
+                import_chunk(session, rows)
+        except BaseException:
+            # A broken file or an interrupted run may take a while to resume, the collector should not wait for
+            # that without its indexes
+            try:
+                session.rollback()
+                add_indexes(session)
+            except database_errors() as e:
+                print(f"Could not build the indexes again ({e}), the next run of the import does")
+            raise
+
+        add_indexes(session)
+
+    if rebuild and ranges:
+        print("Rebuilding the rollups of the imported range...")
+        rebuild_rollups(storage, ranges)
+
+    with storage.session() as session:
+        session.cursor.execute(UPSERT_PROGRESS[dialect], (source, rows_done, json.dumps(ranges), 1, deferred))
+        session.commit()
+    elapsed = time.perf_counter() - began
+    print(f"Imported {rows_imported} rows from {path} in {elapsed:.1f} s "
+          f"({rows_imported / elapsed if elapsed else 0:.0f} rows/sec including indexes and rollups)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ESPTempMonitor bulk import and export of temp_data")
+    parser.add_argument("--sqlite", help="SQLite database file instead of the MySQL database from .env")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="write readings to a .csv/.ndjson file, .gz compresses")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--since", type=datetime.fromisoformat, help="only readings from this time on")
+    export_parser.add_argument("--until", type=datetime.fromisoformat, help="only readings before this time")
+    export_parser.add_argument("--sensor", type=int, nargs="+", dest="sensors", help="only these sensor ids")
+    export_parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="rows per chunk")
+    export_parser.add_argument("--restart", action="store_true", help="start over instead of resuming")
+
+    import_parser = commands.add_parser("import", help="append the readings of a .csv/.ndjson(.gz) file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--method", choices=("auto", "load-data", "insert"), default="auto",
+                               help="LOAD DATA LOCAL INFILE or multi-row INSERTs, auto tries LOAD DATA first")
+    import_parser.add_argument("--indexes", choices=("auto", "defer", "keep"), default="auto",
+                               help="drop the secondary indexes until the end, auto does if temp_data is empty")
+    import_parser.add_argument("--no-rollups", action="store_true", help="skip rebuilding the rollup tables")
+    import_parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="rows per transaction")
+    import_parser.add_argument("--restart", action="store_true", help="import the whole file again")
+
+    args = parser.parse_args()
+    try:
+        database = open_storage(args.sqlite)
+    except database_errors() as e:
+        print(f"Error connecting to the database: {e}")
+        sys.exit(1)
+
+    try:
+        if args.command == "export":
+            export_readings(database, args.path, args.since, args.until, args.sensors, max(1, args.chunk),
+                            args.restart)
+        elif args.command == "import":
+            import_readings(database, args.path, args.method, args.indexes, max(1, args.chunk), not args.no_rollups,
+                            args.restart)
+    except ValueError as e:
+        print(f"Transfer stopped: {e}")
+        sys.exit(1)
+    except (OSError, *database_errors()) as e:
+        print(f"Transfer stopped: {e}")
+        print("Run the same command again to continue where it stopped")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to continue where it stopped")
+        sys.exit(1)